@@ -0,0 +1,201 @@
+import asyncio
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from src.compression import decompress_span
+from src.raid6 import RAID6
+
+
+class _AsyncRWLock(object):
+    '''
+    Reader/writer lock for coroutines, a waiting writer blocks the new readers.
+    '''
+    def __init__(self):
+        self._cond = asyncio.Condition()
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    async def acquire_read(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: not self._writer and self._waiting_writers == 0)
+            self._readers += 1
+
+    async def release_read(self):
+        async with self._cond:
+            self._readers -= 1
+            if self._readers == 0:
+                self._cond.notify_all()
+
+    async def acquire_write(self):
+        async with self._cond:
+            self._waiting_writers += 1
+            await self._cond.wait_for(lambda: not self._writer and self._readers == 0)
+            self._waiting_writers -= 1
+            self._writer = True
+
+    async def release_write(self):
+        async with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+
+
+class AsyncRAID6(object):
+    '''
+    asyncio front-end of the RAID6 system.
+    The allocation, the stripe writes, stripe reads and parity kernels run in the executor, nothing on the
+    event loop waits for a RAID6 lock. Each stripe has a coroutine lock on top of the RAID6 stripe locks, so waiting operations do not
+    hold executor threads and operations on different stripes run in parallel.
+    At most max_in_flight operations are admitted at once, the others wait for a slot.
+    '''
+    def __init__(self, raid6: RAID6, max_in_flight: int = 16, executor: ThreadPoolExecutor = None):
+        self.raid6 = raid6
+        self.max_in_flight = max_in_flight
+        self._own_executor = executor is None
+        self.executor = executor if executor is not None else ThreadPoolExecutor(max_workers=raid6.stripe_width * 2)
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._stripe_locks = defaultdict(asyncio.Lock)
+        # modify_data allocates and writes through the RAID6 internals at once, it runs alone
+        self._array_lock = _AsyncRWLock()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        '''
+        Shut down the executor if it is owned by the front-end.
+        '''
+        if self._own_executor:
+            self.executor.shutdown(wait=True)
+
+    async def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, partial(func, *args, **kwargs))
+
+    async def _locked_stripe(self, stripe_idx: int, func, *args, **kwargs):
+        async with self._stripe_locks[stripe_idx]:
+            return await self._run(func, *args, **kwargs)
+
+    async def _lock_stripes(self, stripe_idxs):
+        # Always lock in ascending order to avoid dead locks between operations
+        for stripe_idx in sorted(stripe_idxs):
+            await self._stripe_locks[stripe_idx].acquire()
+
+    def _unlock_stripes(self, stripe_idxs):
+        for stripe_idx in stripe_idxs:
+            self._stripe_locks[stripe_idx].release()
+
+    @staticmethod
+    def _read_file(path: str):
+        with open(path, "rb") as f:
+            return f.read()
+
+    @staticmethod
+    def _write_file(path: str, data: bytearray):
+        with open(path, "wb") as f:
+            f.write(data)
+
+    async def save_data(self, data_path: str, name: str = None, compression: str = None):
+        '''
+        Save data to the RAID6 system.
+        '''
+        data = await self._run(self._read_file, data_path)
+        return await self.save_bytes(data, name, compression)
+
+    async def save_bytes(self, data: bytes, name: str, compression: str = None):
+        '''
+        Save an in-memory object to the RAID6 system, like RAID6.save_data.
+        The stripes of a stored file are written in parallel, a deduplicated file is saved in one executor call.
+        '''
+        async with self._slots:
+            await self._array_lock.acquire_read()
+            try:
+                if self.raid6.dedup is not None:
+                    await self._run(self.raid6._save_dedup, data, name)
+                    return
+                info, data = await self._run(self.raid6._compress, data, compression)
+                stripe2data = await self._run(self.raid6._allocate_stripes, data)
+                stripe_idxs = list(stripe2data.keys())
+                offset_lists = await asyncio.gather(*[
+                    self._locked_stripe(stripe_idx, self.raid6._distribute_stripe, stripe_idx, stripe2data[stripe_idx], name)
+                    for stripe_idx in stripe_idxs
+                ])
+                await self._run(self.raid6._replace_file, name, stripe_info=dict(zip(stripe_idxs, offset_lists)), info=info)
+            finally:
+                await self._array_lock.release_read()
+        self.raid6.logger.info(f"Data saved to RAID6 system successfully")
+
+    async def read_range(self, name: str, offset: int, size: int, verify=False):
+        '''
+        Read size bytes of a file starting from offset, the stripes are read in parallel.
+        '''
+        info = self.raid6.compressed.get(name)
+        if info is not None:
+            if offset >= info.size or size <= 0:
+                return b""
+            _, _, start, end = info.span(offset, size)
+            stored = await self._read_stored(name, start, end - start, verify)
+            return await self._run(decompress_span, info, stored, offset, size, self.raid6.compress_executor)
+        return await self._read_stored(name, offset, size, verify)
+
+    async def _read_stored(self, name: str, offset: int, size: int, verify=False):
+        '''
+        Read size bytes of the stored bytes of a file starting from offset.
+        '''
+        async with self._slots:
+            await self._array_lock.acquire_read()
+            try:
+                stripe2range = await self._run(self.raid6._range_to_offset_lists, name, offset, size)
+                pieces = await asyncio.gather(*[
+                    self._locked_stripe(stripe_idx, self.raid6._read_stripe, stripe_idx, offset_list, verify=verify)
+                    for stripe_idx, offset_list in stripe2range
+                ])
+            finally:
+                await self._array_lock.release_read()
+        return b"".join(pieces)
+
+    async def load_data(self, name: str, out_path: str = None, verify=False):
+        '''
+        Load a whole file from the RAID6 system, it is written to out_path if given and returned.
+        '''
+        file_size = await self._run(self.raid6.get_file_size, name)
+        data = await self.read_range(name, 0, file_size, verify=verify)
+        if out_path is not None:
+            await self._run(self._write_file, out_path, data)
+        return data
+
+    def _file_stripes(self, name: str):
+        with self.raid6._alloc_lock:
+            return list(self.raid6.file2stripe.get(name, {}).keys())
+
+    async def delete_data(self, file_name: str):
+        '''
+        Delete data from the RAID6 system.
+        '''
+        async with self._slots:
+            await self._array_lock.acquire_read()
+            try:
+                stripe_idxs = await self._run(self._file_stripes, file_name)
+                await self._lock_stripes(stripe_idxs)
+                try:
+                    return await self._run(self.raid6.delete_data, file_name)
+                finally:
+                    self._unlock_stripes(stripe_idxs)
+            finally:
+                await self._array_lock.release_read()
+
+    async def modify_data(self, file_name: str, rewrite_name: str, data_path: str):
+        '''
+        Modify the data in the RAID6 system.
+        The modification reuses the stripes of the file and spills into new ones, so it waits for the
+        in-flight operations to finish and runs alone.
+        '''
+        async with self._slots:
+            await self._array_lock.acquire_write()
+            try:
+                return await self._run(self.raid6.modify_data, file_name, rewrite_name, data_path)
+            finally:
+                await self._array_lock.release_write()
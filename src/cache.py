@@ -0,0 +1,273 @@
+'''
+Cache tier of the RAID6 system in a local file on a fast device.
+The cache file holds whole stripes of data (lines) after an index of one (stripe idx, dirty) record per line.
+A read of a cached stripe does not touch the array, an overwrite of a cached stripe only updates its line and
+marks it dirty. A dirty line is written back (destaged) to the array as a full stripe with one parity computation,
+by flush_cache or a CacheFlusher, and before any other write path or raw read touches the stripe.
+The missed stripes are admitted with TinyLFU: a stripe only replaces the least recently used clean line if it was
+accessed more often recently, by the estimate of a count-min sketch with periodic aging.
+'''
+import os
+import struct
+import threading
+from collections import OrderedDict
+import numpy as np
+from src.qos import BACKGROUND, io_class
+
+RECORD = struct.Struct("<qq") # stripe idx, dirty; the record before the lines is (stripe size, lines)
+ALIGN = 4096
+SEEDS = [0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9, 0x27D4EB2F165667C5]
+
+
+class FrequencySketch:
+    '''
+    Count-min sketch of the access frequency of the stripes, 4 rows of counters capped at 15.
+    All the counters are halved every sample_size accesses, so the old popularity fades.
+    '''
+    def __init__(self, capacity: int):
+        width = 1 << max(4, (8 * capacity - 1).bit_length())
+        self.mask = width - 1
+        self.table = np.zeros((len(SEEDS), width), dtype=np.uint8)
+        self.sample_size = 10 * capacity
+        self.additions = 0
+
+    def _indexes(self, key: int):
+        return [(((key + 1) * seed) & 0xFFFFFFFFFFFFFFFF) >> 32 & self.mask for seed in SEEDS]
+
+    def increment(self, key: int):
+        for row, idx in enumerate(self._indexes(key)):
+            if self.table[row, idx] < 15:
+                self.table[row, idx] += 1
+        self.additions += 1
+        if self.additions >= self.sample_size:
+            self.table >>= 1
+            self.additions //= 2
+
+    def estimate(self, key: int):
+        return min(int(self.table[row, idx]) for row, idx in enumerate(self._indexes(key)))
+
+
+class StripeCache:
+    '''
+    Stripe lines in a local cache file with a persistent index of the dirty lines.
+    A line becomes dirty only after its data is synced, and is recorded clean only after it is destaged,
+    so the dirty lines found when the file is opened again are the writes the array misses.
+    The clean lines are dropped on open, the array may have changed while the cache was detached.
+    destage(stripe idx, stripe data) writes a full stripe to the array, the caller holds the stripe lock.
+    '''
+    def __init__(self, path: str, size: int, stripe_size: int, destage, admit_min: int = 2):
+        self.path = path
+        self.stripe_size = stripe_size
+        self.destage = destage
+        self.admit_min = admit_min
+        self.lines_num = size // stripe_size
+        if self.lines_num == 0:
+            raise ValueError("The cache cannot hold one stripe")
+        self.data_offset = -(-(self.lines_num + 1) * RECORD.size // ALIGN) * ALIGN
+
+        self.stripes = np.full(self.lines_num, -1, dtype=np.int64) # stripe idx of each line
+        self.dirty = np.zeros(self.lines_num, dtype=bool)
+        self.lines = OrderedDict() # stripe idx -> line, least recently used first
+        self.sketch = FrequencySketch(self.lines_num)
+        self.hits = 0
+        self.misses = 0
+        self.destaged = 0
+        self._destaging = set()
+        self._lock = threading.RLock()
+        self._open()
+        self.free = [line for line in range(self.lines_num - 1, -1, -1) if self.stripes[line] < 0]
+
+    def _open(self):
+        '''
+        Load the dirty lines of an existing cache file of the same geometry, or format a new one.
+        '''
+        file_size = self.data_offset + self.lines_num * self.stripe_size
+        if os.path.exists(self.path) and os.path.getsize(self.path) == file_size:
+            self._fd = os.open(self.path, os.O_RDWR)
+            index = os.pread(self._fd, (self.lines_num + 1) * RECORD.size, 0)
+            if RECORD.unpack_from(index, 0) == (self.stripe_size, self.lines_num):
+                for line in range(self.lines_num):
+                    stripe_idx, dirty = RECORD.unpack_from(index, (line + 1) * RECORD.size)
+                    if dirty:
+                        self.stripes[line] = stripe_idx
+                        self.dirty[line] = True
+                        self.lines[stripe_idx] = line
+                return
+            os.close(self._fd)
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_TRUNC)
+        os.ftruncate(self._fd, file_size)
+        os.pwrite(self._fd, RECORD.pack(self.stripe_size, self.lines_num), 0)
+        os.fsync(self._fd)
+
+    def _record(self, line: int, stripe_idx: int, dirty: bool):
+        os.pwrite(self._fd, RECORD.pack(stripe_idx, int(dirty)), (line + 1) * RECORD.size)
+        os.fsync(self._fd)
+
+    def _line_offset(self, line: int):
+        return self.data_offset + line * self.stripe_size
+
+    def read(self, stripe_idx: int, offset_list: list):
+        '''
+        Read the (offset, size) pieces of a cached stripe, None on a miss.
+        '''
+        with self._lock:
+            self.sketch.increment(stripe_idx)
+            line = self.lines.get(stripe_idx)
+            if line is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.lines.move_to_end(stripe_idx)
+            base = self._line_offset(line)
+            return bytearray(b"".join(os.pread(self._fd, size, base + offset) for offset, size in offset_list))
+
+    def _victim(self):
+        for stripe_idx, line in self.lines.items():
+            if not self.dirty[line]:
+                return stripe_idx
+        return None
+
+    def wants(self, stripe_idx: int):
+        '''
+        Check if a missed stripe would be admitted.
+        '''
+        with self._lock:
+            if stripe_idx in self.lines:
+                return False
+            frequency = self.sketch.estimate(stripe_idx)
+            if len(self.free) > 0:
+                return frequency >= self.admit_min
+            victim = self._victim()
+            return victim is not None and frequency > self.sketch.estimate(victim)
+
+    def fill(self, stripe_idx: int, stripe_data):
+        '''
+        Admit a stripe with its whole data, a clean victim is evicted if the cache is full.
+        '''
+        with self._lock:
+            if not self.wants(stripe_idx):
+                return False
+            if len(self.free) == 0:
+                victim = self._victim()
+                line = self.lines.pop(victim)
+                self.stripes[line] = -1
+                self.free.append(line)
+            line = self.free.pop()
+            os.pwrite(self._fd, stripe_data, self._line_offset(line))
+            self.stripes[line] = stripe_idx
+            self.lines[stripe_idx] = line
+            return True
+
+    def write(self, stripe_idx: int, offset_list: list, data):
+        '''
+        Write the (offset, size) pieces of a cached stripe and mark it dirty, return False on a miss.
+        '''
+        with self._lock:
+            self.sketch.increment(stripe_idx)
+            line = self.lines.get(stripe_idx)
+            if line is None or stripe_idx in self._destaging:
+                return False
+            self.lines.move_to_end(stripe_idx)
+            base = self._line_offset(line)
+            data_offset = 0
+            for offset, size in offset_list:
+                os.pwrite(self._fd, data[data_offset : data_offset + size], base + offset)
+                data_offset += size
+            os.fsync(self._fd)
+            if not self.dirty[line]:
+                self._record(line, stripe_idx, True)
+                self.dirty[line] = True
+            return True
+
+    def _destage(self, stripe_idx: int, line: int):
+        self._destaging.add(stripe_idx)
+        try:
+            self.destage(stripe_idx, os.pread(self._fd, self.stripe_size, self._line_offset(line)))
+        finally:
+            self._destaging.discard(stripe_idx)
+        self._record(line, stripe_idx, False)
+        self.dirty[line] = False
+        self.destaged += 1
+
+    def clean(self, stripe_idx: int):
+        '''
+        Write a dirty stripe back to the array, it stays cached. The caller holds the stripe lock.
+        '''
+        with self._lock:
+            line = self.lines.get(stripe_idx)
+            if line is not None and self.dirty[line] and stripe_idx not in self._destaging:
+                self._destage(stripe_idx, line)
+
+    def invalidate(self, stripe_idx: int):
+        '''
+        Drop a stripe before the array is written, a dirty stripe is written back first.
+        The caller holds the stripe lock.
+        '''
+        with self._lock:
+            line = self.lines.get(stripe_idx)
+            if line is None or stripe_idx in self._destaging:
+                return
+            if self.dirty[line]:
+                self._destage(stripe_idx, line)
+            del self.lines[stripe_idx]
+            self.stripes[line] = -1
+            self.free.append(line)
+
+    def dirty_stripes(self):
+        with self._lock:
+            return [stripe_idx for stripe_idx, line in self.lines.items() if self.dirty[line]]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "lines": self.lines_num,
+                "cached": len(self.lines),
+                "dirty": int(self.dirty.sum()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "destaged": self.destaged,
+            }
+
+    def close(self):
+        with self._lock:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+
+
+class CacheFlusher(object):
+    '''
+    Background write-back of the dirty lines of the cache tier of a RAID6 system every interval seconds.
+    The write-back runs in the background I/O class.
+    '''
+    def __init__(self, raid6, interval: float = 1.0):
+        self.raid6 = raid6
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            with io_class(BACKGROUND):
+                self.raid6.flush_cache()
+            self._stop.wait(self.interval)
+
+    def start(self):
+        '''
+        Start writing back in a background thread.
+        '''
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="raid6-cache-flusher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        '''
+        Stop the background thread after its current pass.
+        '''
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
@@ -1,5 +1,7 @@
 #include "parity.h"
 #include "galois_field.h"
+#include <algorithm>
+#include <cstring>
 
 static GaloisField gf = GaloisField();
 
@@ -7,6 +9,7 @@ void cal_parity(py::buffer p, py::buffer q, py::buffer data) {
     py::buffer_info p_info = p.request();
     py::buffer_info q_info = q.request();
     py::buffer_info data_info = data.request();
+    py::gil_scoped_release release;
 
     auto p_ptr = static_cast<uint8_t *>(p_info.ptr);
     auto q_ptr = static_cast<uint8_t *>(q_info.ptr);
@@ -42,6 +45,7 @@ void cal_parity_8(py::buffer p, py::buffer q, py::buffer data) {
     py::buffer_info p_info = p.request();
     py::buffer_info q_info = q.request();
     py::buffer_info data_info = data.request();
+    py::gil_scoped_release release;
 
     auto p_ptr = static_cast<uint64_t *>(p_info.ptr);
     auto q_ptr = static_cast<uint64_t *>(q_info.ptr);
@@ -75,9 +79,63 @@ void cal_parity_8(py::buffer p, py::buffer q, py::buffer data) {
     }
 }
 
+// Only the blocks present in the mask are read, an absent block counts as zero
+void cal_parity_8_mask(py::buffer p, py::buffer q, py::buffer data, std::vector<int> mask) {
+    py::buffer_info p_info = p.request();
+    py::buffer_info q_info = q.request();
+    py::buffer_info data_info = data.request();
+    py::gil_scoped_release release;
+
+    auto p_ptr = static_cast<uint64_t *>(p_info.ptr);
+    auto q_ptr = static_cast<uint64_t *>(q_info.ptr);
+    auto data_ptr = static_cast<uint64_t *>(data_info.ptr);
+
+    int block_size = p_info.shape[0] / 8;
+    int width = data_info.shape[0] / p_info.shape[0];
+
+    // Horner's rule starts from the highest present block
+    int top = width - 1;
+    while (top >= 0 && !mask[top]) { top--; }
+    if (top < 0) {
+        memset(p_ptr, 0, block_size * sizeof(uint64_t));
+        memset(q_ptr, 0, block_size * sizeof(uint64_t));
+        return;
+    }
+    memcpy(q_ptr, data_ptr + top * block_size, block_size * sizeof(uint64_t));
+    memcpy(p_ptr, data_ptr + top * block_size, block_size * sizeof(uint64_t));
+
+    for (int i = top - 1; i >= 0; i--) {
+        int base = i * block_size;
+        int j = 0;
+        if (!mask[i]) {
+            // An absent block only multiplies Q by g
+            for (j = 0; j < block_size; j++) {
+                q_ptr[j] = gf.mult2(q_ptr[j]);
+            }
+            continue;
+        }
+        for (j = 0; j < block_size - 3; j += 4) {
+            p_ptr[j] = gf.add(p_ptr[j], data_ptr[base + j]);
+            p_ptr[j + 1] = gf.add(p_ptr[j + 1], data_ptr[base + j + 1]);
+            p_ptr[j + 2] = gf.add(p_ptr[j + 2], data_ptr[base + j + 2]);
+            p_ptr[j + 3] = gf.add(p_ptr[j + 3], data_ptr[base + j + 3]);
+
+            q_ptr[j] = gf.add(gf.mult2(q_ptr[j]), data_ptr[base + j]);
+            q_ptr[j + 1] = gf.add(gf.mult2(q_ptr[j + 1]), data_ptr[base + j + 1]);
+            q_ptr[j + 2] = gf.add(gf.mult2(q_ptr[j + 2]), data_ptr[base + j + 2]);
+            q_ptr[j + 3] = gf.add(gf.mult2(q_ptr[j + 3]), data_ptr[base + j + 3]);
+        }
+        for (; j < block_size; j++) {
+            p_ptr[j] = gf.add(p_ptr[j], data_ptr[base + j]);
+            q_ptr[j] = gf.add(gf.mult2(q_ptr[j]), data_ptr[base + j]);
+        }
+    }
+}
+
 void cal_parity_p(py::buffer p, py::buffer data) {
     py::buffer_info p_info = p.request();
     py::buffer_info data_info = data.request();
+    py::gil_scoped_release release;
 
     auto p_ptr = static_cast<uint64_t *>(p_info.ptr);
     auto data_ptr = static_cast<uint64_t *>(data_info.ptr);
@@ -103,6 +161,7 @@ void cal_parity_p(py::buffer p, py::buffer data) {
 void cal_parity_q(py::buffer q, py::buffer data, std::vector<int> idxs) {
     py::buffer_info q_info = q.request();
     py::buffer_info data_info = data.request();
+    py::gil_scoped_release release;
 
     auto q_ptr = static_cast<uint8_t *>(q_info.ptr);
     auto data_ptr = static_cast<uint8_t *>(data_info.ptr);
@@ -129,6 +188,7 @@ void cal_parity_q(py::buffer q, py::buffer data, std::vector<int> idxs) {
 void cal_parity_q_8(py::buffer q, py::buffer data) {
     py::buffer_info q_info = q.request();
     py::buffer_info data_info = data.request();
+    py::gil_scoped_release release;
 
     auto q_ptr = static_cast<uint64_t *>(q_info.ptr);
     auto data_ptr = static_cast<uint64_t *>(data_info.ptr);
@@ -158,6 +218,7 @@ void q_recover_data(py::buffer data, py::buffer q, py::buffer inter_q, int idx)
     py::buffer_info q_info = q.request();
     py::buffer_info inter_q_info = inter_q.request();
     py::buffer_info data_info = data.request();
+    py::gil_scoped_release release;
 
     auto q_ptr = static_cast<uint8_t *>(q_info.ptr);
     auto inter_q_ptr = static_cast<uint8_t *>(inter_q_info.ptr);
@@ -188,6 +249,7 @@ void recover_data_data(py::buffer data1, py::buffer data2,
     py::buffer_info inter_p_info = inter_p.request();
     py::buffer_info q_info = q.request();
     py::buffer_info inter_q_info = inter_q.request();
+    py::gil_scoped_release release;
 
     auto data1_ptr = static_cast<uint8_t *>(data1_info.ptr);
     auto data2_ptr = static_cast<uint8_t *>(data2_info.ptr);
@@ -227,10 +289,99 @@ void recover_data_data(py::buffer data1, py::buffer data2,
     }
 }
 
+// Columns of a stripe reconstructed at once, the syndromes of a tile stay in the L1 cache
+static const int TILE_LANES = 512;
+
+// Rebuild the data blocks idx1 < idx2 of a batch of stripes sharing the erasure pattern.
+// data[k] holds the width - 2 surviving blocks of stripe k in order, the blocks of a stripe may have any size.
+// The syndromes P + Pxy and Q + Qxy of a tile are accumulated in one pass over the surviving blocks, with
+// Horner's rule on uint64 lanes for Q, then both blocks are solved with multiplication tables built once.
+void recover_data_data_batch(std::vector<py::buffer> data1, std::vector<py::buffer> data2,
+                             std::vector<py::buffer> p, std::vector<py::buffer> q,
+                             std::vector<py::buffer> data, int width, int idx1, int idx2) {
+    std::vector<py::buffer_info> data1_info, data2_info, p_info, q_info, data_info;
+    for (size_t k = 0; k < data.size(); k++) {
+        data1_info.push_back(data1[k].request());
+        data2_info.push_back(data2[k].request());
+        p_info.push_back(p[k].request());
+        q_info.push_back(q[k].request());
+        data_info.push_back(data[k].request());
+    }
+    py::gil_scoped_release release;
+
+    // d1 = a * (P + Pxy) + b * (Q + Qxy), d2 = (P + Pxy) + d1
+    std::vector<uint8_t> gfilog = gf.get_gfilog();
+    uint8_t g1 = gfilog[idx2 - idx1];
+    uint8_t g2 = gf.divide(1, gfilog[idx1]);
+    uint8_t a = gf.divide(g1, gf.add(g1, 1));
+    uint8_t b = gf.divide(g2, gf.add(g1, 1));
+    uint8_t mult_a[256], mult_b[256];
+    for (int x = 0; x < 256; x++) {
+        mult_a[x] = gf.multiply(x, a);
+        mult_b[x] = gf.multiply(x, b);
+    }
+
+    uint64_t acc_p[TILE_LANES], acc_q[TILE_LANES];
+    for (size_t k = 0; k < data.size(); k++) {
+        int size = p_info[k].shape[0];
+        int lanes = size / 8;
+        auto data_ptr = static_cast<uint8_t *>(data_info[k].ptr);
+        auto p_ptr = static_cast<uint8_t *>(p_info[k].ptr);
+        auto q_ptr = static_cast<uint8_t *>(q_info[k].ptr);
+        auto data1_ptr = static_cast<uint8_t *>(data1_info[k].ptr);
+        auto data2_ptr = static_cast<uint8_t *>(data2_info[k].ptr);
+
+        for (int start = 0; start < size; start += TILE_LANES * 8) {
+            int tile = std::min(TILE_LANES, lanes - start / 8);
+            int tail = tile < TILE_LANES ? size - start - tile * 8 : 0;
+            uint8_t tail_p[8] = {0}, tail_q[8] = {0};
+            memset(acc_p, 0, sizeof(acc_p));
+            memset(acc_q, 0, sizeof(acc_q));
+
+            int survivor = width - 3;
+            for (int i = width - 1; i >= 0; i--) {
+                if (i == idx1 || i == idx2) {
+                    for (int j = 0; j < tile; j++) {
+                        acc_q[j] = gf.mult2(acc_q[j]);
+                    }
+                    for (int j = 0; j < tail; j++) {
+                        tail_q[j] = gf.multiply(tail_q[j], 2);
+                    }
+                    continue;
+                }
+                uint8_t *block = data_ptr + (size_t)survivor * size + start;
+                auto lanes_ptr = reinterpret_cast<uint64_t *>(block);
+                for (int j = 0; j < tile; j++) {
+                    uint64_t value;
+                    memcpy(&value, lanes_ptr + j, sizeof(uint64_t));
+                    acc_p[j] ^= value;
+                    acc_q[j] = gf.mult2(acc_q[j]) ^ value;
+                }
+                for (int j = 0; j < tail; j++) {
+                    tail_p[j] ^= block[tile * 8 + j];
+                    tail_q[j] = gf.multiply(tail_q[j], 2) ^ block[tile * 8 + j];
+                }
+                survivor--;
+            }
+
+            auto bytes_p = reinterpret_cast<uint8_t *>(acc_p);
+            auto bytes_q = reinterpret_cast<uint8_t *>(acc_q);
+            for (int j = 0; j < tile * 8 + tail; j++) {
+                int column = start + j;
+                uint8_t pxy = p_ptr[column] ^ (j < tile * 8 ? bytes_p[j] : tail_p[j - tile * 8]);
+                uint8_t qxy = q_ptr[column] ^ (j < tile * 8 ? bytes_q[j] : tail_q[j - tile * 8]);
+                data1_ptr[column] = mult_a[pxy] ^ mult_b[qxy];
+                data2_ptr[column] = pxy ^ data1_ptr[column];
+            }
+        }
+    }
+}
+
 // Just for test
 void cal_parity_p_rm8(py::buffer p, py::buffer data) {
     py::buffer_info p_info = p.request();
     py::buffer_info data_info = data.request();
+    py::gil_scoped_release release;
 
     auto p_ptr = static_cast<uint8_t *>(p_info.ptr);
     auto data_ptr = static_cast<uint8_t *>(data_info.ptr);
@@ -249,6 +400,7 @@ void cal_parity_p_rm8(py::buffer p, py::buffer data) {
 void cal_parity_p_rmunrolling(py::buffer p, py::buffer data) {
     py::buffer_info p_info = p.request();
     py::buffer_info data_info = data.request();
+    py::gil_scoped_release release;
 
     auto p_ptr = static_cast<uint64_t *>(p_info.ptr);
     auto data_ptr = static_cast<uint64_t *>(data_info.ptr);
@@ -267,6 +419,7 @@ void cal_parity_p_rmunrolling(py::buffer p, py::buffer data) {
 void cal_parity_q_rmunrolling(py::buffer q, py::buffer data, std::vector<int> idxs) {
     py::buffer_info q_info = q.request();
     py::buffer_info data_info = data.request();
+    py::gil_scoped_release release;
 
     auto q_ptr = static_cast<uint8_t *>(q_info.ptr);
     auto data_ptr = static_cast<uint8_t *>(data_info.ptr);
@@ -286,6 +439,7 @@ void cal_parity_q_rmunrolling(py::buffer q, py::buffer data, std::vector<int> id
 void cal_parity_q_8_rmunrolling(py::buffer q, py::buffer data) {
     py::buffer_info q_info = q.request();
     py::buffer_info data_info = data.request();
+    py::gil_scoped_release release;
 
     auto q_ptr = static_cast<uint64_t *>(q_info.ptr);
     auto data_ptr = static_cast<uint64_t *>(data_info.ptr);
@@ -10,6 +10,7 @@ namespace py = pybind11;
 
 void cal_parity(py::buffer p, py::buffer q, py::buffer data);
 void cal_parity_8(py::buffer p, py::buffer q, py::buffer data);
+void cal_parity_8_mask(py::buffer p, py::buffer q, py::buffer data, std::vector<int> mask);
 void cal_parity_p(py::buffer p, py::buffer data);
 void cal_parity_q(py::buffer q, py::buffer data, std::vector<int> idxs);
 void cal_parity_q_8(py::buffer q, py::buffer data);
@@ -19,6 +20,9 @@ void recover_data_data(py::buffer data1, py::buffer data2,
                        py::buffer p, py::buffer inter_p,
                        py::buffer q, py::buffer inter_q,
                        int idx1, int idx2);
+void recover_data_data_batch(std::vector<py::buffer> data1, std::vector<py::buffer> data2,
+                             std::vector<py::buffer> p, std::vector<py::buffer> q,
+                             std::vector<py::buffer> data, int width, int idx1, int idx2);
 
 // Just for test
 void cal_parity_p_rm8(py::buffer p, py::buffer data);
@@ -0,0 +1,201 @@
+import threading
+from contextlib import ExitStack
+from src.qos import BACKGROUND, io_class
+from src.raid6 import RAID6
+
+
+class Compactor(object):
+    '''
+    Online compaction of the sparsely used stripes of a RAID6 system.
+    Each pass picks the sparsest stripes from the allocator state and relocates all the extents of a
+    (file, stripe) pair into destination stripes, so the source stripes become free as a whole.
+    Each destination stripe is written once as a full stripe with one parity computation.
+    The stripes of a pass stay locked only for that pass, and the passes are throttled to
+    max_bytes_per_sec, so the foreground operations on the other stripes are not blocked for long.
+    '''
+    def __init__(self, raid6: RAID6, sparse_ratio: float = 0.5, batch_stripes: int = 8,
+                 max_bytes_per_sec: int = None, interval: float = 1.0):
+        self.raid6 = raid6
+        self.sparse_ratio = sparse_ratio
+        self.batch_stripes = batch_stripes
+        self.max_bytes_per_sec = max_bytes_per_sec
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _pick_stripes(self):
+        '''
+        Pick the source stripes (sparsest first) and the destination stripes (empty ones, then the most free).
+        The stripes with a failed disk are left until they are rebuilt. The caller holds the allocator lock.
+        '''
+        raid6 = self.raid6
+        threshold = self.sparse_ratio * raid6.stripe_size
+        sources, empties, partials = [], [], []
+        for free, stripe_idx in reversed(raid6.stripe_status):
+            if self._degraded(stripe_idx):
+                continue
+            used = raid6.stripe_size - free
+            if used == 0:
+                empties.append(stripe_idx)
+            elif used <= threshold and len(sources) < self.batch_stripes:
+                sources.append(stripe_idx)
+            elif len(partials) < self.batch_stripes:
+                partials.append(stripe_idx)
+        if len(sources) == 0:
+            return [], []
+        # Moving n sources into n empty stripes frees nothing
+        return sources, empties[:len(sources) - 1] + partials
+
+    def _degraded(self, stripe_idx: int):
+        '''
+        Whether a block of the stripe cannot be read from its disk, its data and parity would be rebuilt from an
+        incomplete read.
+        '''
+        raid6 = self.raid6
+        return not all(raid6.status[stripe_idx]) or not all(disk.status for disk in raid6.disks)
+
+    def _plan_moves(self, sources: list, dests: list):
+        '''
+        Place every (file, source stripe) unit into a destination with enough reserved free space.
+        A source is only moved if all its units fit, return the moves as (name, source, destination).
+        The caller holds the allocator lock and the locks of the stripes.
+        '''
+        raid6 = self.raid6
+        free = {stripe_idx: 0 for stripe_idx in dests}
+        for inn_free, stripe_idx in raid6.stripe_status:
+            if stripe_idx in free:
+                free[stripe_idx] = inn_free
+        taken = {stripe_idx: set(name for name, _ in raid6.stripe2file[stripe_idx].values() if name is not None) for stripe_idx in dests}
+
+        moves = []
+        for src in sources:
+            names = set(name for name, _ in raid6.stripe2file[src].values() if name is not None)
+            # The extents of a file being saved are not in file2stripe yet
+            if any(name not in raid6.file2stripe or src not in raid6.file2stripe[name] for name in names):
+                continue
+            # The extents shared with clones or snapshots stay in place, the owner of an extent
+            # kept by a clone after its file was deleted is stale and the files do not cover the stripe
+            owned = set(offset for offset, (name, _) in raid6.stripe2file[src].items() if name is not None)
+            if any((src, offset) in raid6.extent_refs for offset in owned) or \
+                    owned != set(offset for name in names for offset, _ in raid6.file2stripe[name][src]):
+                continue
+            units = sorted(names, key=lambda name: -sum(size for _, size in raid6.file2stripe[name][src]))
+            placed = []
+            for name in units:
+                size = sum(size for _, size in raid6.file2stripe[name][src])
+                for dst in dests:
+                    # A file keeps one entry per stripe in file2stripe
+                    if free[dst] >= size and name not in taken[dst] and dst not in raid6.file2stripe[name]:
+                        placed.append((name, src, dst, size))
+                        free[dst] -= size
+                        taken[dst].add(name)
+                        break
+                else:
+                    break
+            if len(placed) == len(units):
+                moves += placed
+            else:
+                for name, _, dst, size in placed:
+                    free[dst] += size
+                    taken[dst].discard(name)
+        return moves
+
+    def compact_once(self):
+        '''
+        Run one compaction pass, return the number of stripes freed and the number of bytes moved.
+        '''
+        raid6 = self.raid6
+        with raid6._array_lock.read_locked(), io_class(BACKGROUND):
+            with raid6._alloc_lock:
+                sources, dests = self._pick_stripes()
+            if len(sources) == 0 or len(dests) == 0:
+                return 0, 0
+
+            with ExitStack() as stack:
+                for stripe_idx in sorted(sources + dests):
+                    stack.enter_context(raid6._stripe_locks[stripe_idx].write_locked())
+                # A disk may have failed since the stripes were picked
+                if any(self._degraded(stripe_idx) for stripe_idx in sources + dests):
+                    return 0, 0
+
+                # Reserve the space in the destinations, pending allocations keep their reservation
+                with raid6._alloc_lock:
+                    moves = self._plan_moves(sources, dests)
+                    used_dests = set(dst for _, _, dst, _ in moves)
+                    freed = set(src for _, src, _, _ in moves)
+                    new_empties = [dst for dst in used_dests if raid6._live_ranges(dst) == []]
+                    if len(freed) <= len(new_empties):
+                        return 0, 0
+                    for dst in used_dests:
+                        size = sum(size for _, _, inn_dst, size in moves if inn_dst == dst)
+                        for inn_free, stripe_idx in raid6.stripe_status:
+                            if stripe_idx == dst:
+                                raid6.stripe_status.remove((inn_free, stripe_idx))
+                                if inn_free > size:
+                                    raid6.stripe_status.add((inn_free - size, stripe_idx))
+                                break
+
+                # Build every destination in memory and write it as a full stripe
+                new_offsets = {}
+                for dst in sorted(used_dests):
+                    if dst in new_empties:
+                        stripe_data = bytearray(raid6.stripe_size)
+                    else:
+                        _, _, stripe_data, _ = raid6._load_stripes(dst)
+                        stripe_data = bytearray(stripe_data)
+                    for name, src, inn_dst, size in moves:
+                        if inn_dst != dst:
+                            continue
+                        data = bytearray(size)
+                        raid6._process_offset_list(src, raid6.file2stripe[name][src], "read", data)
+                        offset_list = raid6._claim_fragments(dst, size, name)
+                        data_offset = 0
+                        for offset, inn_size in offset_list:
+                            stripe_data[offset : offset + inn_size] = data[data_offset : data_offset + inn_size]
+                            data_offset += inn_size
+                        new_offsets[(name, src)] = offset_list
+                    raid6._write_full_stripe(dst, stripe_data)
+
+                # Switch the extents to the destinations and free the sources
+                with raid6._alloc_lock:
+                    for name, src, dst, _ in moves:
+                        offset_list = raid6.file2stripe[name][src]
+                        raid6.file2stripe[name] = {
+                            (dst if stripe_idx == src else stripe_idx): (new_offsets[(name, src)] if stripe_idx == src else inn_offset_list)
+                            for stripe_idx, inn_offset_list in raid6.file2stripe[name].items()
+                        }
+                        raid6._free_extents(src, offset_list)
+                    for src in freed:
+                        raid6._merge_fragment(src)
+
+        moved = sum(size for _, _, _, size in moves)
+        raid6.logger.info(f"Compaction freed {len(freed)} stripes by moving {moved} bytes")
+        return len(freed), moved
+
+    def _run(self):
+        while not self._stop.is_set():
+            freed, moved = self.compact_once()
+            if freed == 0:
+                self._stop.wait(self.interval)
+            elif self.max_bytes_per_sec:
+                self._stop.wait(moved / self.max_bytes_per_sec)
+
+    def start(self):
+        '''
+        Start compacting in a background thread.
+        '''
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="raid6-compactor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        '''
+        Stop the background thread after its current pass.
+        '''
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
@@ -0,0 +1,112 @@
+'''
+Inline compression of the files of the RAID6 system.
+A file is compressed in independent chunks of chunk_size bytes, in parallel, and the stored stream is the
+concatenation of the compressed chunks. A byte range is read back by decompressing only its chunks.
+'''
+import lzma
+import zlib
+from dataclasses import dataclass, field
+
+
+def _zlib_compress(data):
+    return zlib.compress(data, 6)
+
+def _lzma_compress(data):
+    return lzma.compress(data, preset=1)
+
+# codec -> (compress, decompress)
+CODECS = {
+    "zlib": (_zlib_compress, zlib.decompress),
+    "lzma": (_lzma_compress, lzma.decompress),
+}
+
+
+@dataclass
+class CompressionInfo:
+    '''
+    Metadata of a compressed file: its codec, its original size and the stored size of each chunk.
+    Every chunk holds chunk_size original bytes, except the last one.
+    '''
+    codec: str
+    size: int
+    chunk_size: int
+    chunk_sizes: list
+    offsets: list = field(init=False, repr=False) # stored offset of each chunk, and the stored size
+
+    def __post_init__(self):
+        self.offsets = [0]
+        for size in self.chunk_sizes:
+            self.offsets.append(self.offsets[-1] + size)
+
+    def span(self, offset: int, size: int):
+        '''
+        Find the chunks [first, last] holding a range of the original file, and their stored range [start, end).
+        '''
+        end = min(offset + size, self.size)
+        first = offset // self.chunk_size
+        last = max(first, (end - 1) // self.chunk_size)
+        return first, last, self.offsets[first], self.offsets[last + 1]
+
+    def split(self, stored, first: int, last: int):
+        '''
+        Split the stored bytes of the chunks [first, last] into the chunks.
+        '''
+        start = self.offsets[first]
+        return [stored[self.offsets[i] - start : self.offsets[i + 1] - start] for i in range(first, last + 1)]
+
+
+def choose_codec(data, codec: str = "zlib", samples: int = 8, sample_size: int = 64 * 1024, ratio: float = 0.8):
+    '''
+    Compress a few samples spread over the data with zlib, return codec if they shrink below ratio, None otherwise.
+    '''
+    if len(data) == 0:
+        return None
+    step = max(sample_size, len(data) // samples)
+    view = memoryview(data)
+    stored = 0
+    original = 0
+    for start in range(0, len(data), step):
+        sample = view[start : start + sample_size]
+        stored += len(zlib.compress(sample, 1))
+        original += len(sample)
+    return codec if stored < ratio * original else None
+
+def compress(data, codec: str, chunk_size: int, executor):
+    '''
+    Compress the data chunk by chunk on the executor, return the compression info and the stored bytes.
+    Return None and the data when the data does not shrink.
+    '''
+    compress_chunk = CODECS[codec][0]
+    view = memoryview(data)
+    chunks = list(executor.map(compress_chunk, [view[start : start + chunk_size] for start in range(0, len(data), chunk_size)]))
+    info = CompressionInfo(codec, len(data), chunk_size, [len(chunk) for chunk in chunks])
+    if info.offsets[-1] >= len(data):
+        return None, data
+    return info, b"".join(chunks)
+
+def decompress_span(info: CompressionInfo, stored, offset: int, size: int, executor):
+    '''
+    Decompress the stored bytes of the chunks of a range of the original file, return the bytes of the range.
+    '''
+    first, last, _, _ = info.span(offset, size)
+    data = b"".join(executor.map(CODECS[info.codec][1], info.split(stored, first, last)))
+    start = offset - first * info.chunk_size
+    return data[start : start + min(size, info.size - offset)]
+
+def decompress_stream(info: CompressionInfo, pieces, executor):
+    '''
+    Decompress a stream of stored bytes in order, the complete chunks of every piece in parallel.
+    '''
+    decompress_chunk = CODECS[info.codec][1]
+    pending = bytearray(0)
+    chunk_idx = 0
+    for piece in pieces:
+        pending += piece
+        start = 0
+        chunks = []
+        while chunk_idx < len(info.chunk_sizes) and len(pending) - start >= info.chunk_sizes[chunk_idx]:
+            chunks.append(bytes(pending[start : start + info.chunk_sizes[chunk_idx]]))
+            start += info.chunk_sizes[chunk_idx]
+            chunk_idx += 1
+        del pending[:start]
+        yield from executor.map(decompress_chunk, chunks)
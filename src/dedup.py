@@ -0,0 +1,204 @@
+'''
+Content-addressed deduplication of the files of the RAID6 system.
+A file is cut into chunks, of a fixed size or at content-defined boundaries, and each distinct chunk is stored
+once as an internal object named chunk_name(chunk id). The file itself is a recipe, the list of its chunk ids.
+'''
+import os
+import hashlib
+import numpy as np
+
+EMPTY = -1
+TOMBSTONE = -2
+
+# Random 64-bit value of every byte for the gear rolling hash
+GEAR = np.random.default_rng(0x5eed).integers(0, 2**64 - 1, 256, dtype=np.uint64, endpoint=True)
+GEAR_WINDOW = 32
+
+
+def chunk_name(chunk_id: int):
+    return f"\x00chunk{chunk_id}"
+
+def chunk_key(chunk):
+    '''
+    Get the 128-bit digest of a chunk as two uint64.
+    '''
+    digest = hashlib.blake2b(chunk, digest_size=16).digest()
+    return tuple(int(word) for word in np.frombuffer(digest, dtype=np.uint64))
+
+def fixed_chunks(data, chunk_size: int):
+    '''
+    Cut the data into chunks of chunk_size bytes, return the (start, end) of each chunk.
+    '''
+    return [(start, min(start + chunk_size, len(data))) for start in range(0, len(data), chunk_size)]
+
+def cdc_chunks(data, avg_size: int):
+    '''
+    Cut the data at content-defined boundaries, return the (start, end) of each chunk.
+    A boundary follows every byte where the top bits of a gear hash of the last GEAR_WINDOW bytes are zero,
+    so an insertion only moves the boundaries around it. The chunks are kept within [avg_size / 4, avg_size * 4].
+    '''
+    size = len(data)
+    if size == 0:
+        return []
+    values = GEAR[np.frombuffer(data, dtype=np.uint8)]
+    hashes = values.copy()
+    for shift in range(1, GEAR_WINDOW):
+        hashes[shift:] += values[:size - shift] << np.uint64(shift)
+    bits = max(1, int(avg_size).bit_length() - 1)
+    candidates = np.nonzero((hashes >> np.uint64(64 - bits)) == 0)[0] + 1
+
+    min_size = max(1, avg_size // 4)
+    max_size = avg_size * 4
+    chunks = []
+    start = 0
+    for end in candidates.tolist() + [size]:
+        while end - start > max_size:
+            chunks.append((start, start + max_size))
+            start += max_size
+        if end - start >= min_size or end == size:
+            if end > start:
+                chunks.append((start, end))
+            start = end
+    return chunks
+
+
+class DedupIndex(object):
+    '''
+    Persistent chunk index backed by NumPy arrays.
+    The digests live in an open-addressing table with linear probing, table[slot] holds the chunk id of the
+    digest in keys[slot], so a lookup is O(1). The reference count and size of a chunk are refs[id] and sizes[id].
+    The index is saved atomically to path as one .npz file.
+    '''
+    def __init__(self, path: str = None, capacity: int = 1024):
+        self.path = path
+        if path is not None and os.path.exists(path):
+            with np.load(path) as state:
+                self.keys = state["keys"]
+                self.table = state["table"]
+                self.refs = state["refs"]
+                self.sizes = state["sizes"]
+                self.chunk_keys = state["chunk_keys"]
+        else:
+            self.keys = np.zeros((capacity, 2), dtype=np.uint64)
+            self.table = np.full(capacity, EMPTY, dtype=np.int64)
+            self.refs = np.zeros(capacity, dtype=np.int64)
+            self.sizes = np.zeros(capacity, dtype=np.int64)
+            self.chunk_keys = np.zeros((capacity, 2), dtype=np.uint64)
+        # The ids without references are free, the table counts the live slots and the tombstones
+        self._free = np.nonzero(self.sizes == 0)[0].tolist()[::-1]
+        self.count = int(np.count_nonzero(self.sizes))
+        self._used_slots = int(np.count_nonzero(self.table != EMPTY))
+
+    def __len__(self):
+        return self.count
+
+    def _probe(self, key: tuple):
+        '''
+        Find the slot of a key, or the slot to insert it at, return (slot, found).
+        '''
+        capacity = len(self.table)
+        slot = key[0] % capacity
+        insert = None
+        while True:
+            chunk_id = self.table[slot]
+            if chunk_id == EMPTY:
+                return (slot if insert is None else insert), False
+            if chunk_id == TOMBSTONE:
+                if insert is None:
+                    insert = slot
+            elif self.keys[slot, 0] == key[0] and self.keys[slot, 1] == key[1]:
+                return slot, True
+            slot = (slot + 1) % capacity
+
+    def lookup(self, key: tuple):
+        '''
+        Get the chunk id of a digest, None if the chunk is not stored.
+        '''
+        slot, found = self._probe(key)
+        return int(self.table[slot]) if found else None
+
+    def add(self, key: tuple, size: int):
+        '''
+        Register a new chunk without references, return its id.
+        '''
+        if 2 * (self._used_slots + 1) > len(self.table):
+            self._rehash(max(1024, 4 * self.count))
+        if len(self._free) == 0:
+            self._grow_ids()
+        chunk_id = self._free.pop()
+        slot, _ = self._probe(key)
+        if self.table[slot] == EMPTY:
+            self._used_slots += 1
+        self.keys[slot] = key
+        self.table[slot] = chunk_id
+        self.chunk_keys[chunk_id] = key
+        self.sizes[chunk_id] = size
+        self.refs[chunk_id] = 0
+        self.count += 1
+        return chunk_id
+
+    def ref(self, chunk_id: int):
+        self.refs[chunk_id] += 1
+
+    def unref(self, chunk_id: int):
+        '''
+        Drop a reference to a chunk, return the number of references left.
+        '''
+        self.refs[chunk_id] -= 1
+        return int(self.refs[chunk_id])
+
+    def remove(self, chunk_id: int):
+        '''
+        Forget a chunk, its id is reused.
+        '''
+        slot, found = self._probe(tuple(int(word) for word in self.chunk_keys[chunk_id]))
+        if found:
+            self.table[slot] = TOMBSTONE
+        self.sizes[chunk_id] = 0
+        self.refs[chunk_id] = 0
+        self._free.append(chunk_id)
+        self.count -= 1
+
+    def retain(self, stored):
+        '''
+        Forget the chunks for which stored(chunk id) is False, return the number of chunks forgotten.
+        '''
+        stale = [chunk_id for chunk_id in np.nonzero(self.sizes)[0].tolist() if not stored(chunk_id)]
+        for chunk_id in stale:
+            self.remove(chunk_id)
+        return len(stale)
+
+    def _grow_ids(self):
+        old = len(self.sizes)
+        self.refs = np.concatenate([self.refs, np.zeros(old, dtype=np.int64)])
+        self.sizes = np.concatenate([self.sizes, np.zeros(old, dtype=np.int64)])
+        self.chunk_keys = np.concatenate([self.chunk_keys, np.zeros((old, 2), dtype=np.uint64)])
+        self._free = list(range(2 * old - 1, old - 1, -1))
+
+    def _rehash(self, capacity: int):
+        '''
+        Rebuild the table with the live chunks only, the tombstones are dropped.
+        '''
+        live = np.nonzero(self.sizes)[0]
+        self.keys = np.zeros((capacity, 2), dtype=np.uint64)
+        self.table = np.full(capacity, EMPTY, dtype=np.int64)
+        self._used_slots = 0
+        for chunk_id in live.tolist():
+            key = tuple(int(word) for word in self.chunk_keys[chunk_id])
+            slot, _ = self._probe(key)
+            self.keys[slot] = key
+            self.table[slot] = chunk_id
+            self._used_slots += 1
+
+    def save(self):
+        '''
+        Replace the index file atomically.
+        '''
+        if self.path is None:
+            return
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, keys=self.keys, table=self.table, refs=self.refs, sizes=self.sizes, chunk_keys=self.chunk_keys)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,44 @@
+'''
+Background discard of the space freed by the deletions of a RAID6 system.
+A deletion only updates the maps and queues its stripes, the data blocks left without any extent are punched
+out of the disk files later in one pass over the queued stripes, with one parity update per stripe.
+'''
+import threading
+from src.qos import BACKGROUND, io_class
+
+
+class Discarder(object):
+    '''
+    Run RAID6.discard_freed every interval seconds in the background I/O class.
+    '''
+    def __init__(self, raid6, interval: float = 1.0):
+        self.raid6 = raid6
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            with io_class(BACKGROUND):
+                self.raid6.discard_freed()
+            self._stop.wait(self.interval)
+
+    def start(self):
+        '''
+        Start discarding in a background thread.
+        '''
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="raid6-discarder", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        '''
+        Stop the background thread after its current pass.
+        '''
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
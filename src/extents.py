@@ -0,0 +1,554 @@
+'''
+Compact extent metadata of the RAID6 system.
+The locations of the files (file2stripe) and the fragments of the stripes (stripe2file) are kept in flat arrays
+instead of nested dicts and lists, the file names are interned once and referenced by an integer id.
+* FileTable holds the extents of every file as (stripe, offset, size) rows of one NumPy structured array, the rows
+  of a file are contiguous and found by the per-file (start, count) range index
+* StripeTable holds the fragments of every stripe as (offset, size, owner id) triples of an array sorted by offset
+Both keep the dict interface of the old maps through views, so file2stripe[name][stripe_idx] is still the offset
+list of a file in a stripe and stripe2file[stripe_idx][offset] is still [name, size]. The values are copies,
+an entry is changed by assigning it again.
+'''
+import threading
+from array import array
+import numpy as np
+
+FREE = -1
+NO_FILE = -1
+# The offsets and sizes inside a stripe are stored as int32
+EXTENT_LIMIT = 2**31
+EXTENT = np.dtype([("stripe", "<i4"), ("offset", "<i4"), ("size", "<i4")])
+
+
+class NameTable(object):
+    '''
+    Interned file names, each name is stored once and referenced by its id.
+    The ids are reference counted, the id of a name without references is reused.
+    The table is shared by the FileTable, changed under the allocator lock, and the StripeTable, changed under
+    the stripe locks, so intern and release hold a lock of their own.
+    '''
+    def __init__(self):
+        self.names = [] # id -> name, None for a free id
+        self.ids = {} # name -> id
+        self.refs = array("q")
+        self._free = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def lookup(self, name):
+        return self.ids.get(name)
+
+    def intern(self, name):
+        '''
+        Add a reference to a name, return its id.
+        '''
+        with self._lock:
+            name_id = self.ids.get(name)
+            if name_id is None:
+                if len(self._free) > 0:
+                    name_id = self._free.pop()
+                    self.names[name_id] = name
+                else:
+                    name_id = len(self.names)
+                    self.names.append(name)
+                    self.refs.append(0)
+                self.ids[name] = name_id
+            self.refs[name_id] += 1
+            return name_id
+
+    def release(self, name_id: int):
+        '''
+        Drop a reference to a name, the id is freed with the last one.
+        '''
+        with self._lock:
+            self.refs[name_id] -= 1
+            if self.refs[name_id] == 0:
+                del self.ids[self.names[name_id]]
+                self.names[name_id] = None
+                self._free.append(name_id)
+
+
+class FileTable(object):
+    '''
+    The extents of the files, name -> {stripe idx: [(offset, size)]} with the interface of a dict.
+    The rows of a file are extents[start[id] : start[id] + count[id]] in file order, a stripe without extents is
+    one row with offset -1. A file set again gets new rows at the end, the old ones are garbage until the
+    array is compacted, which happens before it grows once half the rows are garbage.
+    '''
+    def __init__(self, names: NameTable = None, capacity: int = 1024):
+        self.names = NameTable() if names is None else names
+        self.extents = np.zeros(capacity, dtype=EXTENT)
+        self.used = 0
+        self.garbage = 0
+        self.start = np.zeros(0, dtype=np.int64)
+        self.count = np.zeros(0, dtype=np.int64)
+        self.files = 0
+
+    @property
+    def nbytes(self):
+        return self.extents.nbytes + self.start.nbytes + self.count.nbytes
+
+    def _id(self, name):
+        name_id = self.names.lookup(name)
+        if name_id is None or name_id >= len(self.count) or self.count[name_id] == NO_FILE:
+            return None
+        return name_id
+
+    def _rows(self, name):
+        name_id = self._id(name)
+        if name_id is None:
+            raise KeyError(name)
+        start = int(self.start[name_id])
+        return self.extents[start : start + int(self.count[name_id])]
+
+    def _compact(self):
+        '''
+        Move the rows of the live files to the front of the array, in id order.
+        '''
+        live = np.nonzero(self.count > 0)[0]
+        counts = self.count[live]
+        starts = np.cumsum(counts) - counts
+        rows = np.arange(int(counts.sum()), dtype=np.int64) + np.repeat(self.start[live] - starts, counts)
+        self.used = len(rows)
+        self.extents[:self.used] = self.extents[rows]
+        self.start[live] = starts
+        self.garbage = 0
+
+    def _append(self, rows: np.ndarray):
+        if self.used + len(rows) > len(self.extents):
+            if 2 * self.garbage >= self.used:
+                self._compact()
+            if self.used + len(rows) > len(self.extents):
+                extents = np.zeros(max(2 * len(self.extents), self.used + len(rows)), dtype=EXTENT)
+                extents[:self.used] = self.extents[:self.used]
+                self.extents = extents
+        start = self.used
+        self.extents[start : start + len(rows)] = rows
+        self.used += len(rows)
+        return start
+
+    def _new_id(self, name):
+        name_id = self.names.intern(name)
+        if name_id >= len(self.count):
+            grown = max(2 * len(self.count), name_id + 1, 64)
+            self.start = np.concatenate([self.start, np.zeros(grown - len(self.start), dtype=np.int64)])
+            self.count = np.concatenate([self.count, np.full(grown - len(self.count), NO_FILE, dtype=np.int64)])
+        self.files += 1
+        return name_id
+
+    def set(self, name, mapping):
+        '''
+        Set the extents of a file from a {stripe idx: [(offset, size)]} mapping.
+        '''
+        rows = []
+        for stripe_idx, offset_list in mapping.items():
+            if len(offset_list) == 0:
+                rows.append((stripe_idx, -1, 0))
+            rows += [(stripe_idx, offset, size) for offset, size in offset_list]
+        rows = np.array(rows, dtype=EXTENT)
+
+        name_id = self._id(name)
+        if name_id is None:
+            name_id = self._new_id(name)
+        else:
+            self.garbage += int(self.count[name_id])
+            self.count[name_id] = 0
+        self.start[name_id] = self._append(rows)
+        self.count[name_id] = len(rows)
+
+    def discard(self, name):
+        '''
+        Remove a file, return False if it does not exist.
+        '''
+        name_id = self._id(name)
+        if name_id is None:
+            return False
+        self.garbage += int(self.count[name_id])
+        self.count[name_id] = NO_FILE
+        self.files -= 1
+        self.names.release(name_id)
+        return True
+
+    def mapping(self, name):
+        '''
+        Get the extents of a file as a new {stripe idx: [(offset, size)]} dict.
+        '''
+        rows = self._rows(name)
+        mapping = {}
+        for stripe_idx, offset, size in zip(rows["stripe"].tolist(), rows["offset"].tolist(), rows["size"].tolist()):
+            offset_list = mapping.setdefault(stripe_idx, [])
+            if offset >= 0:
+                offset_list.append((offset, size))
+        return mapping
+
+    def stripe_extents(self, name, stripe_idx: int):
+        '''
+        Get the offset list of a file in one stripe, None if the file has no extent there.
+        '''
+        rows = self._rows(name)
+        rows = rows[rows["stripe"] == stripe_idx]
+        if len(rows) == 0:
+            return None
+        return [(offset, size) for offset, size in zip(rows["offset"].tolist(), rows["size"].tolist()) if offset >= 0]
+
+    def size(self, name):
+        '''
+        Get the number of bytes stored for a file.
+        '''
+        return int(self._rows(name)["size"].sum(dtype=np.int64))
+
+    def locate(self, name, offset: int, size: int):
+        '''
+        Map a byte range of a file to the (stripe idx, offset list) of the extents holding it, in file order.
+        The extents holding the range are found by a binary search over the cumulative extent sizes.
+        '''
+        rows = self._rows(name)
+        ends = np.cumsum(rows["size"], dtype=np.int64)
+        first = int(np.searchsorted(ends, offset, side="right"))
+        last = min(len(rows), int(np.searchsorted(ends, offset + size, side="left")) + 1)
+        hit = rows[first:last]
+        stripe2range = []
+        for stripe_idx, extent_offset, extent_size, extent_end in zip(hit["stripe"].tolist(), hit["offset"].tolist(),
+                                                                      hit["size"].tolist(), ends[first:last].tolist()):
+            extent_start = extent_end - extent_size
+            start = max(offset, extent_start)
+            stop = min(offset + size, extent_end)
+            if start >= stop:
+                continue
+            piece = (extent_offset + start - extent_start, stop - start)
+            if len(stripe2range) > 0 and stripe2range[-1][0] == stripe_idx:
+                stripe2range[-1][1].append(piece)
+            else:
+                stripe2range.append((stripe_idx, [piece]))
+        return stripe2range
+
+    def copy(self):
+        '''
+        Copy the table with its own name table, the rows are compacted.
+        '''
+        table = FileTable(capacity=max(1024, self.used - self.garbage))
+        for name in self:
+            rows = self._rows(name)
+            name_id = table._new_id(name)
+            table.start[name_id] = table._append(rows)
+            table.count[name_id] = len(rows)
+        return table
+
+    def __len__(self):
+        return self.files
+
+    def __contains__(self, name):
+        return self._id(name) is not None
+
+    def __iter__(self):
+        return iter([self.names.names[name_id] for name_id in np.nonzero(self.count != NO_FILE)[0].tolist()])
+
+    def __getitem__(self, name):
+        if self._id(name) is None:
+            raise KeyError(name)
+        return FileView(self, name)
+
+    def __setitem__(self, name, mapping):
+        self.set(name, dict(mapping.items()))
+
+    def __delitem__(self, name):
+        if not self.discard(name):
+            raise KeyError(name)
+
+    def get(self, name, default=None):
+        return self[name] if name in self else default
+
+    def pop(self, name, *default):
+        if name not in self:
+            if len(default) > 0:
+                return default[0]
+            raise KeyError(name)
+        mapping = self.mapping(name)
+        self.discard(name)
+        return mapping
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return [FileView(self, name) for name in self]
+
+    def items(self):
+        return [(name, FileView(self, name)) for name in self]
+
+    def update(self, other):
+        for name, mapping in other.items():
+            self[name] = mapping
+
+    def __eq__(self, other):
+        if not hasattr(other, "items"):
+            return NotImplemented
+        return len(self) == len(other) and all(name in other and self.mapping(name) == dict(other[name].items()) for name in self)
+
+    def __repr__(self):
+        return repr({name: self.mapping(name) for name in self})
+
+
+class FileView(object):
+    '''
+    The extents of one file, {stripe idx: [(offset, size)]} with the interface of a dict.
+    '''
+    __slots__ = ("table", "name")
+
+    def __init__(self, table: FileTable, name):
+        self.table = table
+        self.name = name
+
+    def __getitem__(self, stripe_idx: int):
+        offset_list = self.table.stripe_extents(self.name, stripe_idx)
+        if offset_list is None:
+            raise KeyError(stripe_idx)
+        return offset_list
+
+    def __setitem__(self, stripe_idx: int, offset_list: list):
+        mapping = self.table.mapping(self.name)
+        mapping[stripe_idx] = list(offset_list)
+        self.table.set(self.name, mapping)
+
+    def __delitem__(self, stripe_idx: int):
+        mapping = self.table.mapping(self.name)
+        del mapping[stripe_idx]
+        self.table.set(self.name, mapping)
+
+    def __contains__(self, stripe_idx: int):
+        return bool((self.table._rows(self.name)["stripe"] == stripe_idx).any())
+
+    def __iter__(self):
+        return iter(self.table.mapping(self.name))
+
+    def __len__(self):
+        return len(self.table.mapping(self.name))
+
+    def get(self, stripe_idx: int, default=None):
+        offset_list = self.table.stripe_extents(self.name, stripe_idx)
+        return default if offset_list is None else offset_list
+
+    def keys(self):
+        return self.table.mapping(self.name).keys()
+
+    def values(self):
+        return self.table.mapping(self.name).values()
+
+    def items(self):
+        return self.table.mapping(self.name).items()
+
+    def copy(self):
+        return self.table.mapping(self.name)
+
+    def __eq__(self, other):
+        if not hasattr(other, "items"):
+            return NotImplemented
+        return self.table.mapping(self.name) == dict(other.items())
+
+    def __repr__(self):
+        return repr(self.table.mapping(self.name))
+
+
+class StripeTable(object):
+    '''
+    The fragments of the stripes, stripe idx -> {offset: [name, size]} with the interface of a list of dicts.
+    The fragments of a stripe are (offset, size, owner id) triples in one array sorted by offset, found by a
+    binary search. A free fragment has the owner FREE.
+    '''
+    def __init__(self, stripe_num: int, stripe_size: int, names: NameTable = None):
+        if stripe_size >= EXTENT_LIMIT:
+            raise ValueError(f"Stripe size {stripe_size} is too large for the extent table")
+        self.names = NameTable() if names is None else names
+        self.rows = [array("i", (0, stripe_size, FREE)) for _ in range(stripe_num)]
+
+    @property
+    def nbytes(self):
+        return sum(row.itemsize * len(row) for row in self.rows)
+
+    def _find(self, row: array, offset: int):
+        '''
+        Find the position of the first fragment starting at or after offset.
+        '''
+        low, high = 0, len(row) // 3
+        while low < high:
+            middle = (low + high) // 2
+            if row[3 * middle] < offset:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _name(self, owner: int):
+        return None if owner == FREE else self.names.names[owner]
+
+    def get(self, stripe_idx: int, offset: int):
+        '''
+        Get the [name, size] of the fragment starting at offset, None if there is none.
+        '''
+        row = self.rows[stripe_idx]
+        pos = self._find(row, offset)
+        if 3 * pos < len(row) and row[3 * pos] == offset:
+            return [self._name(row[3 * pos + 2]), row[3 * pos + 1]]
+        return None
+
+    def set(self, stripe_idx: int, offset: int, name, size: int):
+        '''
+        Set the fragment starting at offset, a name None marks it free.
+        '''
+        if offset + size >= EXTENT_LIMIT:
+            raise ValueError(f"Fragment ({offset}, {size}) is too large for the extent table")
+        row = self.rows[stripe_idx]
+        owner = FREE if name is None else self.names.intern(name)
+        pos = self._find(row, offset)
+        if 3 * pos < len(row) and row[3 * pos] == offset:
+            if row[3 * pos + 2] != FREE:
+                self.names.release(row[3 * pos + 2])
+            row[3 * pos + 1] = size
+            row[3 * pos + 2] = owner
+        else:
+            row[3 * pos : 3 * pos] = array("i", (offset, size, owner))
+
+    def remove(self, stripe_idx: int, offset: int):
+        '''
+        Remove the fragment starting at offset, return its [name, size].
+        '''
+        row = self.rows[stripe_idx]
+        pos = self._find(row, offset)
+        if 3 * pos >= len(row) or row[3 * pos] != offset:
+            raise KeyError(offset)
+        _, size, owner = row[3 * pos : 3 * pos + 3]
+        del row[3 * pos : 3 * pos + 3]
+        name = self._name(owner)
+        if owner != FREE:
+            self.names.release(owner)
+        return [name, size]
+
+    def clear(self, stripe_idx: int):
+        row = self.rows[stripe_idx]
+        for owner in row[2::3]:
+            if owner != FREE:
+                self.names.release(owner)
+        self.rows[stripe_idx] = array("i")
+
+    def fragments(self, stripe_idx: int):
+        '''
+        Get the (offset, name, size) of the fragments of a stripe, sorted by offset.
+        '''
+        row = self.rows[stripe_idx]
+        return [(row[i], self._name(row[i + 2]), row[i + 1]) for i in range(0, len(row), 3)]
+
+    def free(self, stripe_idx: int, offset: int, size: int):
+        '''
+        Mark a fragment free and merge it with the free fragments right before and after it.
+        '''
+        self.set(stripe_idx, offset, None, size)
+        row = self.rows[stripe_idx]
+        pos = self._find(row, offset)
+        after = 3 * (pos + 1)
+        if after < len(row) and row[after + 2] == FREE and row[after] == offset + size:
+            row[3 * pos + 1] += row[after + 1]
+            del row[after : after + 3]
+        before = 3 * (pos - 1)
+        if pos > 0 and row[before + 2] == FREE and row[before] + row[before + 1] == offset:
+            row[before + 1] += row[3 * pos + 1]
+            del row[3 * pos : 3 * pos + 3]
+
+    def merge(self, stripe_idx: int):
+        '''
+        Drop the empty free fragments of a stripe and merge the continuous free ones.
+        '''
+        row = self.rows[stripe_idx]
+        merged = array("i")
+        for i in range(0, len(row), 3):
+            offset, size, owner = row[i : i + 3]
+            if owner == FREE and size == 0:
+                continue
+            if owner == FREE and len(merged) > 0 and merged[-1] == FREE and merged[-3] + merged[-2] == offset:
+                merged[-2] += size
+            else:
+                merged.extend((offset, size, owner))
+        self.rows[stripe_idx] = merged
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        return iter([StripeView(self, stripe_idx) for stripe_idx in range(len(self.rows))])
+
+    def __getitem__(self, stripe_idx: int):
+        if not -len(self.rows) <= stripe_idx < len(self.rows):
+            raise IndexError(stripe_idx)
+        return StripeView(self, stripe_idx % len(self.rows))
+
+    def __setitem__(self, stripe_idx: int, mapping):
+        fragments = sorted(mapping.items())
+        self.clear(stripe_idx)
+        for offset, (name, size) in fragments:
+            self.set(stripe_idx, offset, name, size)
+
+
+class StripeView(object):
+    '''
+    The fragments of one stripe, {offset: [name, size]} with the interface of a dict.
+    '''
+    __slots__ = ("table", "stripe_idx")
+
+    def __init__(self, table: StripeTable, stripe_idx: int):
+        self.table = table
+        self.stripe_idx = stripe_idx
+
+    def _mapping(self):
+        return {offset: [name, size] for offset, name, size in self.table.fragments(self.stripe_idx)}
+
+    def __getitem__(self, offset: int):
+        fragment = self.table.get(self.stripe_idx, offset)
+        if fragment is None:
+            raise KeyError(offset)
+        return fragment
+
+    def __setitem__(self, offset: int, fragment):
+        name, size = fragment
+        self.table.set(self.stripe_idx, offset, name, size)
+
+    def __delitem__(self, offset: int):
+        self.table.remove(self.stripe_idx, offset)
+
+    def __contains__(self, offset: int):
+        return self.table.get(self.stripe_idx, offset) is not None
+
+    def __iter__(self):
+        return iter(self.table.rows[self.stripe_idx][0::3].tolist())
+
+    def __len__(self):
+        return len(self.table.rows[self.stripe_idx]) // 3
+
+    def get(self, offset: int, default=None):
+        fragment = self.table.get(self.stripe_idx, offset)
+        return default if fragment is None else fragment
+
+    def pop(self, offset: int, *default):
+        if len(default) > 0 and offset not in self:
+            return default[0]
+        return self.table.remove(self.stripe_idx, offset)
+
+    def keys(self):
+        return self._mapping().keys()
+
+    def values(self):
+        return self._mapping().values()
+
+    def items(self):
+        return self._mapping().items()
+
+    def copy(self):
+        return self._mapping()
+
+    def __eq__(self, other):
+        if not hasattr(other, "items"):
+            return NotImplemented
+        return self._mapping() == dict(other.items())
+
+    def __repr__(self):
+        return repr(self._mapping())
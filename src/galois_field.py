@@ -0,0 +1,47 @@
+'''
+GF(2^8) parity kernels of the RAID6 system.
+Both the C extension in src/clib (when it is built) and the NumPy engine are available, the faster one on a
+short calibration run is picked at import time. Set RAID6_GF_BACKEND to "c" or "numpy" to force a backend.
+'''
+import os
+import time
+from src import galois_field_np
+
+BACKENDS = {"numpy": galois_field_np}
+try:
+    from src.clib import galois_field as galois_field_c
+    BACKENDS["c"] = galois_field_c
+except ImportError:
+    pass
+
+def _calibrate(block_size: int = 1 << 16, width: int = 4, rounds: int = 3):
+    '''
+    Time cal_parity_8 of every backend on a stripe of random data, return the name of the fastest.
+    '''
+    data = bytearray(os.urandom(block_size * width))
+    p = bytearray(block_size)
+    q = bytearray(block_size)
+    timings = {}
+    for name, module in BACKENDS.items():
+        module.cal_parity_8(p, q, data)
+        start = time.perf_counter()
+        for _ in range(rounds):
+            module.cal_parity_8(p, q, data)
+        timings[name] = time.perf_counter() - start
+    return min(timings, key=timings.get)
+
+BACKEND = os.environ.get("RAID6_GF_BACKEND")
+if BACKEND is None:
+    BACKEND = _calibrate() if len(BACKENDS) > 1 else "numpy"
+elif BACKEND not in BACKENDS:
+    raise ImportError(f"GF(2^8) backend {BACKEND} is not available")
+
+_module = BACKENDS[BACKEND]
+cal_parity_8 = _module.cal_parity_8
+cal_parity_8_mask = _module.cal_parity_8_mask
+cal_parity_p = _module.cal_parity_p
+cal_parity_q_8 = _module.cal_parity_q_8
+cal_parity_q = _module.cal_parity_q
+q_recover_data = _module.q_recover_data
+recover_data_data = _module.recover_data_data
+recover_data_data_batch = _module.recover_data_data_batch
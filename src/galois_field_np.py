@@ -0,0 +1,178 @@
+import numpy as np
+
+# GF(2^8) with modulo polynomial x^8 + x^4 + x^3 + x^2 + 1, same tables as the C extension
+POLYNOMIAL = 0b100011101
+
+def _build_tables():
+    gflog = np.zeros(256, dtype=np.int32)
+    gfilog = np.zeros(512, dtype=np.uint8)
+    value = 1
+    for exp in range(255):
+        gfilog[exp] = value
+        gflog[value] = exp
+        value <<= 1
+        if value & 0b100000000:
+            value ^= POLYNOMIAL
+    gfilog[255:510] = gfilog[:255]
+
+    # MUL_TABLE[a][b] = a * b, rows are gathered with the data bytes as indices
+    logs = gflog[1:, None] + gflog[None, 1:]
+    mul_table = np.zeros((256, 256), dtype=np.uint8)
+    mul_table[1:, 1:] = gfilog[logs]
+    return gflog, gfilog, mul_table
+
+GFLOG, GFILOG, MUL_TABLE = _build_tables()
+
+_HIGH_BITS = np.uint64(0x8080808080808080)
+_LOW_BITS = np.uint64(0xfefefefefefefefe)
+_REDUCE = np.uint64(0x1d1d1d1d1d1d1d1d)
+_ONE = np.uint64(1)
+_SEVEN = np.uint64(7)
+
+
+def _u8(buffer):
+    return np.frombuffer(buffer, dtype=np.uint8)
+
+def _lanes(buffer):
+    '''
+    View a buffer as uint64 lanes when its size allows, as bytes otherwise.
+    '''
+    array = _u8(buffer)
+    if array.nbytes % 8 == 0:
+        return array.view(np.uint64)
+    return array
+
+def _blocks(data, block_size: int, dtype):
+    array = _u8(data) if dtype == np.uint8 else _lanes(data)
+    width = array.shape[0] // block_size
+    return array[: width * block_size].reshape(width, block_size)
+
+def _mult2(x):
+    '''
+    Multiply every byte by 2: 8 bytes per uint64 lane, a shift and a masked reduction by the polynomial.
+    '''
+    if x.dtype == np.uint64:
+        high = x & _HIGH_BITS
+        return ((x << _ONE) & _LOW_BITS) ^ (((high << _ONE) - (high >> _SEVEN)) & _REDUCE)
+    return MUL_TABLE[2][x]
+
+def _mult(x, g: int):
+    return MUL_TABLE[g][x]
+
+def _inverse(g: int):
+    return int(GFILOG[255 - GFLOG[g]])
+
+def cal_parity_p(p, data):
+    '''
+    XOR the data blocks into p.
+    '''
+    p_lanes = _lanes(p)
+    blocks = _blocks(data, p_lanes.shape[0], p_lanes.dtype)
+    if len(blocks) > 0:
+        p_lanes ^= np.bitwise_xor.reduce(blocks, axis=0)
+
+def cal_parity_q_8(q, data):
+    '''
+    Q = sum of g^i * d_i over the data blocks, evaluated with Horner's rule.
+    '''
+    q_lanes = _lanes(q)
+    blocks = _blocks(data, q_lanes.shape[0], q_lanes.dtype)
+    acc = blocks[-1].copy()
+    for i in range(len(blocks) - 2, -1, -1):
+        acc = _mult2(acc) ^ blocks[i]
+    q_lanes[:] = acc
+
+def cal_parity_8(p, q, data):
+    '''
+    P and Q of the data blocks in one pass.
+    '''
+    p_lanes = _lanes(p)
+    q_lanes = _lanes(q)
+    blocks = _blocks(data, p_lanes.shape[0], p_lanes.dtype)
+    acc_p = blocks[-1].copy()
+    acc_q = blocks[-1].copy()
+    for i in range(len(blocks) - 2, -1, -1):
+        acc_p ^= blocks[i]
+        acc_q = _mult2(acc_q) ^ blocks[i]
+    p_lanes[:] = acc_p
+    q_lanes[:] = acc_q
+
+def cal_parity_8_mask(p, q, data, mask):
+    '''
+    P and Q of the data blocks present in the mask, the absent blocks are not read and count as zero.
+    '''
+    p_lanes = _lanes(p)
+    q_lanes = _lanes(q)
+    blocks = _blocks(data, p_lanes.shape[0], p_lanes.dtype)
+    present = [i for i in range(len(blocks)) if mask[i]]
+    if len(present) == 0:
+        p_lanes[:] = 0
+        q_lanes[:] = 0
+        return
+    acc_p = blocks[present[-1]].copy()
+    acc_q = blocks[present[-1]].copy()
+    for i in range(present[-1] - 1, -1, -1):
+        acc_q = _mult2(acc_q)
+        if mask[i]:
+            acc_p ^= blocks[i]
+            acc_q ^= blocks[i]
+    p_lanes[:] = acc_p
+    q_lanes[:] = acc_q
+
+def cal_parity_q(q, data, idxs):
+    '''
+    XOR g^idxs[i] * d_i into q for every data block.
+    '''
+    q_bytes = _u8(q)
+    blocks = _blocks(data, q_bytes.shape[0], np.uint8)
+    for i, block in enumerate(blocks):
+        q_bytes ^= _mult(block, int(GFILOG[idxs[i]]))
+
+def q_recover_data(data, q, inter_q, idx):
+    '''
+    Recover a data block from Q and the Q of the other data blocks.
+    '''
+    _u8(data)[:] = _mult(_u8(q) ^ _u8(inter_q), _inverse(int(GFILOG[idx])))
+
+def recover_data_data(data1, data2, p, inter_p, q, inter_q, idx1, idx2):
+    '''
+    Recover two data blocks from P, Q and the P and Q of the other data blocks.
+    '''
+    g1 = int(GFILOG[idx2 - idx1])
+    g2 = _inverse(int(GFILOG[idx1]))
+    inverse = _inverse(g1 ^ 1)
+    a = int(MUL_TABLE[g1][inverse])
+    b = int(MUL_TABLE[g2][inverse])
+
+    p_sum = _u8(p) ^ _u8(inter_p)
+    d1 = _mult(p_sum, a) ^ _mult(_u8(q) ^ _u8(inter_q), b)
+    _u8(data1)[:] = d1
+    _u8(data2)[:] = p_sum ^ d1
+
+def recover_data_data_batch(data1, data2, p, q, data, width, idx1, idx2):
+    '''
+    Recover the data blocks idx1 < idx2 of a batch of stripes, data[k] holds the width - 2 surviving blocks
+    of stripe k. The P and Q of the surviving blocks are accumulated in one pass per stripe.
+    '''
+    g1 = int(GFILOG[idx2 - idx1])
+    g2 = _inverse(int(GFILOG[idx1]))
+    inverse = _inverse(g1 ^ 1)
+    mult_a = MUL_TABLE[int(MUL_TABLE[g1][inverse])]
+    mult_b = MUL_TABLE[int(MUL_TABLE[g2][inverse])]
+
+    for k in range(len(data)):
+        p_lanes = _lanes(p[k])
+        blocks = _blocks(data[k], p_lanes.shape[0], p_lanes.dtype)
+        acc_p = np.zeros_like(p_lanes)
+        acc_q = np.zeros_like(p_lanes)
+        survivor = width - 3
+        for i in range(width - 1, -1, -1):
+            acc_q = _mult2(acc_q)
+            if i != idx1 and i != idx2:
+                acc_p ^= blocks[survivor]
+                acc_q ^= blocks[survivor]
+                survivor -= 1
+        p_sum = _u8(p[k]) ^ acc_p.view(np.uint8)
+        d1 = mult_a[p_sum] ^ mult_b[_u8(q[k]) ^ acc_q.view(np.uint8)]
+        _u8(data1[k])[:] = d1
+        _u8(data2[k])[:] = p_sum ^ d1
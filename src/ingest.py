@@ -0,0 +1,169 @@
+import os
+import mmap
+import multiprocessing
+from collections import defaultdict
+from contextlib import ExitStack
+from dataclasses import dataclass
+from src.galois_field import cal_parity_8
+from src.raid6 import RAID6, find_parity_PQ_idx
+from src.utils import Disk
+
+
+@dataclass
+class StripeLayout:
+    '''
+    The part of the RAID6 configuration needed by the ingest workers.
+    '''
+    disk_paths: list
+    disk_size: int
+    block_size: int
+    data_disks: int
+    stripe_width: int
+
+
+# Per-process state of the ingest workers: the layout and the shared mmaps of the disk files
+_worker = {}
+
+def _init_worker(layout: StripeLayout):
+    _worker["layout"] = layout
+    _worker["files"] = [open(path, "r+b") for path in layout.disk_paths]
+    _worker["maps"] = [mmap.mmap(f.fileno(), layout.disk_size) for f in _worker["files"]]
+
+def _write_range(maps: list, data_idxs: list, base: int, block_size: int, stripe: bytearray, start: int, end: int):
+    '''
+    Write the stripe bytes [start, end) to the data blocks they belong to.
+    '''
+    while start < end:
+        block = start // block_size
+        stop = min(end, (block + 1) * block_size)
+        disk_offset = base + start - block * block_size
+        maps[data_idxs[block]][disk_offset : disk_offset + stop - start] = stripe[start:stop]
+        start = stop
+
+def _encode_stripes(tasks: list):
+    '''
+    Worker: write the pieces of each stripe into the disk mmaps and update its parity blocks.
+    Each task is (stripe idx, [(offset list, source path, source offset), ...]).
+    '''
+    layout = _worker["layout"]
+    maps = _worker["maps"]
+    block_size = layout.block_size
+    stripe = bytearray(block_size * layout.data_disks)
+    view = memoryview(stripe)
+    for stripe_idx, pieces in tasks:
+        (p_idx, q_idx), data_idxs = find_parity_PQ_idx(stripe_idx, layout.data_disks, layout.stripe_width)
+        base = stripe_idx * block_size
+
+        # A partial stripe keeps the data already stored in it
+        new_size = sum(size for offset_list, _, _ in pieces for _, size in offset_list)
+        if new_size != len(stripe):
+            for i, disk_idx in enumerate(data_idxs):
+                stripe[i * block_size : (i + 1) * block_size] = maps[disk_idx][base : base + block_size]
+
+        for offset_list, path, src_offset in pieces:
+            with open(path, "rb") as f:
+                f.seek(src_offset)
+                for offset, size in offset_list:
+                    f.readinto(view[offset : offset + size])
+                    _write_range(maps, data_idxs, base, block_size, stripe, offset, offset + size)
+
+        p = bytearray(block_size)
+        q = bytearray(block_size)
+        cal_parity_8(p, q, stripe)
+        maps[p_idx][base : base + block_size] = p
+        maps[q_idx][base : base + block_size] = q
+    return len(tasks)
+
+
+class BulkIngestor(object):
+    '''
+    Bulk ingest of many files into the RAID6 system with a pool of worker processes.
+    The coordinator allocates the stripes and claims the fragments of the whole batch, then hands ranges of
+    stripes to the workers, which read the source files and encode and write their stripes directly into
+    shared mmaps of the disk files. The extents are merged back into file2stripe once the batch is written.
+    The workers bypass the disk objects, so only a healthy array of local disk files can be ingested into.
+    '''
+    def __init__(self, raid6: RAID6, processes: int = None, chunk_stripes: int = 16):
+        self.raid6 = raid6
+        self.chunk_stripes = chunk_stripes
+        self._check_disks()
+        self.layout = StripeLayout(
+            disk_paths=[disk.path for disk in raid6.disks],
+            disk_size=raid6.stripe_num * raid6.block_size,
+            block_size=raid6.block_size,
+            data_disks=raid6.data_disks,
+            stripe_width=raid6.stripe_width,
+        )
+        self.pool = multiprocessing.Pool(processes, initializer=_init_worker, initargs=(self.layout,))
+
+    def _check_disks(self):
+        '''
+        Raise a ValueError unless every disk is a healthy local disk file and no stripe is degraded.
+        '''
+        raid6 = self.raid6
+        if any(type(disk) is not Disk for disk in raid6.disks):
+            raise ValueError("Bulk ingest needs local disk files, not disk nodes or spare rows, use save_data")
+        if not all(disk.status for disk in raid6.disks) or not all(all(stripe_status) for stripe_status in raid6.status):
+            raise ValueError("The RAID6 system is degraded, recover the disks before a bulk ingest")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def ingest(self, data_paths: list, names: list = None):
+        '''
+        Save a batch of files to the RAID6 system, the names default to the file paths.
+        '''
+        raid6 = self.raid6
+        if names is None:
+            names = list(data_paths)
+        if raid6.reshape is not None or raid6.stripe_width != self.layout.stripe_width:
+            raise ValueError("The RAID6 system was reshaped, bulk ingest needs a new ingestor")
+        self._check_disks()
+        sizes = [os.path.getsize(path) for path in data_paths]
+        if sum(sizes) > raid6.left_size:
+            raise ValueError("Not enough space in the RAID6 system")
+
+        with raid6._array_lock.read_locked():
+            plans = [raid6._plan_stripes(size) for size in sizes]
+            stripe_idxs = sorted(set(stripe_idx for plan in plans for stripe_idx in plan))
+
+            with ExitStack() as stack:
+                for stripe_idx in stripe_idxs:
+                    stack.enter_context(raid6._stripe_locks[stripe_idx].write_locked())
+
+                # Claim the fragments of the whole batch, the workers only move the data
+                stripe2pieces = defaultdict(list)
+                stripe_infos = []
+                for path, name, plan in zip(data_paths, names, plans):
+                    stripe_info = {}
+                    for stripe_idx, (src_offset, size) in plan.items():
+                        offset_list = raid6._claim_fragments(stripe_idx, size, name)
+                        stripe2pieces[stripe_idx].append((offset_list, path, src_offset))
+                        stripe_info[stripe_idx] = offset_list
+                    stripe_infos.append((name, stripe_info))
+
+                # The workers write behind the write-intent bitmap, so the coordinator marks for them
+                for stripe_idx in stripe_idxs:
+                    raid6._mark_dirty(stripe_idx)
+                tasks = [(stripe_idx, stripe2pieces[stripe_idx]) for stripe_idx in stripe_idxs]
+                chunks = [tasks[i : i + self.chunk_stripes] for i in range(0, len(tasks), self.chunk_stripes)]
+                encoded = sum(self.pool.imap_unordered(_encode_stripes, chunks))
+                assert encoded == len(tasks), "Something wrong with the ingest workers"
+                for stripe_idx in stripe_idxs:
+                    raid6._clear_dirty(stripe_idx)
+
+            # A name ingested again releases its old extents and loses its compression or dedup entry
+            file2stripe = {}
+            for name, stripe_info in stripe_infos:
+                raid6._replace_file(name, stripe_info=stripe_info)
+                file2stripe[name] = stripe_info
+
+        raid6.logger.info(f"Ingested {len(data_paths)} files into {len(stripe_idxs)} stripes")
+        return file2stripe
@@ -0,0 +1,174 @@
+'''
+I/O scheduling of the disks of the RAID6 system.
+Every request to a disk belongs to a class: foreground for the user reads and writes, rebuild for the disk
+recovery and the copy-back, background for the resync, the compaction and the reshape. The class is set per
+thread with io_class and carried over to the io threads with bind:
+    with io_class(REBUILD):
+        raid6.recover_disks()
+Each disk has a DiskScheduler that dispatches the waiting requests foreground first, in deadline order, and the
+rebuild and background ones only when no foreground request waits, at most at the rate of their token bucket.
+'''
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+FOREGROUND = "foreground"
+REBUILD = "rebuild"
+BACKGROUND = "background"
+PRIORITY = {FOREGROUND: 0, REBUILD: 1, BACKGROUND: 2}
+
+_context = threading.local()
+
+
+def current_class():
+    '''
+    Get the (class, latency budget in seconds or None) of the I/O of this thread.
+    '''
+    return getattr(_context, "io_class", (FOREGROUND, None))
+
+@contextmanager
+def io_class(name: str, budget: float = None):
+    '''
+    Run the I/O of this thread in a class, budget overrides the latency budget of foreground requests.
+    '''
+    if name not in PRIORITY:
+        raise ValueError(f"Unknown I/O class {name}")
+    previous = current_class()
+    _context.io_class = (name, budget)
+    try:
+        yield
+    finally:
+        _context.io_class = previous
+
+def bind(func):
+    '''
+    Wrap a function to run it in the I/O class of the calling thread, for the calls handed to an executor.
+    '''
+    name, budget = current_class()
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with io_class(name, budget):
+            return func(*args, **kwargs)
+    return wrapper
+
+def scheduled(size):
+    '''
+    Route a disk method through the scheduler of its disk, size(*args) gives the bytes of the request.
+    A call made while the thread already holds a dispatch slot, like the fallback of readv, is not queued again.
+    '''
+    def decorator(func):
+        @wraps(func)
+        def wrapper(self, *args):
+            scheduler = self.scheduler
+            if scheduler is None or getattr(_context, "dispatched", False):
+                return func(self, *args)
+            return scheduler.run(size(*args), func, self, *args)
+        return wrapper
+    return decorator
+
+
+class TokenBucket:
+    '''
+    Rate limit of rate bytes per second with bursts of up to burst bytes.
+    A request larger than the burst drives the bucket negative and the next ones wait for the refill.
+    '''
+    def __init__(self, rate: float, burst: float = None):
+        self.rate = rate
+        self.burst = rate if burst is None else burst
+        self.tokens = self.burst
+        self._last = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def delay(self, size: int):
+        '''
+        Get the seconds to wait before size bytes can be sent, 0 if they can be sent now.
+        '''
+        self._refill()
+        need = min(size, self.burst)
+        return 0 if self.tokens >= need else (need - self.tokens) / self.rate
+
+    def consume(self, size: int):
+        self._refill()
+        self.tokens -= size
+
+
+class DiskScheduler:
+    '''
+    Dispatch the requests of one disk by class, at most depth of them run at once.
+    The waiting requests are ordered by class, the foreground ones by deadline (arrival + latency budget) and the
+    others by arrival. A rebuild or background request only runs when no foreground request waits or runs, and
+    after its token bucket allows it, so the foreground latency is bounded by one background request.
+    '''
+    def __init__(self, depth: int = 1, latency_budget: float = 0.05, rates: dict = None):
+        self.depth = depth
+        self.latency_budget = latency_budget
+        self.buckets = {name: TokenBucket(rate) for name, rate in (rates or {}).items() if rate}
+        self.stats = {name: {"requests": 0, "bytes": 0, "wait": 0.0, "missed": 0} for name in PRIORITY}
+        self._cond = threading.Condition()
+        self._waiting = [] # heap of (priority, deadline, seq)
+        self._seq = itertools.count()
+        self._inflight = {name: 0 for name in PRIORITY}
+
+    def _can_dispatch(self, name: str):
+        if sum(self._inflight.values()) >= self.depth:
+            return False
+        return name == FOREGROUND or self._inflight[FOREGROUND] == 0
+
+    def run(self, size: int, func, *args):
+        '''
+        Wait for the turn of a request of size bytes, then run func(*args) and return its result.
+        '''
+        name, budget = current_class()
+        arrival = time.monotonic()
+        deadline = arrival + (self.latency_budget if budget is None else budget)
+        entry = (PRIORITY[name], deadline if name == FOREGROUND else arrival, next(self._seq))
+        bucket = self.buckets.get(name)
+        with self._cond:
+            heapq.heappush(self._waiting, entry)
+            while True:
+                if self._waiting[0] is entry and self._can_dispatch(name):
+                    delay = 0 if bucket is None else bucket.delay(size)
+                    if delay <= 0:
+                        break
+                    self._cond.wait(delay)
+                else:
+                    self._cond.wait()
+            heapq.heappop(self._waiting)
+            self._inflight[name] += 1
+            if bucket is not None:
+                bucket.consume(size)
+            # The next request may fit under the queue depth too
+            self._cond.notify_all()
+
+        stats = self.stats[name]
+        stats["wait"] += time.monotonic() - arrival
+        _context.dispatched = True
+        try:
+            return func(*args)
+        finally:
+            _context.dispatched = False
+            with self._cond:
+                self._inflight[name] -= 1
+                stats["requests"] += 1
+                stats["bytes"] += size
+                if name == FOREGROUND and time.monotonic() > deadline:
+                    stats["missed"] += 1
+                self._cond.notify_all()
+
+    def set_rate(self, name: str, rate: float = None):
+        '''
+        Change the rate limit of a class in bytes per second, None removes it.
+        '''
+        with self._cond:
+            if rate:
+                self.buckets[name] = TokenBucket(rate)
+            else:
+                self.buckets.pop(name, None)
+            self._cond.notify_all()
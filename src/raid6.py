@@ -3,10 +3,21 @@ import numpy as np
 from copy import deepcopy
 import logging
 # from clib.galois_field import cal_parity_8, cal_parity_p, cal_parity_q_8, cal_parity_q, q_recover_data, recover_data_data
-from src.clib.galois_field import cal_parity_8, cal_parity_p, cal_parity_q_8, cal_parity_q, q_recover_data, recover_data_data
-from src.utils import Disk, RAID6Config, merge_tuples
+from src.galois_field import cal_parity_8, cal_parity_8_mask, cal_parity_p, cal_parity_q_8, cal_parity_q, q_recover_data, recover_data_data_batch
+from src.cache import StripeCache
+from src.compression import choose_codec, compress, decompress_span
+from src.dedup import DedupIndex, cdc_chunks, chunk_key, chunk_name, fixed_chunks
+from src.extents import FileTable, NameTable, StripeTable
+from src.readahead import Readahead
+from src.qos import BACKGROUND, REBUILD, DiskScheduler, bind, io_class
+from src.remote import RemoteDisk
+from src.utils import BufferPool, Disk, RAID6Config, ReshapeState, RWLock, Snapshot, SpareDisk, SpareState, WriteIntentBitmap, merge_tuples
 from sortedcontainers import SortedList
 from enum import Enum
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from functools import wraps
+import threading
 import time
 
 # only use to check parity
@@ -27,6 +38,68 @@ class FailCode(Enum):
     CORUCPTED = 7
     GOOD = 8
 
+# Locking decorators of the RAID6 methods
+# Lock order: array lock -> dedup lock -> stripe locks (ascending) -> allocator lock
+def array_shared(func):
+    '''
+    Run the method while holding the array lock in shared mode.
+    '''
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        with self._array_lock.read_locked():
+            return func(self, *args, **kwargs)
+    return wrapper
+
+def array_exclusive(func):
+    '''
+    Run the method alone in the RAID6 system.
+    '''
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        with self._array_lock.write_locked():
+            return func(self, *args, **kwargs)
+    return wrapper
+
+def stripe_shared(func):
+    '''
+    Run the method while holding the lock of the stripe in the first argument in shared mode.
+    '''
+    @wraps(func)
+    def wrapper(self, stripe_idx, *args, **kwargs):
+        with self._array_lock.read_locked(), self._stripe_locks[stripe_idx].read_locked():
+            return func(self, stripe_idx, *args, **kwargs)
+    return wrapper
+
+def stripe_exclusive(func):
+    '''
+    Run the method while holding the lock of the stripe in the first argument in exclusive mode.
+    '''
+    @wraps(func)
+    def wrapper(self, stripe_idx, *args, **kwargs):
+        with self._array_lock.read_locked(), self._stripe_locks[stripe_idx].write_locked():
+            return func(self, stripe_idx, *args, **kwargs)
+    return wrapper
+
+def find_parity_PQ_idx(stripe_idx: int, data_disks: int, stripe_width: int):
+    '''
+    Find the parity disk index for P and Q of a stripe, the parity blocks rotate among the disks.
+    '''
+    base = data_disks + stripe_idx
+    p_idx = base % stripe_width
+    q_idx = (base + 1) % stripe_width
+    data_idxs = [i for i in range(stripe_width) if i not in [p_idx, q_idx]]
+    return (p_idx, q_idx), data_idxs
+
+def allocator(func):
+    '''
+    Run the method while holding the allocator lock, which guards file2stripe, stripe_status and left_size.
+    '''
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        with self._array_lock.read_locked(), self._alloc_lock:
+            return func(self, *args, **kwargs)
+    return wrapper
+
 
 class RAID6(object):
     '''
@@ -44,6 +117,15 @@ class RAID6(object):
     +--------+--------+--------+--------+--------+--------+
     ...
 
+    The system can be used from multiple threads:
+    * the allocator lock guards file2stripe, stripe_status and left_size and is only held for bookkeeping
+    * each stripe has a reader/writer lock guarding its stripe2file entry, data blocks and parity blocks
+    * the array lock is shared by the normal operations, modify_data and the disk recovery hold it alone
+
+    With spare_disks > 0 the last rows of every disk are reserved as spare space instead of holding stripes.
+    A failed disk is then served by a SpareDisk whose blocks are spread over the spare rows of the other disks,
+    so its rebuild writes go to all the survivors instead of one replacement disk. Once a replacement is attached
+    with replace_disk, a CopyBack (src/spare.py) moves the blocks back to it in the background.
     '''
     def __init__(self, config: RAID6Config):
         # Initialize the RAID6 system configuration
@@ -53,16 +135,31 @@ class RAID6(object):
         # self.stripe_width = config.stripe_width
         self.stripe_width = self.data_disks + self.parity_disks
         self.block_size = config.block_size
-        self.stripe_num = config.disk_size // self.block_size
+        self.disk_size = config.disk_size
+        # Reserve enough spare rows on every disk to hold the blocks of spare_disks failed disks
+        self.spare_disks = config.spare_disks
+        disk_rows = config.disk_size // self.block_size
+        self.spare_rows = -(-self.spare_disks * disk_rows // self.stripe_width)
+        self.stripe_num = disk_rows - self.spare_rows
         self.stripe_size = self.block_size * self.data_disks
         
         # Create folders for data and parity disks
         if not os.path.exists(self.data_path):
             os.makedirs(self.data_path, exist_ok=True)
         
-        self.disks = [Disk(config.data_path, config.disk_size, id=_) for _ in range(self.stripe_width)]
-        self.file2stripe = {} # use to track the file storage location
-        self.stripe2file = [{0: [None, self.stripe_size]} for _ in range(self.stripe_num)] # use to track the stripe and the file
+        if config.disk_nodes is not None:
+            self.disks = [RemoteDisk(node, config.disk_size, id=_) for _, node in enumerate(config.disk_nodes)]
+        else:
+            self.disks = [Disk(config.data_path, config.disk_size, id=_) for _ in range(self.stripe_width)]
+        # Schedule the I/O of every disk, the user requests go before the rebuild and background ones
+        if config.qos:
+            rates = {REBUILD: config.qos_rebuild_rate, BACKGROUND: config.qos_background_rate}
+            for disk in self.disks:
+                disk.scheduler = DiskScheduler(config.qos_depth, config.qos_latency_ms / 1000, rates)
+        # The extent tables share the interned file names
+        self.names = NameTable()
+        self.file2stripe = FileTable(self.names) # use to track the file storage location
+        self.stripe2file = StripeTable(self.stripe_num, self.stripe_size, self.names) # use to track the stripe and the file
         self.stripe_status = SortedList() # use to track the stripe status
         self.left_size = self.stripe_num * self.stripe_size # use to track the left size of the total raid6 system
         self.status = [[True for _ in range(self.stripe_width)] for _ in range(self.stripe_num)] # use to track the disk status
@@ -70,6 +167,66 @@ class RAID6(object):
         # Init idle stripe status
         for i in range(self.stripe_num):
             self.stripe_status.add((self.stripe_size, i)) # ordered list
+        # Data blocks known to be zero on disk, the parity is computed without reading them.
+        # Only the blocks of newly created disks are, until a fragment in them is claimed.
+        fresh = all(getattr(disk, "created", False) for disk in self.disks)
+        self.zero_blocks = np.full((self.stripe_num, self.data_disks), fresh, dtype=bool)
+        # Stripes with freed extents, their data blocks freed as a whole are punched by discard_freed
+        self.discard = config.discard
+        self.discard_pending = set()
+
+        self._alloc_lock = threading.Lock()
+        self._stripe_locks = [RWLock() for _ in range(self.stripe_num)]
+        self._array_lock = RWLock()
+
+        # Reusable buffers for the parity and stripe data of the read, encode and recover paths
+        self.block_pool = BufferPool(self.block_size)
+        self.stripe_pool = BufferPool(self.stripe_size)
+        # A rebuild batch is carved from one buffer, a stripe and 4 blocks (P, Q and the 2 rebuilt ones) per stripe
+        self.rebuild_batch = config.rebuild_batch
+        self.rebuild_pool = BufferPool(max(self.rebuild_batch, 1) * (self.data_disks + 4) * self.block_size)
+
+        # Background reads of the sequential readers
+        self.readahead_stripes = config.readahead_stripes
+        self.prefetch_executor = ThreadPoolExecutor(max_workers=self.stripe_width, thread_name_prefix="raid6-prefetch")
+
+        # Hedged reads of the data blocks, a slow read is raced against its reconstruction from P
+        self.hedged_reads = config.hedged_reads
+        self.hedge_min = config.hedge_min_ms / 1000
+        self.hedge_factor = config.hedge_factor
+        self.slow_disk_factor = config.slow_disk_factor
+        self.hedge_executor = ThreadPoolExecutor(max_workers=4 * self.stripe_width, thread_name_prefix="raid6-hedge")
+
+        # Inline compression of the saved files, name -> CompressionInfo of the compressed ones
+        self.compression = config.compression
+        self.compression_chunk = config.compression_chunk
+        self.compressed = {}
+        self.compress_executor = ThreadPoolExecutor(max_workers=os.cpu_count(), thread_name_prefix="raid6-compress")
+
+        # Deduplication, the distinct chunks are stored once and a file is the recipe of its chunk ids
+        self.dedup = None
+        self.recipes = {}
+        self.dedup_chunk = config.dedup_chunk
+        self.dedup_chunking = config.dedup_chunking
+        self._dedup_lock = threading.RLock()
+        if config.dedup:
+            self.dedup = DedupIndex(os.path.join(self.data_path, "dedup_index.npz"))
+            # The chunk extents and the recipes live in memory, an index entry left by an earlier run points to
+            # a chunk that is not stored and would be referenced without writing it
+            if self.dedup.retain(lambda chunk_id: chunk_name(chunk_id) in self.file2stripe) > 0:
+                self.dedup.save()
+
+        # Extents shared by clones and snapshots, (stripe idx, offset) -> reference count, absent means one
+        self.extent_refs = {}
+        self.snapshots = {}
+
+        # Stripe lines cached on a fast local device, opened once the array is consistent
+        self.cache = None
+
+        # The blocks of a stripe on disk nodes are read and written in parallel, local disks are served in turn
+        self.io_executor = None
+        if config.disk_nodes is not None:
+            self.io_executor = ThreadPoolExecutor(max_workers=self.stripe_width, thread_name_prefix="raid6-io")
 
         self.logger = logging.getLogger(self.__class__.__name__)
         self.logger.setLevel(logging.INFO)
@@ -77,6 +234,37 @@ class RAID6(object):
         file_handler.setFormatter(logging.Formatter('%(asctime)s - Func: %(name)s.%(funcName)s - [%(levelname)s] - %(message)s'))
         self.logger.addHandler(file_handler)
         self.logger.info(f"RAID6 system initialized with {self.data_disks} data disks and {self.parity_disks} parity disks")
+        if config.disk_nodes is not None:
+            self.logger.info(f"Disks served by the nodes {', '.join(config.disk_nodes)}")
+
+        # Serve the failed disks from the spare rows again
+        self.spare_path = os.path.join(self.data_path, "spare.json")
+        self.spare = SpareState.load(self.spare_path) if os.path.exists(self.spare_path) else SpareState()
+        for disk_idx, rows in self.spare.rows.items():
+            self.disks[disk_idx] = SpareDisk(self.disks, rows, self.block_size, self.disks[disk_idx])
+            if disk_idx in self.spare.replaced:
+                self.disks[disk_idx].replacement = self.disks[disk_idx].disk
+
+        # Pick up an interrupted reshape, its migrated stripes already use the new layout
+        self.reshape = None
+        reshape_path = os.path.join(self.data_path, "reshape.json")
+        if os.path.exists(reshape_path):
+            state = ReshapeState.load(reshape_path)
+            if state.old_data_disks != self.data_disks:
+                raise ValueError(f"A reshape from {state.old_data_disks} data disks is in progress")
+            self._attach_reshape(state)
+            self.logger.info(f"Reshape to {state.new_data_disks} data disks in progress at stripe {state.position}")
+
+        # Resync the stripes left dirty by an interrupted run
+        self.bitmap = None
+        if config.write_intent_bitmap:
+            self.bitmap = WriteIntentBitmap(os.path.join(self.data_path, "write_intent.bitmap"), self.stripe_num, config.bitmap_region_stripes)
+            self.resync()
+
+        # Write back the dirty lines left in the cache by an interrupted run
+        if config.cache_path is not None:
+            self.cache = StripeCache(config.cache_path, config.cache_size, self.stripe_size, self._write_full_stripe, config.cache_admit_min)
+            self.flush_cache()
 
     def get_disk_status(self):
         '''
@@ -90,16 +278,53 @@ class RAID6(object):
         '''
         return self.stripe_width
 
+    def _attach_reshape(self, state: ReshapeState):
+        '''
+        Attach the disks added by a reshape, the stripes below state.position use the new layout from now on.
+        '''
+        new_width = state.new_data_disks + self.parity_disks
+        for disk_idx in range(len(self.disks), new_width):
+            self.disks.append(Disk(self.data_path, self.disk_size, id=disk_idx))
+        for stripe_status in self.status:
+            stripe_status += [True] * (new_width - len(stripe_status))
+        self.stripe_pool = BufferPool(state.new_data_disks * self.block_size)
+        self.rebuild_pool = BufferPool(max(self.rebuild_batch, 1) * (state.new_data_disks + 4) * self.block_size)
+        # The restriped blocks are rewritten as a whole, none is known to be zero any more
+        self.zero_blocks = np.zeros((self.stripe_num, state.new_data_disks), dtype=bool)
+        self.reshape = state
+
+    def _stripe_geometry(self, stripe_idx: int):
+        '''
+        Get the number of data disks and the stripe width of the layout a stripe is stored in.
+        '''
+        if self.reshape is not None and stripe_idx < self.reshape.position:
+            return self.reshape.new_data_disks, self.reshape.new_data_disks + self.parity_disks
+        return self.data_disks, self.stripe_width
+
     def _find_parity_PQ_idx(self, stripe_idx: int):
         '''
         Find the parity disk index for P and Q.
         '''
-        base = self.data_disks + stripe_idx
-        p_idx = base % self.stripe_width
-        q_idx = (base + 1) % self.stripe_width
-        data_idxs = [i for i in range(self.stripe_width) if i not in [p_idx, q_idx]]
-        return (p_idx, q_idx), data_idxs
+        return find_parity_PQ_idx(stripe_idx, *self._stripe_geometry(stripe_idx))
     
+    def _mark_dirty(self, stripe_idx: int):
+        '''
+        Record in the write-intent bitmap that the blocks of a stripe are about to be written.
+        The cached line of the stripe is written back and dropped first.
+        '''
+        if self.cache is not None:
+            self.cache.invalidate(stripe_idx)
+        if self.bitmap is not None:
+            self.bitmap.mark(stripe_idx)
+
+    def _clear_dirty(self, stripe_idx: int):
+        '''
+        Record that the data and parity blocks of a stripe are consistent again.
+        A failed write never gets here, so its stripe stays dirty until the next resync.
+        '''
+        if self.bitmap is not None:
+            self.bitmap.clear(stripe_idx)
+
     def _cal_disk_and_offset(self, stripe_idx: int, offset: int):
         '''
         Calculate the disk idx and the offset in the disk.
@@ -110,30 +335,45 @@ class RAID6(object):
         pq_index, data_index = self._find_parity_PQ_idx(stripe_idx)
         return data_index[disk_idx], offset % self.block_size + stripe_idx * self.block_size
 
-    def _handle_fragment(self, size: int):
+    def _handle_fragment(self, size: int, data_offset: int = 0):
         '''
-        [TODO]
-        Handle the fragment circumstance.
+        Handle the fragment circumstance: no single stripe can hold the rest of the data,
+        so it is spread over the stripes with the most free space.
+        The caller holds the allocator lock, return the stripe idx -> (data offset, size) mapping.
         '''
-        raise NotImplementedError("Not implemented yet")
-        return {} # return stripe the data spilition mapping
+        stripe2data = {}
+        while size > 0:
+            if len(self.stripe_status) == 0:
+                raise ValueError("Not enough space in the RAID6 system")
+            free, stripe_idx = self.stripe_status.pop()
+            inn_size = min(free, size)
+            stripe2data[stripe_idx] = (data_offset, inn_size)
+            if free > inn_size:
+                self.stripe_status.add((free - inn_size, stripe_idx))
+            data_offset += inn_size
+            size -= inn_size
+        return stripe2data
     
     def _merge_fragment(self, stripe_idx: int):
         '''
-        [TODO]
-        Merge the continuous idle fragments.
+        Merge the continuous idle fragments of a stripe, the fragments are sorted by offset.
+        The caller holds the stripe lock.
         '''
-        raise NotImplementedError("Not implemented yet")
+        self.stripe2file.merge(stripe_idx)
     
     def _process_offset_list(self, stripe_idx: int, offset_list: list, mode: str, stripe_data: bytearray, idxs: list=None):
         '''
         Handle the offset list for a stripe.
         '''
+        if mode == "read" and self.cache is not None:
+            self.cache.clean(stripe_idx)
         if idxs is None:
             (p_idx, q_idx), data_disk_idxs = self._find_parity_PQ_idx(stripe_idx)
         else:
             p_idx, q_idx, data_disk_idxs = idxs
         
+        stripe_view = memoryview(stripe_data)
+        disk_pieces = {}
         stripe_data_offset = 0
         for offset, size in offset_list:
             start_disk_idx, start_disk_offset = self._cal_disk_and_offset(stripe_idx, offset)
@@ -148,66 +388,227 @@ class RAID6(object):
                 # Find process size
                 process_size = end_disk_offset - disk_offset + 1 if disk_idx == end_disk_idx else self.block_size * (stripe_idx + 1) - disk_offset
 
-                # Process the data
-                if mode == "read":
-                    stripe_data[stripe_data_offset : stripe_data_offset + process_size] = self.disks[disk_idx].read(disk_offset, process_size)
-                else:
-                    self.disks[disk_idx].write(disk_offset, stripe_data[stripe_data_offset : stripe_data_offset + process_size])
+                # Group the pieces by disk
+                disk_pieces.setdefault(disk_idx, []).append((disk_offset, stripe_view[stripe_data_offset : stripe_data_offset + process_size]))
                 stripe_data_offset += process_size
         assert stripe_data_offset == len(stripe_data), "Something wrong with the process offset list"
+
+        # Process the data, one vectored call per disk
+        if mode == "read":
+            self._read_pieces(stripe_idx, disk_pieces, [p_idx, q_idx, data_disk_idxs])
+        else:
+            self._fan_out([(self.disks[disk_idx].writev, pieces) for disk_idx, pieces in disk_pieces.items()])
     
-    def _distribute_stripe(self, stripe_idx: int, stripe_data: bytearray, file_name: str):
+    def _fan_out(self, calls: list):
         '''
-        Distribute a stripe of data to the RAID6 system.
+        Run the (function, *args) disk calls, in parallel on the io executor if any, return their results.
         '''
-        # Assume the stripe data is less than the left capacity
-        self.logger.info(f'Distribute stripe {stripe_idx} with data size {len(stripe_data)}')
+        if self.io_executor is None or len(calls) < 2:
+            return [call[0](*call[1:]) for call in calls]
+        futures = [self.io_executor.submit(bind(call[0]), *call[1:]) for call in calls]
+        return [future.result() for future in futures]
+
+    def _hedge_threshold(self):
+        '''
+        Get the latency in seconds after which a data block read is hedged.
+        '''
+        ewmas = sorted(disk.latency.ewma for disk in self.disks)
+        return max(self.hedge_min, self.hedge_factor * ewmas[len(ewmas) // 2])
+
+    def _reconstruct_piece(self, stripe_idx: int, disk_idx: int, disk_offset: int, size: int, idxs: list):
+        '''
+        Reconstruct a piece of a data block from P and the same columns of the other data blocks.
+        '''
+        p_idx, _, data_disk_idxs = idxs
+        base = stripe_idx * self.block_size
+        # Align the column range for the uint64 parity kernel
+        start = (disk_offset - base) // 8 * 8
+        finish = min(self.block_size, (disk_offset - base + size + 7) // 8 * 8)
+        piece = bytearray(self.disks[p_idx].read(base + start, finish - start))
+        others = bytearray(0)
+        for inn_disk_idx in data_disk_idxs:
+            if inn_disk_idx != disk_idx:
+                others += self.disks[inn_disk_idx].read(base + start, finish - start)
+        cal_parity_p(piece, others)
+        return piece[disk_offset - base - start : disk_offset - base - start + size]
+
+    def _read_private(self, disk_idx: int, pieces: list):
+        '''
+        Read the pieces of a disk into new buffers, return None if the disk failed.
+        '''
+        buffers = [bytearray(out.nbytes) for _, out in pieces]
+        if not self.disks[disk_idx].readv([(disk_offset, buffer) for (disk_offset, _), buffer in zip(pieces, buffers)]):
+            return None
+        return buffers
+
+    def _reconstruct_pieces(self, stripe_idx: int, disk_idx: int, pieces: list, idxs: list):
+        return [self._reconstruct_piece(stripe_idx, disk_idx, disk_offset, out.nbytes, idxs) for disk_offset, out in pieces]
+
+    def _read_pieces(self, stripe_idx: int, disk_pieces: dict, idxs: list):
+        '''
+        Read the (disk offset, out view) pieces of the data disks of a stripe.
+        With hedged reads the disks are read in parallel, and a disk slower than the hedge threshold is raced
+        against the reconstruction of its pieces from P and the other data blocks, whichever finishes first wins.
+        Degraded stripes are read directly.
+        '''
+        p_idx, _, data_disk_idxs = idxs
+        if not self.hedged_reads or not all(self.status[stripe_idx][i] for i in data_disk_idxs + [p_idx]):
+            self._fan_out([(self.disks[disk_idx].readv, pieces) for disk_idx, pieces in disk_pieces.items()])
+            return
+
+        # The loser keeps running after the return, so both sides read into private buffers
+        primaries = {disk_idx: self.hedge_executor.submit(bind(self._read_private), disk_idx, pieces) for disk_idx, pieces in disk_pieces.items()}
+        deadline = time.perf_counter() + self._hedge_threshold()
+        for disk_idx, pieces in disk_pieces.items():
+            primary = primaries[disk_idx]
+            done, _ = wait([primary], timeout=max(0, deadline - time.perf_counter()))
+            if len(done) == 0:
+                self.disks[disk_idx].latency.hedges += 1
+                hedge = self.hedge_executor.submit(bind(self._reconstruct_pieces), stripe_idx, disk_idx, pieces, idxs)
+                done, _ = wait([primary, hedge], return_when=FIRST_COMPLETED)
+            winner = primary if primary in done else done.pop()
+            datas = winner.result()
+            if datas is None:
+                # The disk failed under the read
+                datas = self._reconstruct_pieces(stripe_idx, disk_idx, pieces, idxs)
+            for (_, out), data in zip(pieces, datas):
+                out[:] = data
+
+    def slow_disks(self, min_samples: int = 32):
+        '''
+        Find the disks whose average read latency is above slow_disk_factor times the median of the array,
+        they are candidates for a proactive replacement.
+        '''
+        tracked = [(disk_idx, disk.latency.ewma) for disk_idx, disk in enumerate(self.disks) if disk.latency.count >= min_samples]
+        if len(tracked) < 3:
+            return []
+        median = sorted(ewma for _, ewma in tracked)[len(tracked) // 2]
+        return [disk_idx for disk_idx, ewma in tracked if ewma > self.slow_disk_factor * median]
+
+    def disk_latency_stats(self):
+        '''
+        Get the read latency statistics of every disk, the latencies are in seconds.
+        '''
+        return [disk.latency.stats() for disk in self.disks]
+
+    def io_stats(self):
+        '''
+        Get the requests, bytes, queueing time in seconds and missed foreground deadlines of every I/O class
+        of every scheduled disk.
+        '''
+        return [disk.scheduler.stats for disk in self.disks if getattr(disk, "scheduler", None) is not None]
+
+    def set_io_rate(self, name: str, rate: int = None):
+        '''
+        Change the rate limit in bytes per second per disk of the rebuild or background I/O, None removes it.
+        '''
+        for disk in self.disks:
+            if getattr(disk, "scheduler", None) is not None:
+                disk.scheduler.set_rate(name, rate)
 
+    @stripe_exclusive
+    def _claim_fragments(self, stripe_idx: int, size: int, file_name: str):
+        '''
+        Claim size bytes of the free fragments of a stripe for a file, return the claimed offset list.
+        '''
         # Find the offset to write the stripe data
-        left_size = len(stripe_data)
+        left_size = size
         offset_list = []
-        for offset, info in self.stripe2file[stripe_idx].items():
-            if info[0] is None:
-                self.stripe2file[stripe_idx][offset][0] = file_name
-                if info[1] > left_size:
+        for offset, name, fragment_size in self.stripe2file.fragments(stripe_idx):
+            if name is None:
+                if fragment_size > left_size:
                     offset_list.append((offset, left_size))
                     # update the stripe2file, split the fragment
-                    self.stripe2file[stripe_idx][offset + left_size] = [None, info[1] - deepcopy(left_size)]
-                    self.stripe2file[stripe_idx][offset][1] = deepcopy(left_size)
+                    self.stripe2file.set(stripe_idx, offset, file_name, left_size)
+                    self.stripe2file.set(stripe_idx, offset + left_size, None, fragment_size - left_size)
                     left_size = 0
                     break
-                elif info[1] < left_size:
-                    offset_list.append((offset, info[1]))
-                    left_size -= info[1]
-                else:
-                    offset_list.append((offset, left_size))
-                    left_size = 0
+                self.stripe2file.set(stripe_idx, offset, file_name, fragment_size)
+                offset_list.append((offset, fragment_size))
+                left_size -= fragment_size
+                if left_size == 0:
                     break
         assert left_size == 0, "Something wrong with the distributed stripe data"
+        self._claim_blocks(stripe_idx, offset_list)
+        return offset_list
+
+    def _claim_blocks(self, stripe_idx: int, offset_list: list):
+        '''
+        Mark the data blocks holding the extents as no longer zero, before the data is written.
+        The caller holds the stripe lock.
+        '''
+        for offset, size in offset_list:
+            if size > 0:
+                self.zero_blocks[stripe_idx, offset // self.block_size : (offset + size - 1) // self.block_size + 1] = False
+
+    def _stripe_parity(self, stripe_idx: int, idxs: list, p, q, stripe_buffer):
+        '''
+        Compute P and Q of a stripe from the data blocks on the disks into p and q.
+        The blocks known to be zero are left out of the presence mask and not read.
+        The caller holds the stripe lock.
+        '''
+        p_idx, q_idx, data_disk_idxs = idxs
+        mask = (~self.zero_blocks[stripe_idx, :len(data_disk_idxs)]).tolist()
+        if all(mask) or not all(self.status[stripe_idx][disk_idx] for disk_idx in data_disk_idxs):
+            _, _, stripe_data, _ = self._load_stripes(stripe_idx, idxs=idxs, out=stripe_buffer)
+            cal_parity_8(p, q, stripe_data)
+            return
+        if self.cache is not None:
+            self.cache.clean(stripe_idx)
+        stripe_view = memoryview(stripe_buffer)[: len(data_disk_idxs) * self.block_size]
+        disk_offset = stripe_idx * self.block_size
+        self._fan_out([(self.disks[disk_idx].readinto, disk_offset, stripe_view[block * self.block_size : (block + 1) * self.block_size])
+                       for block, disk_idx in enumerate(data_disk_idxs) if mask[block]])
+        cal_parity_8_mask(p, q, stripe_view, mask)
+
+    @stripe_exclusive
+    def _distribute_stripe(self, stripe_idx: int, stripe_data: bytearray, file_name: str):
+        '''
+        Distribute a stripe of data to the RAID6 system.
+        '''
+        # Assume the stripe data is less than the left capacity
+        self.logger.info(f'Distribute stripe {stripe_idx} with data size {len(stripe_data)}')
+        offset_list = self._claim_fragments(stripe_idx, len(stripe_data), file_name)
 
         # Write the stripe data to the disks
         (p_idx, q_idx), data_disk_idxs = self._find_parity_PQ_idx(stripe_idx)
+        self._mark_dirty(stripe_idx)
         self._process_offset_list(stripe_idx, offset_list, "write", stripe_data, idxs=[p_idx, q_idx, data_disk_idxs])
 
-        # Update the parity blocks
-        p = bytearray(self.block_size)
-        q = bytearray(self.block_size)
-        if len(stripe_data) != self.stripe_size:
-            _, _, stripe_data, _ = self._load_stripes(stripe_idx, idxs=[p_idx, q_idx, data_disk_idxs])
-
-        cal_parity_8(p, q, stripe_data)
+        # Update the parity blocks, the blocks known to be zero are not read
+        with self.block_pool.buffer() as p, self.block_pool.buffer() as q, self.stripe_pool.buffer() as stripe_buffer:
+            if len(stripe_data) != self.stripe_size:
+                self._stripe_parity(stripe_idx, [p_idx, q_idx, data_disk_idxs], p, q, stripe_buffer)
+            else:
+                cal_parity_8(p, q, stripe_data)
 
-        # Write back the parity blocks
-        self.disks[p_idx].write(stripe_idx * self.block_size, p)
-        self.disks[q_idx].write(stripe_idx * self.block_size, q)
+            # Write back the parity blocks
+            self.disks[p_idx].write(stripe_idx * self.block_size, p)
+            self.disks[q_idx].write(stripe_idx * self.block_size, q)
+        self._clear_dirty(stripe_idx)
         
         return offset_list
 
-    def _distribute_data(self, data: bytearray, file_name: str):
+    def _write_full_stripe(self, stripe_idx: int, stripe_data: bytearray):
         '''
-        Distribute data to the RAID6 system.
+        Write a whole stripe of data and its parity blocks, no block is read back.
+        The caller holds the stripe lock.
+        '''
+        (p_idx, q_idx), data_disk_idxs = self._find_parity_PQ_idx(stripe_idx)
+        self._mark_dirty(stripe_idx)
+        self._process_offset_list(stripe_idx, [(0, self.stripe_size)], "write", stripe_data, idxs=[p_idx, q_idx, data_disk_idxs])
+        with self.block_pool.buffer() as p, self.block_pool.buffer() as q:
+            cal_parity_8(p, q, stripe_data)
+            self.disks[p_idx].write(stripe_idx * self.block_size, p)
+            self.disks[q_idx].write(stripe_idx * self.block_size, q)
+        self._clear_dirty(stripe_idx)
+
+    @allocator
+    def _plan_stripes(self, data_size: int):
+        '''
+        Allocate the stripes for data_size bytes, return a mapping of stripe idx -> (data offset, size).
+        Only the allocator state (stripe_status, left_size) is updated, the fragments are claimed by _claim_fragments.
         '''
-        data_size = len(data)
         if data_size > self.left_size:
             raise ValueError("Not enough space in the RAID6 system")
 
@@ -222,64 +623,129 @@ class RAID6(object):
         for idx, size in enumerate(stripe_data_size):
             # Handle the fragment circumstance
             if size > self.stripe_status[-1][0]:
-                stripe2data.update(self._handle_fragment(data_size - idx * self.stripe_size))
+                stripe2data.update(self._handle_fragment(data_size - idx * self.stripe_size, idx * self.stripe_size))
                 break
             
             # Handle the normal circumstance
             if size == self.stripe_size:
-                stripe2data[self.stripe_status.pop()[1]] = data[idx * self.stripe_size : (idx + 1) * self.stripe_size] # pop the last stripe
+                stripe2data[self.stripe_status.pop()[1]] = (idx * self.stripe_size, size) # pop the last stripe
             else:
                 for idx_sorted, stripe in enumerate(self.stripe_status):
                     if size <= stripe[0]:
-                        stripe2data[stripe[1]] = data[idx * self.stripe_size : idx * self.stripe_size + size]
+                        stripe2data[stripe[1]] = (idx * self.stripe_size, size)
                         break
                 # Update the stripe status
                 stripe = self.stripe_status.pop(idx_sorted)
                 if stripe[0] > size:
                     self.stripe_status.add((stripe[0] - size, stripe[1]))
         
+        self.left_size -= data_size
+        return stripe2data
+
+    def _allocate_stripes(self, data: bytearray):
+        '''
+        Allocate the stripes for the data and split the data among them.
+        '''
+        plan = self._plan_stripes(len(data))
+        return {stripe_idx: data[start : start + size] for stripe_idx, (start, size) in plan.items()}
+
+    def _distribute_data(self, data: bytearray, file_name: str):
+        '''
+        Distribute data to the RAID6 system.
+        '''
+        stripe2data = self._allocate_stripes(data)
+
         # Distribute the data to the stripes
         for stripe_idx, stripe_data in stripe2data.items():
             # print(f'Distribute stripe {stripe_idx}')
             self.logger.info(f'Distribute stripe {stripe_idx}')
             stripe2data[stripe_idx] = self._distribute_stripe(stripe_idx, stripe_data, file_name)
         
-        self.left_size -= data_size
         return stripe2data
     
-    def _load_stripes(self, stripe_idx: int, idxs: list=None, read_p: bool=False, read_q: bool=False):
+    def _load_stripes(self, stripe_idx: int, idxs: list=None, read_p: bool=False, read_q: bool=False, offset: int=0, size: int=None, out=None):
         '''
         Load the stripe data from the RAID6 system.
+        offset and size select a column range inside each block, the whole block is loaded by default.
+        The blocks are read in place into out when given (a pooled stripe buffer), the stripe data is then a view of it.
         '''
-        # [TODO] use multi-thread to load the data
+        if self.cache is not None:
+            self.cache.clean(stripe_idx)
         if idxs is None:
             (p_idx, q_idx), data_disk_idxs = self._find_parity_PQ_idx(stripe_idx)
         else:
             p_idx, q_idx, data_disk_idxs = idxs
+        if size is None:
+            size = self.block_size - offset
+        disk_offset = stripe_idx * self.block_size + offset
 
         new_data_idxs = []
-        stripe_data = bytearray(0)
+        stripe_data = bytearray(size * len(data_disk_idxs)) if out is None else out
         p = None
         q = None
 
+        filled = 0
+        stripe_view = memoryview(stripe_data)
+        calls = []
         for idx, disk_idx in enumerate(data_disk_idxs):
             if self.status[stripe_idx][disk_idx] == False:
                 continue
-            now_data = self.disks[disk_idx].read(stripe_idx * self.block_size, self.block_size)
-            stripe_data += now_data
+            # The blocks known to be zero (new or punched) are not read
+            if self.zero_blocks[stripe_idx, idx]:
+                np.frombuffer(stripe_view[filled : filled + size], dtype=np.uint8)[:] = 0
+            else:
+                calls.append((self.disks[disk_idx].readinto, disk_offset, stripe_view[filled : filled + size]))
+            filled += size
             new_data_idxs.append(idx)
+        self._fan_out(calls)
+        if out is None:
+            stripe_view.release()
+            del stripe_data[filled:]
+        else:
+            stripe_data = stripe_view[:filled]
         
         if read_p:
-            p = self.disks[p_idx].read(stripe_idx * self.block_size, self.block_size)
+            p = self.disks[p_idx].read(disk_offset, size)
         if read_q:
-            q = self.disks[q_idx].read(stripe_idx * self.block_size, self.block_size)
+            q = self.disks[q_idx].read(disk_offset, size)
 
         return p, q, stripe_data, new_data_idxs
+
+    def _live_ranges(self, stripe_idx: int):
+        '''
+        Find the column ranges [start, end) inside a block that hold allocated data in any data block of the stripe.
+        The ranges are aligned to 8 bytes for the uint64 parity kernels and merged.
+        '''
+        ranges = []
+        for offset, name, size in self.stripe2file.fragments(stripe_idx):
+            if name is None or size == 0:
+                continue
+            start, end = offset, offset + size
+            while start < end:
+                block_end = min(end, (start // self.block_size + 1) * self.block_size)
+                col_start = start % self.block_size
+                col_end = col_start + block_end - start
+                ranges.append((col_start // 8 * 8, min(self.block_size, (col_end + 7) // 8 * 8)))
+                start = block_end
+
+        merged = []
+        for start, end in sorted(ranges):
+            if merged and start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+            else:
+                merged.append((start, end))
+        return merged
     
-    def _recover_stripe(self, stripe_idx: int, wrong_code: int, failed_idxs: list):
+    def _recover_stripe(self, stripe_idx: int, wrong_code: int, failed_idxs: list, offset: int=0, size: int=None):
         '''
         Recover a stripe in the RAID6 system.
+        offset and size select the column range inside the blocks to rebuild, the whole block by default.
         '''
+        if size is None:
+            size = self.block_size - offset
+        disk_offset = stripe_idx * self.block_size + offset
+        data_disks, _ = self._stripe_geometry(stripe_idx)
+
         if wrong_code == FailCode.GOOD:
             print(f"Stripe {stripe_idx} is good.")
             return True
@@ -288,99 +754,131 @@ class RAID6(object):
             print(f"Stripe {stripe_idx} cannot be recovered.")
             return False
 
-        if wrong_code == FailCode.DATA:
-            print(f"Recover stripe {stripe_idx} with data {failed_idxs[0]}")
-            p, _, stripe_data, _ = self._load_stripes(stripe_idx, read_p=True)
-            inter_res = p + stripe_data
-            new_data = bytearray(self.block_size)
-            cal_parity_p(new_data, inter_res)
-            self.disks[failed_idxs[0]].write(stripe_idx * self.block_size, new_data)
-            return True
-        
-        if wrong_code == FailCode.Parity_P:
-            print(f"Recover stripe {stripe_idx} with p parity {failed_idxs[0]}")
-            _, _, stripe_data, _ = self._load_stripes(stripe_idx)
-            new_p = bytearray(self.block_size)
-            cal_parity_p(new_p, stripe_data)
-            self.disks[failed_idxs[0]].write(stripe_idx * self.block_size, new_p)
-            return True
-        
-        if wrong_code == FailCode.Parity_Q:
-            print(f"Recover stripe {stripe_idx} with q parity {failed_idxs[0]}")
-            _, _, stripe_data, _ = self._load_stripes(stripe_idx)
-            new_q = bytearray(self.block_size)
-            cal_parity_q_8(new_q, stripe_data)
-            self.disks[failed_idxs[0]].write(stripe_idx * self.block_size, new_q)
-            return True
+        (p_idx, q_idx), _ = self._find_parity_PQ_idx(stripe_idx)
+        with ExitStack() as stack:
+            # Column sized views of pooled buffers, the stripe data is read in place
+            stripe_buffer = stack.enter_context(self.stripe_pool.buffer())
+            def block(zero=False):
+                return stack.enter_context(self.block_pool.buffer(zero))[:size]
+
+            if wrong_code == FailCode.DATA:
+                print(f"Recover stripe {stripe_idx} with data {failed_idxs[0]}")
+                _, _, stripe_data, _ = self._load_stripes(stripe_idx, offset=offset, size=size, out=stripe_buffer)
+                new_data = block()
+                self.disks[p_idx].readinto(disk_offset, new_data)
+                cal_parity_p(new_data, stripe_data)
+                self.disks[failed_idxs[0]].write(disk_offset, new_data)
+                return True
+            
+            if wrong_code == FailCode.Parity_P:
+                print(f"Recover stripe {stripe_idx} with p parity {failed_idxs[0]}")
+                _, _, stripe_data, _ = self._load_stripes(stripe_idx, offset=offset, size=size, out=stripe_buffer)
+                new_p = block(zero=True)
+                cal_parity_p(new_p, stripe_data)
+                self.disks[failed_idxs[0]].write(disk_offset, new_p)
+                return True
+            
+            if wrong_code == FailCode.Parity_Q:
+                print(f"Recover stripe {stripe_idx} with q parity {failed_idxs[0]}")
+                _, _, stripe_data, _ = self._load_stripes(stripe_idx, offset=offset, size=size, out=stripe_buffer)
+                new_q = block()
+                cal_parity_q_8(new_q, stripe_data)
+                self.disks[failed_idxs[0]].write(disk_offset, new_q)
+                return True
+
+            if wrong_code == FailCode.PARITY_PARITY:
+                print(f"Recover stripe {stripe_idx} with p parity {failed_idxs[0]} and q parity {failed_idxs[1]}")
+                _, _, stripe_data, _ = self._load_stripes(stripe_idx, offset=offset, size=size, out=stripe_buffer)
+                new_p = block()
+                new_q = block()
+                cal_parity_8(new_p, new_q, stripe_data)
+                self.disks[failed_idxs[0]].write(disk_offset, new_p)
+                self.disks[failed_idxs[1]].write(disk_offset, new_q)
+                return True
+            
+            if wrong_code == FailCode.Data_P:
+                print(f"Recover stripe {stripe_idx} with data {failed_idxs[1]} and p parity {failed_idxs[0]}")
+                _, _, stripe_data, new_data_idxs = self._load_stripes(stripe_idx, offset=offset, size=size, out=stripe_buffer)
+                q = block()
+                self.disks[q_idx].readinto(disk_offset, q)
+                inter_res = block(zero=True)
+                cal_parity_q(inter_res, stripe_data, new_data_idxs)
+                idx = -1
+                exist_idxs = set(new_data_idxs)
+                for i in range(data_disks):
+                    if i not in exist_idxs:
+                        idx = i
+                new_data = block()
+                q_recover_data(new_data, q, inter_res, idx)
+                self.disks[failed_idxs[1]].write(disk_offset, new_data)
+
+                new_p = block(zero=True)
+                cal_parity_p(new_p, stripe_data)
+                cal_parity_p(new_p, new_data)
+                self.disks[failed_idxs[0]].write(disk_offset, new_p)
+                return True
+            
+            if wrong_code == FailCode.Data_Q:
+                print(f"Recover stripe {stripe_idx} with data {failed_idxs[1]} and q parity {failed_idxs[0]}")
+                _, _, stripe_data, new_data_idxs = self._load_stripes(stripe_idx, offset=offset, size=size, out=stripe_buffer)
+                new_data = block()
+                self.disks[p_idx].readinto(disk_offset, new_data)
+                cal_parity_p(new_data, stripe_data)
+                self.disks[failed_idxs[1]].write(disk_offset, new_data)
+
+                exist_idxs = set(new_data_idxs)
+                for idx in range(data_disks):
+                    if idx not in exist_idxs:
+                        break
+                new_q = block(zero=True)
+                cal_parity_q(new_q, stripe_data, new_data_idxs)
+                cal_parity_q(new_q, new_data, [idx])
+                self.disks[failed_idxs[0]].write(disk_offset, new_q)
+                return True
 
-        if wrong_code == FailCode.PARITY_PARITY:
-            print(f"Recover stripe {stripe_idx} with p parity {failed_idxs[0]} and q parity {failed_idxs[1]}")
-            _, _, stripe_data, _ = self._load_stripes(stripe_idx)
-            new_p = bytearray(self.block_size)
-            new_q = bytearray(self.block_size)
-            cal_parity_8(new_p, new_q, stripe_data)
-            self.disks[failed_idxs[0]].write(stripe_idx * self.block_size, new_p)
-            self.disks[failed_idxs[1]].write(stripe_idx * self.block_size, new_q)
-            return True
-        
-        if wrong_code == FailCode.Data_P:
-            print(f"Recover stripe {stripe_idx} with data {failed_idxs[1]} and p parity {failed_idxs[0]}")
-            _, q, stripe_data, new_data_idxs = self._load_stripes(stripe_idx, read_q=True)
-            inter_res = bytearray(self.block_size)
-            cal_parity_q(inter_res, stripe_data, new_data_idxs)
-            idx = -1
-            exist_idxs = set(new_data_idxs)
-            for i in range(self.data_disks):
-                if i not in exist_idxs:
-                    idx = i
-            new_data = bytearray(self.block_size)
-            q_recover_data(new_data, q, inter_res, idx)
-            self.disks[failed_idxs[1]].write(stripe_idx * self.block_size, new_data)
-
-            new_p = bytearray(self.block_size)
-            inter_res = stripe_data + new_data
-            cal_parity_p(new_p, inter_res)
-            self.disks[failed_idxs[0]].write(stripe_idx * self.block_size, new_p)
-            return True
-        
-        if wrong_code == FailCode.Data_Q:
-            print(f"Recover stripe {stripe_idx} with data {failed_idxs[1]} and q parity {failed_idxs[0]}")
-            p, _, stripe_data, new_data_idxs = self._load_stripes(stripe_idx, read_p=True)
-            inter_res = p + stripe_data
-            new_data = bytearray(self.block_size)
-            cal_parity_p(new_data, inter_res)
-            self.disks[failed_idxs[1]].write(stripe_idx * self.block_size, new_data)
+            if wrong_code == FailCode.DATA_DATA:
+                self._recover_data_data_batch([(stripe_idx, failed_idxs, offset, size)])
+                return True
 
-            exist_idxs = set(new_data_idxs)
-            for idx in range(self.data_disks):
-                if idx not in exist_idxs:
-                    new_data_idxs.append(idx)
-                    break
-            inter_res = stripe_data + new_data
-            new_q = bytearray(self.block_size)
-            cal_parity_q(new_q, inter_res, new_data_idxs)
-            self.disks[failed_idxs[0]].write(stripe_idx * self.block_size, new_q)
-            return True
+    def _recover_data_data_batch(self, items: list):
+        '''
+        Recover the two failed data blocks of a batch of stripes in one kernel call.
+        items are (stripe idx, failed disk idxs, offset, size), the stripes share the geometry and the positions
+        of the failed blocks. The surviving blocks are read once, their P and Q are accumulated inside the kernel.
+        '''
+        data_disks, _ = self._stripe_geometry(items[0][0])
+        with self.rebuild_pool.buffer() as batch_buffer:
+            p, q, stripe_datas, new_data1, new_data2 = [], [], [], [], []
+            calls = []
+            base = 0
+            for stripe_idx, failed_idxs, offset, size in items:
+                print(f"Recover stripe {stripe_idx} with data {failed_idxs[0]} and {failed_idxs[1]}")
+                (p_idx, q_idx), _ = self._find_parity_PQ_idx(stripe_idx)
+                disk_offset = stripe_idx * self.block_size + offset
+                stripe_buffer = batch_buffer[base : base + data_disks * size]
+                _, _, stripe_data, new_data_idxs = self._load_stripes(stripe_idx, offset=offset, size=size, out=stripe_buffer)
+                stripe_datas.append(stripe_data)
+                base += data_disks * size
+                blocks = [batch_buffer[base + i * size : base + (i + 1) * size] for i in range(4)]
+                base += 4 * size
+                p.append(blocks[0])
+                q.append(blocks[1])
+                new_data1.append(blocks[2])
+                new_data2.append(blocks[3])
+                calls.append((self.disks[p_idx].readinto, disk_offset, p[-1]))
+                calls.append((self.disks[q_idx].readinto, disk_offset, q[-1]))
+            self._fan_out(calls)
 
-        if wrong_code == FailCode.DATA_DATA:
-            print(f"Recover stripe {stripe_idx} with data {failed_idxs[0]} and {failed_idxs[1]}")
-            p, q, stripe_data, new_data_idxs = self._load_stripes(stripe_idx, read_p=True, read_q=True)
-            inter_p = bytearray(self.block_size)
-            inter_q = bytearray(self.block_size)
-            cal_parity_p(inter_p, stripe_data)
-            cal_parity_q(inter_q, stripe_data, new_data_idxs)
-            
-            idxs = []
             exist_idxs = set(new_data_idxs)
-            for idx in range(self.data_disks):
-                if idx not in exist_idxs:
-                    idxs.append(idx)
-            new_data1 = bytearray(self.block_size)
-            new_data2 = bytearray(self.block_size)
-            recover_data_data(new_data1, new_data2, p, inter_p, q, inter_q, idxs[0], idxs[1])
-            self.disks[failed_idxs[0]].write(stripe_idx * self.block_size, new_data1)
-            self.disks[failed_idxs[1]].write(stripe_idx * self.block_size, new_data2)
-            return True
+            idxs = [idx for idx in range(data_disks) if idx not in exist_idxs]
+            recover_data_data_batch(new_data1, new_data2, p, q, stripe_datas, data_disks, idxs[0], idxs[1])
+
+            calls = []
+            for k, (stripe_idx, failed_idxs, offset, size) in enumerate(items):
+                disk_offset = stripe_idx * self.block_size + offset
+                calls.append((self.disks[failed_idxs[0]].write, disk_offset, new_data1[k]))
+                calls.append((self.disks[failed_idxs[1]].write, disk_offset, new_data2[k]))
+            self._fan_out(calls)
     
     def _detect_stripe_failcode(self, stripe_idx: int):
         '''
@@ -420,172 +918,892 @@ class RAID6(object):
         else:
             return FailCode.GOOD, []
 
-    def save_data(self, data_path: str, name: str = None):
+    def _compress(self, data: bytes, compression: str = None):
+        '''
+        Compress the data with the codec of the file, or of the system by default, "auto" samples the data first.
+        Return the compression info, None when the data is stored as is, and the bytes to store.
+        '''
+        codec = self.compression if compression is None else compression
+        if codec == "auto":
+            codec = choose_codec(data)
+        if codec is None or codec == "none":
+            return None, data
+        return compress(data, codec, self.compression_chunk, self.compress_executor)
+
+    @array_shared
+    def save_data(self, data_path: str, name: str = None, compression: str = None):
         '''
         Save Data to the RAID6 system.
+        compression overrides the codec of the system for this file: none, zlib, lzma or auto.
         '''
         with open(data_path, "rb") as f:
             data = f.read()
-        
-        self.file2stripe[name] = self._distribute_data(data, name)
+        self._save_bytes(data, name, compression)
+
+    @array_shared
+    def save_bytes(self, data: bytes, name: str, compression: str = None):
+        '''
+        Save an in-memory object to the RAID6 system, see save_data.
+        '''
+        self._save_bytes(data, name, compression)
+
+    def _save_bytes(self, data: bytes, name: str, compression: str = None):
+        '''
+        Store a file, deduplicated or compressed as configured. An existing file of the same name is replaced.
+        '''
+        if self.dedup is not None:
+            self._save_dedup(data, name)
+            return
+
+        info, data = self._compress(data, compression)
+        stripe2data = self._distribute_data(data, name)
+        self._replace_file(name, stripe_info=stripe2data, info=info)
         # print(f"Data saved to RAID6 system successfully")
         self.logger.info(f"Data saved to RAID6 system successfully")
+
+    def _replace_file(self, name: str, stripe_info: dict = None, info=None, recipe=None):
+        '''
+        Publish a saved file under its name: a stored file with its stripe info (and the compression info of a
+        compressed one), or a deduplicated file with its recipe.
+        The file previously saved under the name is released once the new one is visible, a failed save keeps it.
+        '''
+        with self._alloc_lock:
+            old_info = self.file2stripe.pop(name) if name in self.file2stripe else None
+            old_recipe = self.recipes.pop(name, None)
+            if recipe is not None:
+                self.recipes[name] = recipe
+            else:
+                self.file2stripe[name] = stripe_info
+            if info is not None:
+                self.compressed[name] = info
+            else:
+                self.compressed.pop(name, None)
+        if old_info is not None:
+            self._release_extents(old_info)
+        if old_recipe is not None:
+            with self._dedup_lock:
+                self._drop_recipe(old_recipe)
+
+    def _save_dedup(self, data: bytes, name: str):
+        '''
+        Save a file as a recipe of chunks, only the chunks missing from the dedup index are written.
+        The new chunks are packed into stripes with save_many, a duplicate chunk only costs a reference.
+        '''
+        view = memoryview(data)
+        chunks = cdc_chunks(data, self.dedup_chunk) if self.dedup_chunking == "cdc" else fixed_chunks(data, self.dedup_chunk)
+        with self._dedup_lock:
+            recipe = np.empty(len(chunks), dtype=np.int64)
+            new_ids = []
+            new_chunks = []
+            for i, (start, end) in enumerate(chunks):
+                key = chunk_key(view[start:end])
+                chunk_id = self.dedup.lookup(key)
+                if chunk_id is None:
+                    chunk_id = self.dedup.add(key, end - start)
+                    new_ids.append(chunk_id)
+                    new_chunks.append(bytes(view[start:end]))
+                self.dedup.ref(chunk_id)
+                recipe[i] = chunk_id
+
+            try:
+                if len(new_chunks) > 0:
+                    self.save_many(new_chunks, [chunk_name(chunk_id) for chunk_id in new_ids])
+            except Exception:
+                for chunk_id in recipe:
+                    self.dedup.unref(chunk_id)
+                for chunk_id in new_ids:
+                    self.dedup.remove(chunk_id)
+                raise
+            self._replace_file(name, recipe=recipe)
+            self.dedup.save()
+        self.logger.info(f"Data {name} saved as {len(chunks)} chunks, {len(new_chunks)} of them new")
+
+    def _delete_dedup(self, file_name: str):
+        '''
+        Drop the references of a recipe, the chunks left without references are deleted.
+        '''
+        with self._dedup_lock:
+            with self._alloc_lock:
+                recipe = self.recipes.pop(file_name)
+            dead = self._drop_recipe(recipe)
+            self.dedup.save()
+        self.logger.info(f"Data {file_name} deleted from RAID6 system successfully, {dead} chunks freed")
+
+    def _drop_recipe(self, recipe):
+        '''
+        Drop the chunk references of a recipe, the chunks left without references are deleted.
+        Return the number of chunks deleted. The caller holds the dedup lock.
+        '''
+        dead = [int(chunk_id) for chunk_id in recipe if self.dedup.unref(chunk_id) == 0]
+        for chunk_id in dead:
+            self._delete_file(chunk_name(chunk_id))
+            self.dedup.remove(chunk_id)
+        return len(dead)
     
+    def _pack_pieces(self, sizes: list):
+        '''
+        Pack pieces of at most stripe_size bytes into as few stripes as possible with best-fit decreasing.
+        Return the bins, each a list of piece indexes.
+        '''
+        bins = []
+        free = SortedList() # (left size, bin idx)
+        for piece_idx in sorted(range(len(sizes)), key=lambda i: -sizes[i]):
+            size = sizes[piece_idx]
+            pos = free.bisect_left((size, -1))
+            if pos < len(free):
+                left_size, bin_idx = free.pop(pos)
+            else:
+                left_size, bin_idx = self.stripe_size, len(bins)
+                bins.append([])
+            bins[bin_idx].append(piece_idx)
+            if left_size > size:
+                free.add((left_size - size, bin_idx))
+        return bins
+
+    @array_shared
+    def save_many(self, objects: list, names: list = None):
+        '''
+        Save many objects at once, packing them into as few empty stripes as possible.
+        Each packed stripe is written and encoded once, then each object replaces the file of the same name.
+        input:
+            objects: list, file paths or bytes-like objects
+            names: list, the names of the objects, default to the file paths
+        '''
+        if names is None:
+            if any(not isinstance(obj, str) for obj in objects):
+                raise ValueError("Names are required for in-memory objects")
+            names = list(objects)
+        datas = []
+        for obj in objects:
+            if isinstance(obj, str):
+                with open(obj, "rb") as f:
+                    obj = f.read()
+            datas.append(obj)
+
+        # Split the objects into pieces of at most one stripe and pack them
+        pieces = [] # (object idx, data offset, size)
+        for obj_idx, data in enumerate(datas):
+            for start in range(0, len(data), self.stripe_size):
+                pieces.append((obj_idx, start, min(self.stripe_size, len(data) - start)))
+        bins = self._pack_pieces([size for _, _, size in pieces])
+
+        with self._alloc_lock:
+            # Only the empty stripes are packed, the objects that do not fit go through _distribute_data
+            empty_num = len(self.stripe_status) - self.stripe_status.bisect_left((self.stripe_size, -1))
+            overflow = set(pieces[i][0] for bin_pieces in bins[empty_num:] for i in bin_pieces)
+            bins = [[i for i in bin_pieces if pieces[i][0] not in overflow] for bin_pieces in bins[:empty_num]]
+            bins = [bin_pieces for bin_pieces in bins if len(bin_pieces) > 0]
+
+            stripe_idxs = [self.stripe_status.pop()[1] for _ in bins]
+            for stripe_idx, bin_pieces in zip(stripe_idxs, bins):
+                used = sum(pieces[i][2] for i in bin_pieces)
+                if used < self.stripe_size:
+                    self.stripe_status.add((self.stripe_size - used, stripe_idx))
+                self.left_size -= used
+
+        extents = [[] for _ in datas] # (data offset, stripe idx, offset list)
+        for stripe_idx, bin_pieces in zip(stripe_idxs, bins):
+            stripe_data = bytearray(self.stripe_size)
+            with self._stripe_locks[stripe_idx].write_locked():
+                for piece_idx in bin_pieces:
+                    obj_idx, start, size = pieces[piece_idx]
+                    offset_list = self._claim_fragments(stripe_idx, size, names[obj_idx])
+                    data_offset = start
+                    for offset, inn_size in offset_list:
+                        stripe_data[offset : offset + inn_size] = datas[obj_idx][data_offset : data_offset + inn_size]
+                        data_offset += inn_size
+                    extents[obj_idx].append((start, stripe_idx, offset_list))
+                self._write_full_stripe(stripe_idx, stripe_data)
+
+        file2stripe = {}
+        for obj_idx, name in enumerate(names):
+            if obj_idx in overflow:
+                file2stripe[name] = self._distribute_data(datas[obj_idx], name)
+            else:
+                file2stripe[name] = {stripe_idx: offset_list for _, stripe_idx, offset_list in sorted(extents[obj_idx])}
+            # A name saved again releases its old extents and loses its compression or dedup entry
+            self._replace_file(name, stripe_info=file2stripe[name])
+
+        self.logger.info(f"{len(names)} objects saved to {len(stripe_idxs)} packed stripes")
+        return file2stripe
+
+    @stripe_shared
     def verify_stripe(self, stripe_idx: int, idxs: list=None):
         '''
         Verify the integrity of a stripe in the RAID6 system.
+        Only the live column ranges are compared with P and Q. Each parity byte only covers its own column, and a
+        live column is checked across all the data blocks, so the freed bytes next to live data that a
+        reconstruction depends on are covered. The columns free in every block are never reconstructed, and they
+        only become live again through a write that recomputes P and Q from all the data blocks, so a mismatch
+        there cannot reach any data.
         '''
         if idxs is None:
             (p_idx, q_idx), data_disk_idxs = self._find_parity_PQ_idx(stripe_idx)
         else:
             p_idx, q_idx, data_disk_idxs = idxs
         
-        p, q, stripe_data, new_disk_idxs = self._load_stripes(stripe_idx, idxs=[p_idx, q_idx, data_disk_idxs], read_p=True, read_q=True)
-        if len(new_disk_idxs) != len(data_disk_idxs):
-            return ParityCode.WRONG
+        with ExitStack() as stack:
+            stripe_buffer = stack.enter_context(self.stripe_pool.buffer())
+            p, q, recompute_p, recompute_q = [stack.enter_context(self.block_pool.buffer()) for _ in range(4)]
+            _, _, stripe_data, new_disk_idxs = self._load_stripes(stripe_idx, idxs=[p_idx, q_idx, data_disk_idxs], out=stripe_buffer)
+            if len(new_disk_idxs) != len(data_disk_idxs):
+                return ParityCode.WRONG
+            self.disks[p_idx].readinto(stripe_idx * self.block_size, p)
+            self.disks[q_idx].readinto(stripe_idx * self.block_size, q)
+
+            cal_parity_8(recompute_p, recompute_q, stripe_data)
+            
+            # Free columns are not rebuilt by recover_disks and may not match P and Q afterwards
+            for start, end in self._live_ranges(stripe_idx):
+                if recompute_p[start:end] != p[start:end] or recompute_q[start:end] != q[start:end]:
+                    return ParityCode.WRONG
+        return ParityCode.ACCURATE
+
+    @stripe_shared
+    def _read_stripe(self, stripe_idx: int, offset_list: list, verify=False):
+        '''
+        Read the pieces in the offset list of a stripe, optionally verifying the stripe parity first.
+        '''
+        (p_idx, q_idx), data_disk_idxs = self._find_parity_PQ_idx(stripe_idx)
+        if self.status[stripe_idx].count(False) > self.parity_disks:
+            self.logger.error(f"Stripe {stripe_idx} cannot be recovered.")
+            raise ValueError(f"Stripe {stripe_idx} cannot be recovered.")
+
+        if verify:
+            stripe_status = self.verify_stripe(stripe_idx, [p_idx, q_idx, data_disk_idxs])
+            if stripe_status == ParityCode.ACCURATE:
+                # print(f"Stripe {stripe_idx} is verified.")
+                self.logger.info(f"Stripe {stripe_idx} is verified.")
+            else:
+                self.logger.error(f"Stripe {stripe_idx} is corrupted.")
+                raise ValueError(f"Stripe {stripe_idx} is corrupted.")
 
-        recompute_p = bytearray(self.block_size)
-        recompute_q = bytearray(self.block_size)
-        cal_parity_8(recompute_p, recompute_q, stripe_data)
-        
-        if recompute_p == p and recompute_q == q:
-            return ParityCode.ACCURATE
+        elif self.cache is not None:
+            stripe_data = self._cached_read(stripe_idx, offset_list, [p_idx, q_idx, data_disk_idxs])
+            if stripe_data is not None:
+                return stripe_data
+
+        stripe_data_size = sum(size for _, size in offset_list)
+        stripe_data = bytearray(stripe_data_size)
+        self._process_offset_list(stripe_idx, offset_list, "read", stripe_data, idxs=[p_idx, q_idx, data_disk_idxs])
+        return stripe_data
+
+    def _cached_read(self, stripe_idx: int, offset_list: list, idxs: list):
+        '''
+        Read the pieces of a stripe from the cache tier. A missed stripe hot enough to be admitted is loaded whole
+        and cached, return None if the stripe is read from the array instead. The caller holds the stripe lock.
+        '''
+        stripe_data = self.cache.read(stripe_idx, offset_list)
+        if stripe_data is not None or not self.cache.wants(stripe_idx):
+            return stripe_data
+        with self.stripe_pool.buffer() as stripe_buffer:
+            _, _, full_data, data_idxs = self._load_stripes(stripe_idx, idxs=idxs, out=stripe_buffer)
+            if len(data_idxs) != len(idxs[2]):
+                return None
+            self.cache.fill(stripe_idx, full_data)
+            return bytearray(b"".join(full_data[offset : offset + size] for offset, size in offset_list))
+
+    @array_shared
+    def flush_cache(self):
+        '''
+        Write back the dirty lines of the cache tier to the array, return the number of stripes written back.
+        '''
+        if self.cache is None:
+            return 0
+        stripe_idxs = self.cache.dirty_stripes()
+        for stripe_idx in stripe_idxs:
+            with self._stripe_locks[stripe_idx].write_locked():
+                self.cache.clean(stripe_idx)
+        return len(stripe_idxs)
+
+    def discard_freed(self):
+        '''
+        Punch holes in the data blocks freed as a whole since the last pass and bring the parity of their
+        stripes up to date, return the number of blocks punched.
+        The stripes being reshaped or with a failed disk are left for a later pass.
+        '''
+        with self._alloc_lock:
+            stripe_idxs = sorted(self.discard_pending)
+            self.discard_pending.clear()
+        punched = 0
+        deferred = []
+        for stripe_idx in stripe_idxs:
+            blocks = self._discard_stripe(stripe_idx)
+            if blocks is None:
+                deferred.append(stripe_idx)
+            else:
+                punched += blocks
+        with self._alloc_lock:
+            self.discard_pending.update(deferred)
+        if punched > 0:
+            self.logger.info(f"Punched {punched} free data blocks in {len(stripe_idxs) - len(deferred)} stripes")
+        return punched
+
+    @stripe_exclusive
+    def _discard_stripe(self, stripe_idx: int):
+        '''
+        Punch the data blocks of a stripe holding no extent, return the number of blocks punched, None if the
+        stripe cannot be discarded now. The punched blocks are recorded as zero, so the parity computations and
+        the rebuild do not read them. The parity of a stripe left without data is zero and is punched as well.
+        '''
+        if self.reshape is not None or not all(self.status[stripe_idx]):
+            return None
+        (p_idx, q_idx), data_disk_idxs = self._find_parity_PQ_idx(stripe_idx)
+        used = np.zeros(len(data_disk_idxs), dtype=bool)
+        for offset, name, size in self.stripe2file.fragments(stripe_idx):
+            if name is not None and size > 0:
+                used[offset // self.block_size : (offset + size - 1) // self.block_size + 1] = True
+        blocks = [block for block in range(len(data_disk_idxs)) if not used[block] and not self.zero_blocks[stripe_idx, block]]
+        if len(blocks) == 0:
+            return 0
+
+        # The data and parity are inconsistent until the parity is written, as for a write
+        disk_offset = stripe_idx * self.block_size
+        self._mark_dirty(stripe_idx)
+        self._fan_out([(self.disks[data_disk_idxs[block]].discard, disk_offset, self.block_size) for block in blocks])
+        self.zero_blocks[stripe_idx, blocks] = True
+        if self.zero_blocks[stripe_idx].all():
+            self._fan_out([(self.disks[idx].discard, disk_offset, self.block_size) for idx in [p_idx, q_idx]])
         else:
-            return ParityCode.WRONG
+            with self.block_pool.buffer() as p, self.block_pool.buffer() as q, self.stripe_pool.buffer() as stripe_buffer:
+                self._stripe_parity(stripe_idx, [p_idx, q_idx, data_disk_idxs], p, q, stripe_buffer)
+                self._fan_out([(self.disks[p_idx].write, disk_offset, p), (self.disks[q_idx].write, disk_offset, q)])
+        self._clear_dirty(stripe_idx)
+        return len(blocks)
 
+    def _has_file(self, name: str):
+        return name in self.file2stripe or name in self.recipes
+
+    def _file_extents(self, name: str):
+        '''
+        Get the (stripe idx, offset list) extents of a file in file order, a stripe may come back for a
+        deduplicated file. The caller holds the allocator lock.
+        '''
+        if name in self.recipes:
+            return [extent for chunk_id in self.recipes[name] for extent in self.file2stripe.mapping(chunk_name(chunk_id)).items()]
+        return list(self.file2stripe.mapping(name).items())
+
+    @allocator
+    def _range_to_offset_lists(self, name: str, offset: int, size: int):
+        '''
+        Map a byte range of a file to the (stripe idx, offset list) of the extents holding it, in file order.
+        '''
+        if name not in self.recipes:
+            return self.file2stripe.locate(name, offset, size)
+        stripe2range = []
+        file_offset = 0
+        end = offset + size
+        for stripe_idx, offset_list in self._file_extents(name):
+            pieces = []
+            for extent_offset, extent_size in offset_list:
+                start = max(offset, file_offset)
+                stop = min(end, file_offset + extent_size)
+                if start < stop:
+                    pieces.append((extent_offset + start - file_offset, stop - start))
+                file_offset += extent_size
+            if len(pieces) > 0:
+                stripe2range.append((stripe_idx, pieces))
+            if file_offset >= end:
+                break
+        return stripe2range
+
+    @array_shared
+    def read_range(self, name: str, offset: int, size: int):
+        '''
+        Read size bytes of a file starting from offset, the range is clipped to the end of the file.
+        Only the chunks of a compressed file holding the range are read and decompressed.
+        '''
+        if not self._has_file(name):
+            self.logger.error(f"File {name} does not exist in the RAID6 system")
+            raise KeyError(name)
+
+        info = self.compressed.get(name)
+        if info is None:
+            return self._read_stored(name, offset, size)
+        if offset >= info.size or size <= 0:
+            return b""
+        _, _, start, end = info.span(offset, size)
+        return decompress_span(info, self._read_stored(name, start, end - start), offset, size, self.compress_executor)
+
+    def _read_stored(self, name: str, offset: int, size: int):
+        '''
+        Read size bytes of the stored bytes of a file starting from offset.
+        '''
+        data = bytearray(0)
+        for stripe_idx, offset_list in self._range_to_offset_lists(name, offset, size):
+            data += self._read_stripe(stripe_idx, offset_list)
+        return bytes(data)
+
+    @allocator
+    def get_file_size(self, name: str):
+        '''
+        Get the size of a file stored in the RAID6 system, the original size of a compressed file.
+        '''
+        if name in self.compressed:
+            return self.compressed[name].size
+        if name in self.recipes:
+            return int(self.dedup.sizes[self.recipes[name]].sum())
+        return self.file2stripe.size(name)
+
+    def open_reader(self, name: str, verify=False):
+        '''
+        Open a reader of a file with sequential readahead, see Readahead.
+        '''
+        return Readahead(self, name, verify=verify, max_window=self.readahead_stripes)
+
+    @array_shared
     def load_data(self, name: str, out_path: str, verify=False):
         '''
         Load data from the RAID6 system.
         In a RAID6 system, the data is distributed across multiple disks.
         In order to load the data, we need to read the data from the disks and reconstruct the original data.
+        The stripes are streamed to the output file while the next ones are prefetched.
         '''
-        stripe2data = self.file2stripe[name]
-        
-        data = bytearray(0)
-        for stripe_idx, offset_list in stripe2data.items():
-            (p_idx, q_idx), data_disk_idxs = self._find_parity_PQ_idx(stripe_idx)
-
-            if verify:
-                stripe_status = self.verify_stripe(stripe_idx, [p_idx, q_idx, data_disk_idxs])
-                if stripe_status == ParityCode.ACCURATE:
-                    # print(f"Stripe {stripe_idx} is verified.")
-                    self.logger.info(f"Stripe {stripe_idx} is verified.")
-                else:
-                    self.logger.error(f"Stripe {stripe_idx} is corrupted.")
-                    raise ValueError(f"Stripe {stripe_idx} is corrupted.")
-
-            stripe_data_size = sum(size for _, size in offset_list)
-            stripe_data = bytearray(stripe_data_size)
-            self._process_offset_list(stripe_idx, offset_list, "read", stripe_data, idxs=[p_idx, q_idx, data_disk_idxs])
-            data += stripe_data
-
-        with open(out_path, "wb") as f:
-            f.write(data)
-            # print(f"Data loaded from RAID6 system successfully")
-            self.logger.info(f"Data loaded from RAID6 system successfully")
+        with self.open_reader(name, verify=verify) as reader:
+            try:
+                with open(out_path, "wb") as f:
+                    for data in reader:
+                        f.write(data)
+            except Exception:
+                os.remove(out_path)
+                raise
+        # print(f"Data loaded from RAID6 system successfully")
+        self.logger.info(f"Data loaded from RAID6 system successfully")
     
+    @array_exclusive
     def check_disks_status(self):
         '''
         Check the status of the disks in the RAID6 system.
         '''
-        for i in range(self.stripe_width):
+        failed = []
+        for i in range(len(self.disks)):
+            # A disk served by the spare rows fails through the disks holding them
+            if isinstance(self.disks[i], SpareDisk):
+                continue
             flag = self.disks[i].check()
             # print(f"Disk {i} status: {flag}")
             self.logger.info(f"Disk {i} status: {flag}")
             for j in range(self.stripe_num):
                 self.status[j][i] = flag
             if flag == False:
+                failed.append(i)
+        if len(failed) > 0 and self._spare_capacity(failed) >= self._spare_demand(failed):
+            self._fail_over_spare(failed)
+        else:
+            for i in failed:
                 self.disks[i].init_new_disk(self.disks[i].path + "_new")
+            # The spare blocks held by the failed disks are rebuilt in place on their replacements
+            for disk_idx, rows in self.spare.rows.items():
+                for stripe_idx, (spare_disk, _) in rows.items():
+                    if spare_disk in failed:
+                        self.status[stripe_idx][disk_idx] = False
+        for i in self.slow_disks():
+            self.logger.warning(f"Disk {i} is slow, consider replacing it: {self.disks[i].latency.stats()}")
     
+    def _spare_capacity(self, failed: list):
+        '''
+        Count the free spare rows of the healthy disks.
+        '''
+        used = set((spare_disk, spare_row) for rows in self.spare.rows.values() for spare_disk, spare_row in rows.values())
+        healthy = [i for i, disk in enumerate(self.disks) if not isinstance(disk, SpareDisk) and i not in failed]
+        return sum(1 for i in healthy for row in range(self.stripe_num, self.stripe_num + self.spare_rows) if (i, row) not in used)
+
+    def _spare_demand(self, failed: list):
+        '''
+        Count the spare rows needed by the newly failed disks, their own blocks and the spare blocks they held.
+        '''
+        moved = sum(1 for rows in self.spare.rows.values() for spare_disk, _ in rows.values() if spare_disk in failed)
+        return len(failed) * self.stripe_num + moved
+
+    def _assign_spare(self, disk_idx: int, stripe_idxs: list, failed: list):
+        '''
+        Give the blocks of a failed disk a spare row each. The spare disk rotates with the stripe idx so the
+        rebuild writes are spread over all the healthy disks, two blocks of a stripe never share a spare disk.
+        '''
+        used = set((spare_disk, spare_row) for rows in self.spare.rows.values() for spare_disk, spare_row in rows.values())
+        healthy = [i for i, disk in enumerate(self.disks) if not isinstance(disk, SpareDisk) and i not in failed]
+        free = {i: [row for row in range(self.stripe_num + self.spare_rows - 1, self.stripe_num - 1, -1) if (i, row) not in used] for i in healthy}
+        rows = self.spare.rows.setdefault(disk_idx, {})
+        for stripe_idx in stripe_idxs:
+            taken = set(inn_rows[stripe_idx][0] for inn_rows in self.spare.rows.values() if stripe_idx in inn_rows)
+            for k in range(len(healthy)):
+                spare_disk = healthy[(stripe_idx + k) % len(healthy)]
+                if spare_disk not in taken and len(free[spare_disk]) > 0:
+                    break
+            else:
+                raise ValueError(f"No spare row left for stripe {stripe_idx} of disk {disk_idx}")
+            rows[stripe_idx] = (spare_disk, free[spare_disk].pop())
+
+    def _fail_over_spare(self, failed: list):
+        '''
+        Serve the failed disks from the spare rows, their blocks are rebuilt there by recover_disks.
+        The spare blocks held by the failed disks are moved to other spare rows and rebuilt as well.
+        '''
+        for disk_idx, rows in self.spare.rows.items():
+            moved = [stripe_idx for stripe_idx, (spare_disk, _) in rows.items() if spare_disk in failed]
+            for stripe_idx in moved:
+                del rows[stripe_idx]
+                self.status[stripe_idx][disk_idx] = False
+            self._assign_spare(disk_idx, moved, failed)
+        # Only the allocated columns are rebuilt and the spare rows may hold stale data
+        for stripe_idx in range(self.stripe_num):
+            _, data_disk_idxs = self._find_parity_PQ_idx(stripe_idx)
+            for block, disk_idx in enumerate(data_disk_idxs):
+                if disk_idx in failed or disk_idx in self.spare.rows:
+                    self.zero_blocks[stripe_idx, block] = False
+        for disk_idx in failed:
+            self._assign_spare(disk_idx, range(self.stripe_num), failed)
+            self.disks[disk_idx] = SpareDisk(self.disks, self.spare.rows[disk_idx], self.block_size, self.disks[disk_idx])
+            self.logger.info(f"Disk {disk_idx} is served by the spare rows")
+        self.spare.save(self.spare_path)
+        self.logger.warning(f"{len(self.degraded_stripes())} stripes tolerate one more disk failure until their spare blocks are copied back")
+
+    def degraded_stripes(self):
+        '''
+        Get the stripes with a block in the spare rows. Every disk holds a block of every stripe, so the spare
+        row of a block is on a disk holding another block of its stripe. A failure of that disk loses two blocks,
+        these stripes tolerate one more disk failure instead of two until they are copied back.
+        '''
+        return sorted(set(stripe_idx for rows in self.spare.rows.values() for stripe_idx in rows))
+
+    @array_exclusive
+    def replace_disk(self, disk_idx: int):
+        '''
+        Attach a replacement to a disk served by the spare rows, its blocks are moved back by a CopyBack.
+        '''
+        disk = self.disks[disk_idx]
+        if not isinstance(disk, SpareDisk):
+            raise ValueError(f"Disk {disk_idx} is not served by the spare rows")
+        if disk.replacement is None:
+            disk.disk.init_new_disk(disk.disk.path)
+            disk.replacement = disk.disk
+            self.spare.replaced.append(disk_idx)
+            self.spare.save(self.spare_path)
+        self.logger.info(f"Replacement attached to disk {disk_idx}")
+
+    @array_exclusive
     def recover_disks(self):
         '''
         Recover the disks in the RAID6 system.
+        Only the allocated column ranges of each stripe are rebuilt, stripes holding data are rebuilt first.
+        The free columns are left to the zero-filled replacement disks.
+        The rebuild I/O runs in the rebuild class, with qos it goes behind the foreground requests of the other threads.
+        The stripes missing the same two data blocks are rebuilt in batches of rebuild_batch column ranges.
+        A stripe missing more blocks than the parity can rebuild stays failed, a ValueError lists them once the
+        others are rebuilt.
         '''
+        live_stripes = []
         for stripe_idx in range(self.stripe_num):
-            if len(self.stripe2file[stripe_idx]) == 1 and self.stripe2file[stripe_idx][0][0] is None:
-                for i in range(self.stripe_width):
+            ranges = self._live_ranges(stripe_idx)
+            if len(ranges) == 0:
+                for i in range(len(self.disks)):
                     self.status[stripe_idx][i] = True
                 continue
+            live_stripes.append((stripe_idx, ranges))
+
+        def recover(stripe_idx, ranges):
             fail_code, failed_idxs = self._detect_stripe_failcode(stripe_idx)
             if fail_code == FailCode.GOOD:
+                return
+            for start, end in ranges:
+                self._recover_stripe(stripe_idx, fail_code, failed_idxs, offset=start, size=end - start)
+            for i in failed_idxs:
+                self.status[stripe_idx][i] = True
+
+        # Group the ranges of the stripes missing two data blocks by geometry and positions of the failed blocks
+        batches = {}
+        batched = []
+        others = []
+        lost = []
+        for stripe_idx, ranges in live_stripes:
+            fail_code, failed_idxs = self._detect_stripe_failcode(stripe_idx)
+            if fail_code == FailCode.CORUCPTED:
+                lost.append(stripe_idx)
+                continue
+            if fail_code != FailCode.DATA_DATA or self.rebuild_batch < 2:
+                others.append((stripe_idx, ranges))
                 continue
-            self._recover_stripe(stripe_idx, fail_code, failed_idxs)
+            data_disks, _ = self._stripe_geometry(stripe_idx)
+            _, data_disk_idxs = self._find_parity_PQ_idx(stripe_idx)
+            key = (data_disks, data_disk_idxs.index(failed_idxs[0]), data_disk_idxs.index(failed_idxs[1]))
+            batches.setdefault(key, []).extend((stripe_idx, failed_idxs, start, end - start) for start, end in ranges)
+            batched.append((stripe_idx, failed_idxs))
+
+        # With spare rows the rebuild writes are spread over all the disks, the stripes are rebuilt in parallel
+        workers = len(self.disks) if any(isinstance(disk, SpareDisk) for disk in self.disks) else 1
+        with io_class(REBUILD), ThreadPoolExecutor(max_workers=workers, thread_name_prefix="raid6-rebuild") as executor:
+            futures = [executor.submit(bind(recover), stripe_idx, ranges) for stripe_idx, ranges in others]
+            for items in batches.values():
+                for start in range(0, len(items), self.rebuild_batch):
+                    futures.append(executor.submit(bind(self._recover_data_data_batch), items[start : start + self.rebuild_batch]))
+            for future in futures:
+                future.result()
+        # The ranges of a stripe may be in several batches, it is marked recovered once all of them are written
+        for stripe_idx, failed_idxs in batched:
             for i in failed_idxs:
                 self.status[stripe_idx][i] = True
+        if len(lost) > 0:
+            self.logger.error(f"Stripes {lost} lost more blocks than the parity can rebuild")
+            raise ValueError(f"Stripes {lost} lost more blocks than the parity can rebuild")
         # print(f"Disks recovered successfully")
         self.logger.info(f"Disks recovered successfully")
 
+    @stripe_exclusive
     def _update_parity_by_stripe_id(self, stripe_idx: int):
         '''
         Update the parity blocks by stripe id.
         '''
         (p_idx, q_idx), data_disk_idxs = self._find_parity_PQ_idx(stripe_idx)
-        p = bytearray(self.block_size)
-        q = bytearray(self.block_size)
-        _, _, stripe_data, _ = self._load_stripes(stripe_idx, idxs=[p_idx, q_idx, data_disk_idxs])
-        cal_parity_8(p, q, stripe_data)
-        self.disks[p_idx].write(stripe_idx * self.block_size, p)
-        self.disks[q_idx].write(stripe_idx * self.block_size, q)
+        with self.block_pool.buffer() as p, self.block_pool.buffer() as q, self.stripe_pool.buffer() as stripe_buffer:
+            self._stripe_parity(stripe_idx, [p_idx, q_idx, data_disk_idxs], p, q, stripe_buffer)
+            self._mark_dirty(stripe_idx)
+            self.disks[p_idx].write(stripe_idx * self.block_size, p)
+            self.disks[q_idx].write(stripe_idx * self.block_size, q)
+        self._clear_dirty(stripe_idx)
         return True
 
+    @array_exclusive
+    def resync(self):
+        '''
+        Recompute the parity blocks of the stripes marked dirty in the write-intent bitmap,
+        return the number of stripes resynced.
+        '''
+        if self.bitmap is None:
+            return 0
+        resynced = 0
+        with io_class(BACKGROUND):
+            for region in self.bitmap.dirty_regions():
+                for stripe_idx in self.bitmap.region_to_stripes(region):
+                    # The stripes of an interrupted reshape batch are rewritten from the reshape backup
+                    if self.reshape is not None and self.reshape.position <= stripe_idx < self.reshape.batch_end:
+                        continue
+                    self._update_parity_by_stripe_id(stripe_idx)
+                    resynced += 1
+        self.bitmap.flush()
+        if resynced > 0:
+            self.logger.info(f"Resynced the parity of {resynced} dirty stripes")
+        return resynced
+
+    def close(self):
+        '''
+        Write back the cache tier and clear the write-intent bitmap of the finished writes, so a clean restart
+        resyncs nothing, stop the prefetch, hedge, compression and io threads and close the connections to the disk nodes.
+        '''
+        if self.cache is not None:
+            self.flush_cache()
+            self.cache.close()
+            self.cache = None
+        if self.bitmap is not None:
+            self.bitmap.close()
+            self.bitmap = None
+        self.prefetch_executor.shutdown(wait=True)
+        self.hedge_executor.shutdown(wait=True)
+        self.compress_executor.shutdown(wait=True)
+        if self.io_executor is not None:
+            self.io_executor.shutdown(wait=True)
+            for disk in self.disks:
+                if isinstance(disk, RemoteDisk):
+                    disk.close()
+
+
+    def _free_extents(self, stripe_idx: int, offset_list: list):
+        '''
+        Mark the extents of a stripe as free and give the space back to the stripe status.
+        The caller holds the stripe lock and the allocator lock.
+        '''
+        if self.discard and len(offset_list) > 0:
+            self.discard_pending.add(stripe_idx)
+        for offset, size in offset_list:
+            # Mark the blocks as empty and merge them with the free space ahead and behind
+            self.stripe2file.free(stripe_idx, offset, size)
+
+            # Update the stripe status (add the freed space back)
+            for idx, stripe in enumerate(self.stripe_status):
+                if stripe[1] == stripe_idx:
+                    # Merge the free space with the existing stripe
+                    new_size = stripe[0] + size
+                    self.stripe_status.remove(stripe)
+                    self.stripe_status.add((new_size, stripe_idx))
+                    break
+            else:
+                # If the stripe was fully used, add it back as free space
+                self.stripe_status.add((size, stripe_idx))
 
+    @array_shared
     def delete_data(self, file_name: str):
         '''
         Delete data from the RAID6 system.
+        The chunks of a deduplicated file are only deleted once no other file references them.
         '''
-        if file_name not in self.file2stripe:
-            # print(f"File {file_name} does not exist in the RAID6 system")
-            self.logger.error(f"File {file_name} does not exist in the RAID6 system")
-            return False
-        
-        stripe_info = self.file2stripe[file_name]
-        for stripe_idx, offset_list in stripe_info.items():
-            for offset, size in offset_list:
-                # Mark the blocks as empty
-                self.stripe2file[stripe_idx][offset] = [None, size]
-                # Merge the free space
-                # Merge the space ahead
-                new_offset = offset
-                new_size = size
-                for inn_offset, inn_info in self.stripe2file[stripe_idx].items():
-                    inn_name, inn_size = inn_info
-                    if inn_name == None and inn_offset + inn_size == new_offset:
-                        self.stripe2file[stripe_idx][inn_offset] = [None, inn_size + new_size]
-                        self.stripe2file[stripe_idx].pop(offset)
-                        new_offset = inn_offset
-                        new_size += inn_size
-                        break
-                # Merge the space behind
-                for inn_offset, inn_info in self.stripe2file[stripe_idx].items():
-                    inn_name, inn_size = inn_info
-                    if inn_name == None and offset + size == inn_offset:
-                        self.stripe2file[stripe_idx][new_offset] = [None, new_size + inn_size]
-                        self.stripe2file[stripe_idx].pop(inn_offset)
-                        break
-                
-                # Update the stripe status (add the freed space back)
-                for idx, stripe in enumerate(self.stripe_status):
-                    if stripe[1] == stripe_idx:
-                        # Merge the free space with the existing stripe
-                        new_size = stripe[0] + size
-                        self.stripe_status.remove(stripe)
-                        self.stripe_status.add((new_size, stripe_idx))
-                        break
-                else:
-                    # If the stripe was fully used, add it back as free space
-                    self.stripe_status.add((size, stripe_idx))
-
-
-            # Do not need to update the parity blocks, lazy update for deletion
-            # self._update_parity_by_stripe_id(stripe_idx)
+        if file_name in self.recipes:
+            return self._delete_dedup(file_name)
+        return self._delete_file(file_name)
 
+    def _delete_file(self, file_name: str):
+        '''
+        Free the extents of a stored file.
+        '''
+        while True:
+            with self._alloc_lock:
+                if file_name not in self.file2stripe:
+                    # print(f"File {file_name} does not exist in the RAID6 system")
+                    self.logger.error(f"File {file_name} does not exist in the RAID6 system")
+                    return False
+                stripe_idxs = sorted(self.file2stripe[file_name].keys())
+
+            with ExitStack() as stack:
+                for stripe_idx in stripe_idxs:
+                    stack.enter_context(self._stripe_locks[stripe_idx].write_locked())
+                stack.enter_context(self._alloc_lock)
+                # The file may have been deleted or saved again by another thread before the stripes were locked
+                if file_name not in self.file2stripe or sorted(self.file2stripe[file_name].keys()) != stripe_idxs:
+                    continue
 
-        del self.file2stripe[file_name]
-        self.left_size += sum(id_size[0][1] for _, id_size in stripe_info.items())
+                stripe_info = self.file2stripe.pop(file_name)
+                self.compressed.pop(file_name, None)
+                # Do not need to update the parity blocks, lazy update for deletion, see discard_freed
+                self._drop_extents(stripe_info)
+                break
 
         # print(f"Data {file_name} deleted from RAID6 system successfully")
         self.logger.info(f"Data {file_name} deleted from RAID6 system successfully")
 
+    def _share_extents(self, stripe_info: dict):
+        '''
+        Add a reference to each extent of a file. The caller holds the allocator lock.
+        '''
+        for stripe_idx, offset_list in stripe_info.items():
+            for offset, _ in offset_list:
+                self.extent_refs[(stripe_idx, offset)] = self.extent_refs.get((stripe_idx, offset), 1) + 1
+
+    def _drop_extents(self, stripe_info: dict):
+        '''
+        Drop a reference to each extent of a file, the extents left without references are freed.
+        The caller holds the locks of the stripes and the allocator lock.
+        '''
+        for stripe_idx, offset_list in stripe_info.items():
+            dead = []
+            for offset, size in offset_list:
+                refs = self.extent_refs.pop((stripe_idx, offset), 1) - 1
+                if refs > 1:
+                    self.extent_refs[(stripe_idx, offset)] = refs
+                elif refs == 0:
+                    dead.append((offset, size))
+            self._free_extents(stripe_idx, dead)
+            self.left_size += sum(size for _, size in dead)
+
+    def _release_extents(self, stripe_info: dict):
+        '''
+        Drop the references of extents no longer held by any file map.
+        '''
+        with ExitStack() as stack:
+            for stripe_idx in sorted(stripe_info.keys()):
+                stack.enter_context(self._stripe_locks[stripe_idx].write_locked())
+            stack.enter_context(self._alloc_lock)
+            self._drop_extents(stripe_info)
+
+    @allocator
+    def _is_shared(self, name: str):
+        '''
+        Check if an extent of a file is shared with a clone or a snapshot.
+        '''
+        if len(self.extent_refs) == 0:
+            return False
+        return any((stripe_idx, offset) in self.extent_refs for stripe_idx, offset_list in self.file2stripe.mapping(name).items() for offset, _ in offset_list)
+
+    @array_exclusive
+    def clone(self, src: str, dst: str, snapshot: str = None):
+        '''
+        Clone a file, or a file of a snapshot, without copying its data.
+        The clone shares the extents of the source, a later write to either of them goes to new extents.
+        '''
+        source = self if snapshot is None else self.snapshots[snapshot]
+        if src not in source.file2stripe and src not in source.recipes:
+            self.logger.error(f"File {src} does not exist in the RAID6 system")
+            raise KeyError(src)
+        if self._has_file(dst):
+            raise ValueError(f"File {dst} already exists")
+
+        if src in source.recipes:
+            self._clone_recipe(source, src, dst)
+        else:
+            with self._alloc_lock:
+                stripe_info = {stripe_idx: list(offset_list) for stripe_idx, offset_list in source.file2stripe[src].items()}
+                self._share_extents(stripe_info)
+                self.file2stripe[dst] = stripe_info
+                if src in source.compressed:
+                    self.compressed[dst] = source.compressed[src]
+        self.logger.info(f"Data {src} cloned to {dst}")
+
+    def _clone_recipe(self, source, src: str, dst: str):
+        '''
+        Clone a deduplicated file by referencing its chunks. A chunk of a snapshot that was deleted from the
+        live system since is registered again, on the extents of the snapshot.
+        '''
+        recipe = source.recipes[src].copy()
+        with self._dedup_lock:
+            for i, chunk_id in enumerate(recipe.tolist()):
+                extents = source.file2stripe[chunk_name(chunk_id)]
+                with self._alloc_lock:
+                    live = self.file2stripe.get(chunk_name(chunk_id)) == extents
+                if not live:
+                    data = b"".join(self._read_stripe(stripe_idx, offset_list) for stripe_idx, offset_list in extents.items())
+                    key = chunk_key(data)
+                    chunk_id = self.dedup.lookup(key)
+                    if chunk_id is None:
+                        chunk_id = self.dedup.add(key, len(data))
+                        with self._alloc_lock:
+                            stripe_info = {stripe_idx: list(offset_list) for stripe_idx, offset_list in extents.items()}
+                            self._share_extents(stripe_info)
+                            self.file2stripe[chunk_name(chunk_id)] = stripe_info
+                    recipe[i] = chunk_id
+                self.dedup.ref(chunk_id)
+            with self._alloc_lock:
+                self.recipes[dst] = recipe
+            self.dedup.save()
+
+    @array_exclusive
+    def snapshot(self, name: str):
+        '''
+        Take a snapshot of all the files, only the metadata maps are copied and the data blocks are not touched.
+        The files of a snapshot are read back by cloning them with clone(src, dst, snapshot=name).
+        '''
+        if name in self.snapshots:
+            raise ValueError(f"Snapshot {name} already exists")
+        with self._alloc_lock:
+            file2stripe = self.file2stripe.copy()
+            for stripe_info in file2stripe.values():
+                self._share_extents(stripe_info)
+            self.snapshots[name] = Snapshot(name, time.time(), file2stripe, dict(self.compressed), dict(self.recipes))
+        self.logger.info(f"Snapshot {name} taken of {len(file2stripe)} files")
+        return self.snapshots[name]
+
+    @array_exclusive
+    def delete_snapshot(self, name: str):
+        '''
+        Delete a snapshot, the extents only it references are freed.
+        '''
+        if name not in self.snapshots:
+            self.logger.error(f"Snapshot {name} does not exist")
+            raise KeyError(name)
+        snapshot = self.snapshots.pop(name)
+        with self._alloc_lock:
+            for stripe_info in snapshot.file2stripe.values():
+                self._drop_extents(stripe_info)
+        self.logger.info(f"Snapshot {name} deleted")
+
+    def _copy_on_write(self, name: str, offset: int, data: bytes):
+        '''
+        Write a patched copy of a file with shared extents to new extents and drop its references to the old ones.
+        '''
+        stored = bytearray(self._read_stored(name, 0, self.get_file_size(name)))
+        stored[offset : offset + len(data)] = data
+        stripe2data = self._distribute_data(stored, name)
+        with self._alloc_lock:
+            stripe_info = self.file2stripe.pop(name)
+            self.file2stripe[name] = stripe2data
+        self._release_extents(stripe_info)
+
     def _is_offset_available(self, stripe_idx: int, offset_list):
         '''
         Check if the offset list is available for the stripe.
@@ -599,6 +1817,7 @@ class RAID6(object):
         return True
 
 
+    @stripe_exclusive
     def _distribute_stripe_with_offset(self, stripe_idx: int, stripe_data: bytearray, file_name: str, offset_list: list):
         '''
         Distribute a stripe of data to the RAID6 system.
@@ -639,25 +1858,120 @@ class RAID6(object):
                     
                     break
         self.stripe2file[stripe_idx] = new_dict
+        self._claim_blocks(stripe_idx, offset_list)
 
         # Write the stripe data to the disks
         (p_idx, q_idx), data_disk_idxs = self._find_parity_PQ_idx(stripe_idx)
+        self._mark_dirty(stripe_idx)
         self._process_offset_list(stripe_idx, offset_list, "write", stripe_data, idxs=[p_idx, q_idx, data_disk_idxs])
 
         # Update the parity blocks
-        p = bytearray(self.block_size)
-        q = bytearray(self.block_size)
-        if len(stripe_data) != self.stripe_size:
-            _, _, stripe_data, _ = self._load_stripes(stripe_idx, idxs=[p_idx, q_idx, data_disk_idxs])
-
-        cal_parity_8(p, q, stripe_data)
+        with self.block_pool.buffer() as p, self.block_pool.buffer() as q, self.stripe_pool.buffer() as stripe_buffer:
+            if len(stripe_data) != self.stripe_size:
+                self._stripe_parity(stripe_idx, [p_idx, q_idx, data_disk_idxs], p, q, stripe_buffer)
+            else:
+                cal_parity_8(p, q, stripe_data)
 
-        # Write back the parity blocks
-        self.disks[p_idx].write(stripe_idx * self.block_size, p)
-        self.disks[q_idx].write(stripe_idx * self.block_size, q)
+            # Write back the parity blocks
+            self.disks[p_idx].write(stripe_idx * self.block_size, p)
+            self.disks[q_idx].write(stripe_idx * self.block_size, q)
+        self._clear_dirty(stripe_idx)
         
         return offset_list
 
+    def _stripe_degraded(self, stripe_idx: int):
+        '''
+        Whether a block of the stripe is on a failed disk and cannot be read until it is rebuilt.
+        '''
+        (p_idx, q_idx), data_disk_idxs = self._find_parity_PQ_idx(stripe_idx)
+        return not all(self.status[stripe_idx]) or not all(self.disks[i].status for i in data_disk_idxs + [p_idx, q_idx])
+
+    @stripe_exclusive
+    def _overwrite_stripe(self, stripe_idx: int, offset_list: list, data: bytearray):
+        '''
+        Overwrite the pieces in the offset list of a stripe in place.
+        P and Q are updated from the XOR delta of the old and new data, the other blocks are not read.
+        A stripe cached in the cache tier is only written to its line, the array is updated on write-back.
+        The old data of a degraded stripe may be on a failed disk, the delta would corrupt P and Q.
+        '''
+        if self._stripe_degraded(stripe_idx):
+            self.logger.error(f"Stripe {stripe_idx} is degraded, recover the disks before overwriting it")
+            raise ValueError(f"Stripe {stripe_idx} is degraded, recover the disks before overwriting it")
+        if self.cache is not None and self.cache.write(stripe_idx, offset_list, data):
+            return
+        (p_idx, q_idx), data_disk_idxs = self._find_parity_PQ_idx(stripe_idx)
+        base = stripe_idx * self.block_size
+        data_view = memoryview(data)
+        data_offset = 0
+        self._mark_dirty(stripe_idx)
+        with ExitStack() as stack:
+            new_buffer, delta_buffer, p_buffer, q_buffer = [stack.enter_context(self.block_pool.buffer()) for _ in range(4)]
+            for offset, size in offset_list:
+                end = offset + size
+                while offset < end:
+                    block = offset // self.block_size
+                    stop = min(end, (block + 1) * self.block_size)
+                    col_start = offset - block * self.block_size
+                    col_end = stop - block * self.block_size
+                    # Align the column range for the uint64 parity kernels, the delta is zero outside the new data
+                    start = col_start // 8 * 8
+                    finish = min(self.block_size, (col_end + 7) // 8 * 8)
+                    new, delta, p, q = [buffer[: finish - start] for buffer in (new_buffer, delta_buffer, p_buffer, q_buffer)]
+
+                    self.disks[data_disk_idxs[block]].readinto(base + start, delta)
+                    new[:] = delta
+                    new[col_start - start : col_end - start] = data_view[data_offset : data_offset + stop - offset]
+                    cal_parity_p(delta, new)
+
+                    self.disks[p_idx].readinto(base + start, p)
+                    self.disks[q_idx].readinto(base + start, q)
+                    cal_parity_p(p, delta)
+                    cal_parity_q(q, delta, [block])
+
+                    self.disks[data_disk_idxs[block]].write(base + col_start, new[col_start - start : col_end - start])
+                    self.disks[p_idx].write(base + start, p)
+                    self.disks[q_idx].write(base + start, q)
+                    data_offset += stop - offset
+                    offset = stop
+        self._clear_dirty(stripe_idx)
+
+    @array_shared
+    def overwrite(self, name: str, offset: int, data: bytes):
+        '''
+        Overwrite the bytes of a file starting from offset in place, the file size does not change.
+        Only the affected blocks and the parity blocks of their stripes are touched.
+        A file sharing extents with a clone or a snapshot is written to new extents instead.
+        A range on a stripe with a failed disk raises a ValueError until the disks are recovered.
+        '''
+        if not self._has_file(name):
+            self.logger.error(f"File {name} does not exist in the RAID6 system")
+            raise KeyError(name)
+        if name in self.compressed:
+            raise ValueError(f"File {name} is compressed and cannot be overwritten in place")
+        if name in self.recipes:
+            raise ValueError(f"File {name} is deduplicated, its chunks may be shared and cannot be overwritten in place")
+        if offset < 0 or offset + len(data) > self.get_file_size(name):
+            raise ValueError("Overwrite out of the file range")
+
+        if self._is_shared(name):
+            self._copy_on_write(name, offset, data)
+            self.logger.info(f"Data {name} shares its extents, overwritten at offset {offset} by copy-on-write")
+            return
+
+        stripe_offset_lists = self._range_to_offset_lists(name, offset, len(data))
+        # Refuse before any stripe is written, so a failed overwrite leaves the file unchanged
+        for stripe_idx, _ in stripe_offset_lists:
+            if self._stripe_degraded(stripe_idx):
+                self.logger.error(f"Stripe {stripe_idx} is degraded, recover the disks before overwriting it")
+                raise ValueError(f"Stripe {stripe_idx} is degraded, recover the disks before overwriting it")
+        data_offset = 0
+        for stripe_idx, offset_list in stripe_offset_lists:
+            size = sum(size for _, size in offset_list)
+            self._overwrite_stripe(stripe_idx, offset_list, data[data_offset : data_offset + size])
+            data_offset += size
+        self.logger.info(f"Data {name} overwritten in place at offset {offset} with {len(data)} bytes")
+
+    @array_exclusive
     def modify_data(self, file_name: str, rewrite_name: str, data_path: str):
         '''
         Modify the data in the RAID6 system.
@@ -666,6 +1980,8 @@ class RAID6(object):
             file_name: str, the name of the file to be modified
             data_path: str, the path of the new data
         '''
+        if file_name in self.recipes:
+            raise ValueError(f"File {file_name} is deduplicated, delete it and save the new data instead")
         if file_name not in self.file2stripe:
             # print(f"File {file_name} does not exist in the RAID6 system")
             self.logger.error(f"File {file_name} does not exist in the RAID6 system")
@@ -673,8 +1989,17 @@ class RAID6(object):
         
         with open(data_path, "rb") as f:
             data = f.read()
+        data_size = len(data)
+
+        # The extents shared with clones or snapshots are kept, the new data goes to new extents
+        if self._is_shared(file_name):
+            self.delete_data(file_name)
+            stripe2data = self._distribute_data(data, rewrite_name)
+            with self._alloc_lock:
+                self.file2stripe[rewrite_name] = stripe2data
+            return True
 
-        stripe_info = self.file2stripe[file_name]
+        stripe_info = self.file2stripe.mapping(file_name)
         self.delete_data(file_name)
 
         stripe_data = bytearray(0)
@@ -723,6 +2048,7 @@ class RAID6(object):
                 break
         # Update the file2stripe
         self.file2stripe[rewrite_name] = file2stripe
+        self.left_size -= data_size - len(data)
 
         # If need extra space
         if len(data) > 0:
@@ -0,0 +1,158 @@
+from bisect import bisect_right
+from collections import OrderedDict
+from src.compression import decompress_span, decompress_stream
+from src.qos import bind
+
+
+class Readahead(object):
+    '''
+    Adaptive sequential readahead over the extents of one file, in file2stripe order.
+    While the file is read sequentially, the next stripes of the window are read in the background by the
+    prefetch executor and kept in a buffer bounded by max_bytes. The window doubles when the consumer has to
+    wait for the disks and shrinks when the prefetched stripes pile up unread, a non-sequential read resets it.
+    The extents are taken when the reader is opened, like load_data the prefetched data is not invalidated by
+    a concurrent overwrite. The stored bytes of a compressed file are decompressed on the fly.
+    '''
+    def __init__(self, raid6, name: str, verify=False, min_window: int = 1, max_window: int = 8, max_bytes: int = None):
+        self.raid6 = raid6
+        self.name = name
+        self.verify = verify
+        self.min_window = min_window
+        self.max_window = max_window
+        self.max_bytes = max_bytes if max_bytes is not None else max_window * raid6.stripe_size
+        with raid6._alloc_lock:
+            if not raid6._has_file(name):
+                raise KeyError(name)
+            self.extents = raid6._file_extents(name)
+            self.info = raid6.compressed.get(name)
+
+        self.sizes = [sum(size for _, size in offset_list) for _, offset_list in self.extents]
+        self.starts = []
+        file_offset = 0
+        for size in self.sizes:
+            self.starts.append(file_offset)
+            file_offset += size
+        self.file_size = file_offset # stored size
+
+        # The prefetch threads need the array lock, which an exclusive holder would keep from them
+        self._prefetch = not raid6._array_lock.write_held()
+        self.window = min_window
+        self.position = 0 # index of the next extent to consume
+        self._inflight = OrderedDict() # extent idx -> future
+        self._inflight_bytes = 0
+        self._current_idx = None
+        self._current = None
+        self.hits = 0
+        self.waits = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __iter__(self):
+        '''
+        Stream the file in order.
+        '''
+        if self.info is not None:
+            return decompress_stream(self.info, self._iter_extents(), self.raid6.compress_executor)
+        return self._iter_extents()
+
+    def _iter_extents(self):
+        '''
+        Stream the extents of the file in order.
+        '''
+        self._seek(0)
+        while self.position < len(self.extents):
+            yield self._next_extent()
+
+    def _read_extent(self, idx: int):
+        stripe_idx, offset_list = self.extents[idx]
+        return self.raid6._read_stripe(stripe_idx, offset_list, verify=self.verify)
+
+    def _fill(self):
+        '''
+        Submit the extents of the window that are not read yet, within the byte budget.
+        '''
+        if not self._prefetch:
+            return
+        for idx in range(self.position, min(len(self.extents), self.position + self.window)):
+            if idx in self._inflight:
+                continue
+            if self._inflight_bytes + self.sizes[idx] > self.max_bytes and len(self._inflight) > 0:
+                break
+            self._inflight[idx] = self.raid6.prefetch_executor.submit(bind(self._read_extent), idx)
+            self._inflight_bytes += self.sizes[idx]
+
+    def _next_extent(self):
+        '''
+        Consume the extent at the current position and move the window forward.
+        '''
+        idx = self.position
+        future = self._inflight.pop(idx, None)
+        if future is None:
+            data = self._read_extent(idx)
+        else:
+            self._inflight_bytes -= self.sizes[idx]
+            if future.done():
+                self.hits += 1
+                # The disks are ahead of the consumer, a full window of ready stripes is wasted memory
+                if all(inn_future.done() for inn_future in self._inflight.values()) and len(self._inflight) >= self.window - 1:
+                    self.window = max(self.min_window, self.window - 1)
+            else:
+                self.waits += 1
+                self.window = min(self.max_window, self.window * 2)
+            data = future.result()
+        self.position += 1
+        self._fill()
+        return data
+
+    def _seek(self, idx: int):
+        '''
+        Restart the readahead from an extent, the prefetched extents are dropped.
+        '''
+        if idx == self.position:
+            return
+        for future in self._inflight.values():
+            future.cancel()
+        self._inflight.clear()
+        self._inflight_bytes = 0
+        self.position = idx
+        self.window = self.min_window
+
+    def read(self, offset: int, size: int):
+        '''
+        Read size bytes of the file starting from offset, the range is clipped to the end of the file.
+        Reads continuing where the previous one stopped are served from the readahead window.
+        '''
+        if self.info is None:
+            return self._read_stored(offset, size)
+        if offset >= self.info.size or size <= 0:
+            return b""
+        _, _, start, end = self.info.span(offset, size)
+        return decompress_span(self.info, self._read_stored(start, end - start), offset, size, self.raid6.compress_executor)
+
+    def _read_stored(self, offset: int, size: int):
+        '''
+        Read size bytes of the stored bytes of the file starting from offset.
+        '''
+        end = min(offset + size, self.file_size)
+        data = bytearray(0)
+        while offset < end:
+            idx = bisect_right(self.starts, offset) - 1
+            if self._current_idx != idx:
+                self._seek(idx)
+                self._current = self._next_extent()
+                self._current_idx = idx
+            start = offset - self.starts[idx]
+            inn_size = min(end - offset, self.sizes[idx] - start)
+            data += self._current[start : start + inn_size]
+            offset += inn_size
+        return bytes(data)
+
+    def close(self):
+        for future in self._inflight.values():
+            future.cancel()
+        self._inflight.clear()
+        self._inflight_bytes = 0
@@ -0,0 +1,319 @@
+'''
+Disks of the RAID6 system exported over TCP.
+A BlockServer serves one disk file, a RemoteDisk is its client with the interface of Disk, so each disk of the
+array can be placed on a different storage node:
+    python -m src.remote --path /data/disk0 --size 1073741824 --port 9000
+Requests are a header (op, offset, size) followed by the data of a write, responses are a header (status, size)
+followed by the data of a read. The responses of a connection are sent in the order of its requests.
+'''
+import os
+import socket
+import socketserver
+import struct
+import threading
+import time
+from src.qos import scheduled
+from src.utils import LatencyTracker, buffer_size, coalesce_pieces, pieces_size, punch_hole
+
+OP_READ = 0
+OP_WRITE = 1
+OP_CHECK = 2
+OP_FORMAT = 3
+OP_DISCARD = 4
+
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+REQUEST = struct.Struct("!BQI") # op, offset, size
+RESPONSE = struct.Struct("!BI") # status, size
+
+
+def recv_into(sock: socket.socket, buffer):
+    '''
+    Fill the buffer from the socket.
+    '''
+    view = memoryview(buffer).cast("B")
+    while view.nbytes > 0:
+        received = sock.recv_into(view)
+        if received == 0:
+            raise ConnectionError("Connection closed by the peer")
+        view = view[received:]
+
+def recv_exact(sock: socket.socket, size: int):
+    buffer = bytearray(size)
+    recv_into(sock, buffer)
+    return buffer
+
+
+class _BlockHandler(socketserver.BaseRequestHandler):
+    def setup(self):
+        with self.server._lock:
+            self.server._connections.add(self.request)
+
+    def finish(self):
+        with self.server._lock:
+            self.server._connections.discard(self.request)
+
+    def handle(self):
+        server = self.server
+        sock = self.request
+        while True:
+            try:
+                op, offset, size = REQUEST.unpack(recv_exact(sock, REQUEST.size))
+                data = recv_exact(sock, size) if op == OP_WRITE else None
+                status, payload = server.execute(op, offset, size, data)
+                sock.sendall(RESPONSE.pack(status, len(payload)) + payload)
+            except OSError:
+                return
+
+
+class BlockServer(socketserver.ThreadingTCPServer):
+    '''
+    Export a disk file of size bytes over TCP, one thread per connection.
+    The file is created zero-filled when it is missing, CHECK fails once it is removed or resized.
+    '''
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, path: str, size: int, host: str = "127.0.0.1", port: int = 0):
+        super().__init__((host, port), _BlockHandler)
+        self.path = path
+        self.size = size
+        self._fd = None
+        self._lock = threading.Lock()
+        self._connections = set()
+        self._thread = None
+        if not os.path.exists(path) or os.path.getsize(path) != size:
+            self._format()
+        else:
+            self._fd = os.open(path, os.O_RDWR)
+
+    @property
+    def address(self):
+        host, port = self.server_address[:2]
+        return f"{host}:{port}"
+
+    def _format(self):
+        with self._lock:
+            if self._fd is not None:
+                os.close(self._fd)
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_TRUNC)
+            os.ftruncate(self._fd, self.size)
+
+    def execute(self, op: int, offset: int, size: int, data: bytearray):
+        '''
+        Run a request, return the response status and payload.
+        '''
+        try:
+            if op == OP_CHECK:
+                healthy = os.path.exists(self.path) and os.path.getsize(self.path) == self.size
+                return (STATUS_OK if healthy else STATUS_ERROR), b""
+            if op == OP_FORMAT:
+                self._format()
+                return STATUS_OK, b""
+            if offset + size > self.size:
+                return STATUS_ERROR, b""
+            if op == OP_READ:
+                return STATUS_OK, os.pread(self._fd, size, offset)
+            if op == OP_WRITE:
+                os.pwrite(self._fd, data, offset)
+                return STATUS_OK, b""
+            if op == OP_DISCARD:
+                punch_hole(self._fd, offset, size)
+                return STATUS_OK, b""
+        except OSError:
+            pass
+        return STATUS_ERROR, b""
+
+    def start(self):
+        '''
+        Serve in a background thread.
+        '''
+        self._thread = threading.Thread(target=self.serve_forever, args=(0.05,), name="raid6-block-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        '''
+        Stop serving and drop the open connections.
+        '''
+        self.shutdown()
+        self.server_close()
+        with self._lock:
+            for sock in self._connections:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class RemoteDisk:
+    '''
+    Client of a disk exported by a BlockServer, with the interface of Disk.
+    Up to pool_size connections are kept open for reuse. The contiguous pieces of a readv or writev are merged
+    into one request and all the requests are sent before their responses are read, so a batch costs one round
+    trip. A connection error, a timeout or an error response marks the disk as failed.
+    '''
+    def __init__(self, address: str, size: int, id: int, timeout: float = 5.0, pool_size: int = 4):
+        host, port = address.rsplit(":", 1)
+        self.address = (host, int(port))
+        self.path = address
+        self.size = size
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.status = True # True: normal, False: damaged
+        self.latency = LatencyTracker()
+        self.scheduler = None # DiskScheduler of the requests, see src/qos.py
+        self._pool = []
+        self._lock = threading.Lock()
+
+    def _acquire(self, pooled: bool = True):
+        if pooled:
+            with self._lock:
+                if len(self._pool) > 0:
+                    return self._pool.pop()
+        sock = socket.create_connection(self.address, timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    def _release(self, sock: socket.socket):
+        with self._lock:
+            if len(self._pool) < self.pool_size:
+                self._pool.append(sock)
+                return
+        sock.close()
+
+    def _pipeline(self, sock: socket.socket, requests: list):
+        '''
+        Send all the requests, then read their responses in order, return False on an error response.
+        '''
+        for op, offset, size, data, _ in requests:
+            sock.sendall(REQUEST.pack(op, offset, size))
+            for buffer in data or []:
+                sock.sendall(buffer)
+        failed = False
+        for op, _, size, _, outs in requests:
+            status, payload_size = RESPONSE.unpack(recv_exact(sock, RESPONSE.size))
+            if status != STATUS_OK or (op == OP_READ and payload_size != size):
+                failed = True
+                recv_exact(sock, payload_size)
+                continue
+            for buffer in outs or []:
+                recv_into(sock, buffer)
+        return not failed
+
+    def _call(self, requests: list):
+        '''
+        Pipeline (op, offset, size, data, out buffers) requests on one connection. The payload of a read is
+        scattered into its out buffers, return False if the disk failed.
+        A pooled connection closed by the node is retried once on a new one, the requests are idempotent.
+        '''
+        for pooled in [True, False]:
+            try:
+                sock = self._acquire(pooled)
+            except OSError:
+                break
+            try:
+                ok = self._pipeline(sock, requests)
+            except OSError:
+                sock.close()
+                continue
+            if not ok:
+                # The rest of the batch may not have been answered, the connection is not reused
+                sock.close()
+                self.status = False
+                return False
+            self._release(sock)
+            return True
+        self.status = False
+        return False
+
+    def read(self, offset: int, size: int):
+        if offset + size > self.size:
+            raise ValueError("Read out of bound")
+        buffer = bytearray(size)
+        if self.readinto(offset, buffer) is False:
+            return None
+        return bytes(buffer)
+
+    @scheduled(buffer_size)
+    def write(self, offset: int, data: bytearray):
+        if offset + len(data) > self.size:
+            raise ValueError("Write out of bound")
+        self._call([(OP_WRITE, offset, len(data), [data], None)])
+
+    def readinto(self, offset: int, buffer):
+        '''
+        Read len(buffer) bytes into a preallocated writable buffer.
+        '''
+        return self.readv([(offset, buffer)])
+
+    @scheduled(pieces_size)
+    def readv(self, pieces: list):
+        '''
+        Read the (offset, buffer) pieces with one request per run of contiguous offsets, return False on failure.
+        '''
+        if any(offset + memoryview(buffer).nbytes > self.size for offset, buffer in pieces):
+            raise ValueError("Read out of bound")
+        requests = []
+        for offset, buffers in coalesce_pieces(pieces):
+            requests.append((OP_READ, offset, sum(memoryview(buffer).nbytes for buffer in buffers), None, buffers))
+        start = time.perf_counter()
+        try:
+            return self._call(requests)
+        finally:
+            self.latency.record(time.perf_counter() - start)
+
+    @scheduled(pieces_size)
+    def writev(self, pieces: list):
+        '''
+        Write the (offset, buffer) pieces with one request per run of contiguous offsets.
+        '''
+        if any(offset + memoryview(buffer).nbytes > self.size for offset, buffer in pieces):
+            raise ValueError("Write out of bound")
+        requests = []
+        for offset, buffers in coalesce_pieces(pieces):
+            requests.append((OP_WRITE, offset, sum(memoryview(buffer).nbytes for buffer in buffers), buffers, None))
+        self._call(requests)
+
+    def discard(self, offset: int, size: int):
+        '''
+        Punch a hole of size bytes in the exported disk file.
+        '''
+        if offset + size > self.size:
+            raise ValueError("Discard out of bound")
+        self._call([(OP_DISCARD, offset, size, None, None)])
+
+    def check(self):
+        self.status = self._call([(OP_CHECK, 0, 0, None, None)])
+        return self.status
+
+    def init_new_disk(self, path: str):
+        '''
+        Format the exported disk file, the node keeps its address.
+        '''
+        self.status = True
+        self.latency = LatencyTracker()
+        self._call([(OP_FORMAT, 0, 0, None, None)])
+
+    def close(self):
+        with self._lock:
+            for sock in self._pool:
+                sock.close()
+            self._pool = []
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Export a RAID6 disk file over TCP")
+    parser.add_argument("--path", required=True, help="Path of the disk file")
+    parser.add_argument("--size", type=int, required=True, help="Disk size in bytes")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=9000)
+    args = parser.parse_args()
+    server = BlockServer(args.path, args.size, args.host, args.port)
+    print(f"Serving {args.path} on {server.address}")
+    server.serve_forever()
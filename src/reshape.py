@@ -0,0 +1,177 @@
+import os
+import threading
+from contextlib import ExitStack
+from sortedcontainers import SortedList
+from src.galois_field import cal_parity_8
+from src.qos import BACKGROUND, io_class
+from src.raid6 import RAID6, find_parity_PQ_idx
+from src.utils import ReshapeState
+
+
+class Reshaper(object):
+    '''
+    Online reshape of a RAID6 system to more data disks.
+    The stripes keep their index and their offsets, so file2stripe and stripe2file are not touched while the
+    stripes are migrated in order, batch_stripes at a time. A batch is copied to a backup file and checkpointed
+    before its stripes are rewritten in place in the new layout, each stripe with one parity computation.
+    Only the stripes of the current batch are locked, the others keep serving reads and writes in their old or
+    new layout. The added capacity is handed to the allocator once every stripe is migrated.
+    An interrupted reshape is resumed by creating a Reshaper with the same number of data disks.
+    '''
+    def __init__(self, raid6: RAID6, new_data_disks: int, batch_stripes: int = 8, max_bytes_per_sec: int = None):
+        self.raid6 = raid6
+        self.batch_stripes = batch_stripes
+        self.max_bytes_per_sec = max_bytes_per_sec
+        self.state_path = os.path.join(raid6.data_path, "reshape.json")
+        self.backup_path = os.path.join(raid6.data_path, "reshape.backup")
+        self._stop = threading.Event()
+        self._thread = None
+
+        with raid6._array_lock.write_locked():
+            if raid6.reshape is None:
+                if len(raid6.spare.rows) > 0:
+                    raise ValueError("Disks are served by the spare rows, copy them back before reshaping")
+                if raid6.cache is not None:
+                    raise ValueError("The cache tier holds stripes of the old layout, detach it before reshaping")
+                if new_data_disks <= raid6.data_disks:
+                    raise ValueError("The reshape must add data disks")
+                state = ReshapeState(raid6.data_disks, new_data_disks)
+                state.save(self.state_path)
+                raid6._attach_reshape(state)
+            elif raid6.reshape.new_data_disks != new_data_disks:
+                raise ValueError(f"A reshape to {raid6.reshape.new_data_disks} data disks is in progress")
+            self.state = raid6.reshape
+
+            # Finish the batch interrupted by a crash from its backup copy
+            if self.state.batch_end > self.state.position:
+                with open(self.backup_path, "rb") as f:
+                    backup = f.read()
+                self._write_batch(self.state.position, self.state.batch_end, backup)
+        raid6.logger.info(f"Reshape to {new_data_disks} data disks at stripe {self.state.position}")
+
+    @property
+    def done(self):
+        return self.raid6.reshape is None
+
+    def _write_batch(self, start: int, end: int, backup: bytes):
+        '''
+        Write the stripes [start, end) in the new layout from their old data, then move the checkpoint past them.
+        The caller holds the locks of the stripes.
+        '''
+        raid6 = self.raid6
+        state = self.state
+        block_size = raid6.block_size
+        old_size = state.old_data_disks * block_size
+        new_width = state.new_data_disks + raid6.parity_disks
+        stripe_data = bytearray(state.new_data_disks * block_size)
+        p = bytearray(block_size)
+        q = bytearray(block_size)
+        for stripe_idx in range(start, end):
+            (p_idx, q_idx), data_disk_idxs = find_parity_PQ_idx(stripe_idx, state.new_data_disks, new_width)
+            # The added blocks are zero-filled so the parity stays valid when they are handed out
+            stripe_data[:old_size] = backup[(stripe_idx - start) * old_size : (stripe_idx - start + 1) * old_size]
+            stripe_data[old_size:] = bytes(len(stripe_data) - old_size)
+            cal_parity_8(p, q, stripe_data)
+
+            raid6._mark_dirty(stripe_idx)
+            base = stripe_idx * block_size
+            for i, disk_idx in enumerate(data_disk_idxs):
+                raid6.disks[disk_idx].write(base, stripe_data[i * block_size : (i + 1) * block_size])
+            raid6.disks[p_idx].write(base, p)
+            raid6.disks[q_idx].write(base, q)
+            raid6._clear_dirty(stripe_idx)
+
+        state.position = end
+        state.save(self.state_path)
+
+    def reshape_once(self):
+        '''
+        Migrate the next batch of stripes, return the number of stripes migrated.
+        '''
+        raid6 = self.raid6
+        state = self.state
+        if self.done:
+            return 0
+        start = state.position
+        end = min(raid6.stripe_num, start + self.batch_stripes)
+
+        with raid6._array_lock.read_locked(), io_class(BACKGROUND):
+            with ExitStack() as stack:
+                for stripe_idx in range(start, end):
+                    stack.enter_context(raid6._stripe_locks[stripe_idx].write_locked())
+
+                backup = bytearray(0)
+                for stripe_idx in range(start, end):
+                    _, _, stripe_data, data_idxs = raid6._load_stripes(stripe_idx)
+                    if len(data_idxs) != state.old_data_disks:
+                        raise ValueError(f"Stripe {stripe_idx} is degraded, recover the disks before reshaping")
+                    backup += stripe_data
+                with open(self.backup_path, "wb") as f:
+                    f.write(backup)
+                    f.flush()
+                    os.fsync(f.fileno())
+                state.batch_end = end
+                state.save(self.state_path)
+
+                self._write_batch(start, end, backup)
+
+        if state.position == raid6.stripe_num:
+            self._finish()
+        return end - start
+
+    def _finish(self):
+        '''
+        Switch the RAID6 system to the new layout and hand the added capacity to the allocator.
+        '''
+        raid6 = self.raid6
+        state = self.state
+        with raid6._array_lock.write_locked(), raid6._alloc_lock:
+            old_size = raid6.stripe_size
+            new_size = state.new_data_disks * raid6.block_size
+            for stripe_idx in range(raid6.stripe_num):
+                raid6.stripe2file[stripe_idx][old_size] = [None, new_size - old_size]
+                raid6._merge_fragment(stripe_idx)
+            raid6.stripe_status = SortedList()
+            for stripe_idx in range(raid6.stripe_num):
+                free = sum(size for name, size in raid6.stripe2file[stripe_idx].values() if name is None)
+                if free > 0:
+                    raid6.stripe_status.add((free, stripe_idx))
+            raid6.left_size += (new_size - old_size) * raid6.stripe_num
+            raid6.data_disks = state.new_data_disks
+            raid6.stripe_width = state.new_data_disks + raid6.parity_disks
+            raid6.stripe_size = new_size
+            raid6.reshape = None
+
+        os.remove(self.state_path)
+        if os.path.exists(self.backup_path):
+            os.remove(self.backup_path)
+        raid6.logger.info(f"Reshape finished, the RAID6 system has {raid6.data_disks} data disks")
+
+    def run(self):
+        '''
+        Migrate the stripes until the reshape is finished or stopped.
+        '''
+        while not self.done and not self._stop.is_set():
+            migrated = self.reshape_once()
+            if self.max_bytes_per_sec:
+                self._stop.wait(migrated * self.raid6.stripe_size / self.max_bytes_per_sec)
+
+    def start(self):
+        '''
+        Start reshaping in a background thread.
+        '''
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name="raid6-reshaper", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        '''
+        Stop the background thread after its current batch, the reshape can be continued later.
+        '''
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
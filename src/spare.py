@@ -0,0 +1,98 @@
+import threading
+from contextlib import ExitStack
+from src.qos import REBUILD, io_class
+from src.raid6 import RAID6
+from src.utils import SpareDisk
+
+
+class CopyBack(object):
+    '''
+    Background copy-back of a disk served by the spare rows to its replacement, see RAID6.replace_disk.
+    The blocks are copied batch_stripes stripes at a time under the stripe locks, then their spare rows are
+    released and the placement is checkpointed. The copied stripes are served by the replacement and the
+    others by the spare rows, so the array keeps serving reads and writes during the copy.
+    An interrupted copy-back is resumed by creating a CopyBack for the same disk.
+    '''
+    def __init__(self, raid6: RAID6, disk_idx: int, batch_stripes: int = 8, max_bytes_per_sec: int = None):
+        self.raid6 = raid6
+        self.disk_idx = disk_idx
+        self.batch_stripes = batch_stripes
+        self.max_bytes_per_sec = max_bytes_per_sec
+        self._stop = threading.Event()
+        self._thread = None
+
+        disk = raid6.disks[disk_idx]
+        if not isinstance(disk, SpareDisk) or disk.replacement is None:
+            raise ValueError(f"Disk {disk_idx} has no replacement to copy back to")
+        self.disk = disk
+
+    @property
+    def done(self):
+        return self.disk_idx not in self.raid6.spare.rows
+
+    def copy_once(self):
+        '''
+        Copy the next batch of stripes back to the replacement, return the number of stripes copied.
+        '''
+        raid6 = self.raid6
+        if self.done:
+            return 0
+        rows = self.disk.rows
+        stripe_idxs = sorted(rows)[: self.batch_stripes]
+
+        with raid6._array_lock.read_locked(), io_class(REBUILD):
+            with ExitStack() as stack:
+                for stripe_idx in stripe_idxs:
+                    stack.enter_context(raid6._stripe_locks[stripe_idx].write_locked())
+                for stripe_idx in stripe_idxs:
+                    spare_disk, spare_row = rows[stripe_idx]
+                    block = raid6.disks[spare_disk].read(spare_row * raid6.block_size, raid6.block_size)
+                    self.disk.replacement.write(stripe_idx * raid6.block_size, block)
+                for stripe_idx in stripe_idxs:
+                    del rows[stripe_idx]
+                raid6.spare.save(raid6.spare_path)
+
+        if len(rows) == 0:
+            self._finish()
+        return len(stripe_idxs)
+
+    def _finish(self):
+        '''
+        Put the replacement back in the array.
+        '''
+        raid6 = self.raid6
+        with raid6._array_lock.write_locked():
+            raid6.disks[self.disk_idx] = self.disk.replacement
+            del raid6.spare.rows[self.disk_idx]
+            raid6.spare.replaced.remove(self.disk_idx)
+            raid6.spare.save(raid6.spare_path)
+        raid6.logger.info(f"Copy-back of disk {self.disk_idx} finished")
+
+    def run(self):
+        '''
+        Copy the stripes back until the copy-back is finished or stopped.
+        '''
+        while not self.done and not self._stop.is_set():
+            copied = self.copy_once()
+            if self.max_bytes_per_sec:
+                self._stop.wait(copied * self.raid6.block_size / self.max_bytes_per_sec)
+
+    def start(self):
+        '''
+        Start copying back in a background thread.
+        '''
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name="raid6-copy-back", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        '''
+        Stop the background thread after its current batch, the copy-back can be continued later.
+        '''
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
@@ -1,11 +1,109 @@
 import os
+import ctypes
+import ctypes.util
+import json
+import mmap
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
 from dataclasses import dataclass, field
+from src.qos import scheduled
+
+class LatencyTracker:
+    '''
+    Read latency statistics of a disk: an exponentially weighted moving average over all the reads
+    and the tail percentiles of the last window reads.
+    '''
+    def __init__(self, alpha: float = 0.1, window: int = 1024):
+        self.alpha = alpha
+        self.ewma = 0.0
+        self.count = 0
+        self.hedges = 0 # number of reads raced against a reconstruction
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self.ewma = seconds if self.count == 0 else self.alpha * seconds + (1 - self.alpha) * self.ewma
+            self.count += 1
+            self._samples.append(seconds)
+
+    def percentile(self, q: float):
+        '''
+        Get the q-th percentile (nearest rank) of the recent latencies in seconds.
+        '''
+        with self._lock:
+            samples = sorted(self._samples)
+        if len(samples) == 0:
+            return 0.0
+        return samples[min(len(samples) - 1, int(q / 100 * len(samples)))]
+
+    def stats(self):
+        return {
+            "count": self.count,
+            "ewma": self.ewma,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "hedges": self.hedges,
+        }
+
+try:
+    IOV_MAX = os.sysconf("SC_IOV_MAX")
+except (AttributeError, ValueError, OSError):
+    IOV_MAX = 1024
+
+def coalesce_pieces(pieces: list):
+    '''
+    Group the (offset, buffer) pieces into runs of contiguous offsets, return (offset, [buffers]) per run.
+    A run has at most IOV_MAX buffers.
+    '''
+    runs = []
+    end = None
+    for offset, buffer in sorted(pieces, key=lambda piece: piece[0]):
+        size = memoryview(buffer).nbytes
+        if offset == end and len(runs[-1][1]) < IOV_MAX:
+            runs[-1][1].append(buffer)
+        else:
+            runs.append((offset, [buffer]))
+        end = offset + size
+    return runs
+
+FALLOC_FL_KEEP_SIZE = 0x01
+FALLOC_FL_PUNCH_HOLE = 0x02
+try:
+    _fallocate = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True).fallocate
+    _fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64]
+except (OSError, AttributeError):
+    _fallocate = None
+
+def punch_hole(fd: int, offset: int, size: int):
+    '''
+    Deallocate a range of a file with fallocate(PUNCH_HOLE), the range reads back as zeros.
+    The range is overwritten with zeros where the platform or the file system cannot punch holes.
+    '''
+    if _fallocate is not None and _fallocate(fd, FALLOC_FL_PUNCH_HOLE | FALLOC_FL_KEEP_SIZE, offset, size) == 0:
+        return
+    os.pwrite(fd, bytes(size), offset)
+
+def read_size(offset: int, size: int):
+    return size
+
+def buffer_size(offset: int, buffer):
+    return memoryview(buffer).nbytes
+
+def pieces_size(pieces: list):
+    return sum(memoryview(buffer).nbytes for _, buffer in pieces)
 
 # Define a class to simulate each disk in the RAID6 system
 class Disk:
     def __init__(self, path: str, size: int, id: int):
         self.size = size
         self.status = True # True: normal, False: damaged
+        self.latency = LatencyTracker()
+        self.scheduler = None # DiskScheduler of the requests, see src/qos.py
+        self.created = False # True if the disk file was created zero-filled
 
         # create a file to simulate the disk
         self.path = os.path.join(path, f"disk{id}")
@@ -17,20 +115,26 @@ class Disk:
                     raise ValueError("Disk size mismatch")
         except:
             self.init_new_disk(self.path)
+            self.created = True
             
         print(f"Disk {id} is loaded with size {size} bytes")
     
+    @scheduled(read_size)
     def read(self, offset: int, size: int):
         if offset + size > self.size:
             raise ValueError("Read out of bound")
         
+        start = time.perf_counter()
         try:
             with open(self.path, "rb") as f:
                 f.seek(offset)
                 return f.read(size)
         except:
             self.status = False
+        finally:
+            self.latency.record(time.perf_counter() - start)
 
+    @scheduled(buffer_size)
     def write(self, offset: int, data: bytearray):
         if offset + len(data) > self.size:
             raise ValueError("Write out of bound")
@@ -42,6 +146,90 @@ class Disk:
         except:
             self.status = False
 
+    @scheduled(buffer_size)
+    def readinto(self, offset: int, buffer):
+        '''
+        Read len(buffer) bytes into a preallocated writable buffer.
+        '''
+        size = memoryview(buffer).nbytes
+        if offset + size > self.size:
+            raise ValueError("Read out of bound")
+
+        start = time.perf_counter()
+        try:
+            with open(self.path, "rb") as f:
+                f.seek(offset)
+                f.readinto(buffer)
+        except:
+            self.status = False
+        finally:
+            self.latency.record(time.perf_counter() - start)
+
+    @scheduled(pieces_size)
+    def readv(self, pieces: list):
+        '''
+        Read the (offset, buffer) pieces with one preadv call per run of contiguous offsets, return False on failure.
+        '''
+        if any(offset + memoryview(buffer).nbytes > self.size for offset, buffer in pieces):
+            raise ValueError("Read out of bound")
+        if not hasattr(os, "preadv"):
+            for offset, buffer in pieces:
+                self.readinto(offset, buffer)
+            return self.status
+
+        start = time.perf_counter()
+        try:
+            fd = os.open(self.path, os.O_RDONLY)
+            try:
+                for offset, buffers in coalesce_pieces(pieces):
+                    os.preadv(fd, buffers, offset)
+            finally:
+                os.close(fd)
+        except:
+            self.status = False
+            return False
+        finally:
+            self.latency.record(time.perf_counter() - start)
+        return True
+
+    @scheduled(pieces_size)
+    def writev(self, pieces: list):
+        '''
+        Write the (offset, buffer) pieces with one pwritev call per run of contiguous offsets.
+        '''
+        if any(offset + memoryview(buffer).nbytes > self.size for offset, buffer in pieces):
+            raise ValueError("Write out of bound")
+        if not hasattr(os, "pwritev"):
+            for offset, buffer in pieces:
+                self.write(offset, buffer)
+            return
+
+        try:
+            fd = os.open(self.path, os.O_WRONLY)
+            try:
+                for offset, buffers in coalesce_pieces(pieces):
+                    os.pwritev(fd, buffers, offset)
+            finally:
+                os.close(fd)
+        except:
+            self.status = False
+
+    def discard(self, offset: int, size: int):
+        '''
+        Punch a hole of size bytes, the range reads back as zeros.
+        '''
+        if offset + size > self.size:
+            raise ValueError("Discard out of bound")
+
+        try:
+            fd = os.open(self.path, os.O_WRONLY)
+            try:
+                punch_hole(fd, offset, size)
+            finally:
+                os.close(fd)
+        except:
+            self.status = False
+
     def check(self):
         try:
             with open(self.path, "rb") as f:
@@ -55,9 +243,264 @@ class Disk:
     def init_new_disk(self, path: str):
         self.path = path
         self.status = True
+        self.latency = LatencyTracker()
         with open(path, "wb") as f:
             f.write(b"\x00" * self.size)
 
+class SpareDisk:
+    '''
+    A failed disk of a declustered array, served from the spare rows reserved at the end of the other disks.
+    The block of stripe i lives in rows[i] = (spare disk idx, spare row). Once a replacement is attached,
+    the stripes copied back to it leave rows and are served by the replacement.
+    '''
+    def __init__(self, disks: list, rows: dict, block_size: int, disk: Disk):
+        self.disks = disks
+        self.rows = rows
+        self.block_size = block_size
+        self.disk = disk # the failed disk, reinitialized as the replacement
+        self.replacement = None
+        self.size = disk.size
+        self.path = disk.path
+        self.status = True
+        self.latency = LatencyTracker()
+
+    def _locate(self, offset: int):
+        '''
+        Find the disk and the disk offset holding an offset of the failed disk.
+        '''
+        stripe_idx, col = divmod(offset, self.block_size)
+        if stripe_idx in self.rows:
+            spare_disk, spare_row = self.rows[stripe_idx]
+            return self.disks[spare_disk], spare_row * self.block_size + col
+        if self.replacement is None:
+            raise ValueError(f"Stripe {stripe_idx} has no spare row")
+        return self.replacement, offset
+
+    def _group(self, pieces: list):
+        groups = {}
+        for offset, buffer in pieces:
+            disk, disk_offset = self._locate(offset)
+            groups.setdefault(id(disk), (disk, []))[1].append((disk_offset, buffer))
+        return groups.values()
+
+    def read(self, offset: int, size: int):
+        disk, disk_offset = self._locate(offset)
+        return disk.read(disk_offset, size)
+
+    def write(self, offset: int, data: bytearray):
+        disk, disk_offset = self._locate(offset)
+        disk.write(disk_offset, data)
+
+    def readinto(self, offset: int, buffer):
+        disk, disk_offset = self._locate(offset)
+        disk.readinto(disk_offset, buffer)
+
+    def readv(self, pieces: list):
+        return all([disk.readv(disk_pieces) for disk, disk_pieces in self._group(pieces)])
+
+    def writev(self, pieces: list):
+        for disk, disk_pieces in self._group(pieces):
+            disk.writev(disk_pieces)
+
+    def discard(self, offset: int, size: int):
+        disk, disk_offset = self._locate(offset)
+        disk.discard(disk_offset, size)
+
+    def check(self):
+        return self.status
+
+class BufferPool:
+    '''
+    Pool of page-aligned buffers of a fixed size, handed out as memoryviews with acquire/release semantics.
+    A released buffer keeps its old content, acquire with zero=True for the accumulating parity kernels.
+    At most max_free buffers are kept for reuse, the rest are left to the garbage collector.
+    '''
+    def __init__(self, size: int, max_free: int = 32):
+        self.size = size
+        self.max_free = max_free
+        self._free = []
+        self._zeros = memoryview(bytes(size))
+        self._lock = threading.Lock()
+        self.allocated = 0 # number of buffers allocated over the lifetime of the pool
+
+    def acquire(self, zero: bool = False):
+        with self._lock:
+            buffer = self._free.pop() if self._free else None
+            if buffer is None:
+                self.allocated += 1
+        if buffer is None:
+            # Anonymous mmaps are page-aligned
+            buffer = memoryview(mmap.mmap(-1, self.size))
+        elif zero:
+            buffer[:] = self._zeros
+        return buffer
+
+    def release(self, buffer: memoryview):
+        # Buffers of a pool replaced after a reshape are dropped
+        if buffer.nbytes != self.size:
+            return
+        with self._lock:
+            if len(self._free) < self.max_free:
+                self._free.append(buffer)
+
+    @contextmanager
+    def buffer(self, zero: bool = False):
+        buffer = self.acquire(zero)
+        try:
+            yield buffer
+        finally:
+            self.release(buffer)
+
+class WriteIntentBitmap:
+    '''
+    Persistent write-intent bitmap with one bit per region of stripes.
+    A region is marked dirty on disk before its data or parity blocks are written. Once no write is in flight
+    it is cleared lazily, clear_batch regions at a time, so after a crash only the dirty regions need their
+    parity recomputed instead of the whole array.
+    '''
+    def __init__(self, path: str, stripe_num: int, region_stripes: int = 1, clear_batch: int = 64):
+        self.path = path
+        self.stripe_num = stripe_num
+        self.region_stripes = region_stripes
+        self.region_num = (stripe_num + region_stripes - 1) // region_stripes
+        self.clear_batch = clear_batch
+        self._lock = threading.Lock()
+        self._inflight = [0] * self.region_num
+        self._pending = set() # regions waiting to be cleared
+
+        size = (self.region_num + 7) // 8
+        if not os.path.exists(path) or os.path.getsize(path) != size:
+            with open(path, "wb") as f:
+                f.write(b"\x00" * size)
+        self._fd = os.open(path, os.O_RDWR)
+        self._bits = bytearray(os.pread(self._fd, size, 0))
+
+    def _is_set(self, region: int):
+        return (self._bits[region >> 3] >> (region & 7)) & 1 == 1
+
+    def dirty_regions(self):
+        '''
+        Get the regions marked dirty on disk.
+        '''
+        with self._lock:
+            return [region for region in range(self.region_num) if self._is_set(region)]
+
+    def region_to_stripes(self, region: int):
+        return range(region * self.region_stripes, min(self.stripe_num, (region + 1) * self.region_stripes))
+
+    def mark(self, stripe_idx: int):
+        '''
+        Mark the region of a stripe dirty, the bit is durable when this returns.
+        '''
+        region = stripe_idx // self.region_stripes
+        with self._lock:
+            self._inflight[region] += 1
+            self._pending.discard(region)
+            if not self._is_set(region):
+                self._bits[region >> 3] |= 1 << (region & 7)
+                os.pwrite(self._fd, self._bits[region >> 3 : (region >> 3) + 1], region >> 3)
+                os.fsync(self._fd)
+
+    def clear(self, stripe_idx: int):
+        '''
+        Finish a write to a stripe, its region is cleared lazily.
+        '''
+        region = stripe_idx // self.region_stripes
+        with self._lock:
+            self._inflight[region] -= 1
+            if self._inflight[region] == 0:
+                self._pending.add(region)
+            if len(self._pending) >= self.clear_batch:
+                self._flush()
+
+    def _flush(self):
+        for region in self._pending:
+            self._bits[region >> 3] &= ~(1 << (region & 7)) & 0xff
+        if len(self._pending) > 0:
+            os.pwrite(self._fd, self._bits, 0)
+            os.fsync(self._fd)
+        self._pending.clear()
+
+    def flush(self):
+        '''
+        Clear every region without a write in flight.
+        '''
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        self.flush()
+        os.close(self._fd)
+
+@dataclass
+class ReshapeState:
+    '''
+    Checkpoint of an online reshape to more data disks.
+    The stripes below position use the new layout, the stripes in [position, batch_end) are being migrated
+    and have a copy in the backup file.
+    '''
+    old_data_disks: int
+    new_data_disks: int
+    position: int = 0
+    batch_end: int = 0
+
+    @classmethod
+    def load(cls, path: str):
+        with open(path, "r") as f:
+            return cls(**json.load(f))
+
+    def save(self, path: str):
+        '''
+        Replace the checkpoint atomically.
+        '''
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.__dict__, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+@dataclass
+class SpareState:
+    '''
+    Placement of the blocks of the failed disks in the spare rows of a declustered array.
+    rows maps a failed disk idx to its stripe idx -> (spare disk idx, spare row) mapping,
+    replaced lists the failed disks with a replacement attached.
+    '''
+    rows: dict = field(default_factory=dict)
+    replaced: list = field(default_factory=list)
+
+    @classmethod
+    def load(cls, path: str):
+        with open(path, "r") as f:
+            state = json.load(f)
+        rows = {int(disk_idx): {int(stripe_idx): tuple(row) for stripe_idx, row in disk_rows.items()} for disk_idx, disk_rows in state["rows"].items()}
+        return cls(rows, state["replaced"])
+
+    def save(self, path: str):
+        '''
+        Replace the placement atomically.
+        '''
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.__dict__, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+@dataclass
+class Snapshot:
+    '''
+    Point-in-time copy of the metadata maps of a RAID6 system.
+    file2stripe is a copy of the extent table of the files. Its extents are shared with the live files and
+    referenced until the snapshot is deleted, so the data blocks are never copied.
+    '''
+    name: str
+    created: float
+    file2stripe: dict
+    compressed: dict
+    recipes: dict
+
 @dataclass
 class RAID6Config:
     '''
@@ -69,11 +512,39 @@ class RAID6Config:
     # stripe_width: int = field(default=6, metadata={"description": "Number of disks in a stripe"})
     block_size: int = field(default=1024 * 1024, metadata={"description": "Block size in bytes"})
     disk_size: int = field(default=1024*1024*1024, metadata={"description": "Disk size in bytes"})
+    write_intent_bitmap: bool = field(default=True, metadata={"description": "Track the stripes being written for a fast resync after a crash"})
+    hedged_reads: bool = field(default=True, metadata={"description": "Race slow data block reads against their reconstruction from P"})
+    hedge_min_ms: float = field(default=5.0, metadata={"description": "Minimal latency in milliseconds before a read is hedged"})
+    hedge_factor: float = field(default=4.0, metadata={"description": "A read is hedged after hedge_factor times the median disk latency"})
+    slow_disk_factor: float = field(default=4.0, metadata={"description": "A disk is flagged as slow above slow_disk_factor times the median disk latency"})
+    readahead_stripes: int = field(default=8, metadata={"description": "Maximal number of stripes prefetched by a sequential reader"})
+    bitmap_region_stripes: int = field(default=1, metadata={"description": "Number of stripes covered by one bit of the write-intent bitmap"})
+    compression: str = field(default="none", metadata={"description": "Codec of the saved files: none, zlib, lzma or auto to sample each file"})
+    compression_chunk: int = field(default=1024 * 1024, metadata={"description": "Size in bytes of the independently compressed chunks of a file"})
+    dedup: bool = field(default=False, metadata={"description": "Store the distinct chunks of the saved files once"})
+    dedup_chunk: int = field(default=64 * 1024, metadata={"description": "Average size in bytes of the deduplicated chunks"})
+    dedup_chunking: str = field(default="cdc", metadata={"description": "Chunk boundaries of the deduplication: cdc (content-defined) or fixed"})
+    disk_nodes: list = field(default=None, metadata={"description": "host:port of the BlockServer of each disk, local disk files by default"})
+    spare_disks: int = field(default=0, metadata={"description": "Number of disk failures absorbed by spare rows reserved on every disk, 0 for replacement disks"})
+    qos: bool = field(default=False, metadata={"description": "Schedule the I/O of every disk by class, foreground before rebuild and background, at most qos_depth requests per disk in flight"})
+    qos_depth: int = field(default=1, metadata={"description": "Maximal number of requests in flight per disk"})
+    qos_latency_ms: float = field(default=50.0, metadata={"description": "Latency budget in milliseconds of the foreground requests, they are dispatched by deadline"})
+    qos_rebuild_rate: int = field(default=None, metadata={"description": "Rate limit in bytes per second per disk of the rebuild I/O, None for the bandwidth left by the foreground"})
+    qos_background_rate: int = field(default=None, metadata={"description": "Rate limit in bytes per second per disk of the background I/O, None for the bandwidth left by the foreground"})
+    cache_path: str = field(default=None, metadata={"description": "Path of the cache tier file on a fast local device, no cache by default"})
+    cache_size: int = field(default=256 * 1024 * 1024, metadata={"description": "Size in bytes of the stripe lines of the cache tier"})
+    cache_admit_min: int = field(default=2, metadata={"description": "Minimal recent accesses of a stripe before it is cached"})
+    discard: bool = field(default=True, metadata={"description": "Punch holes in the data blocks freed as a whole by a deletion, see RAID6.discard_freed"})
+    rebuild_batch: int = field(default=16, metadata={"description": "Number of stripes missing the same two data blocks rebuilt in one kernel call"})
     
     def __post_init__(self):
         assert self.parity_disks == 2, "RAID6 does not support 2 parity disks"
         # assert self.stripe_width == self.data_disks + self.parity_disks, "Invalid RAID6 configuration"
         assert self.disk_size % self.block_size == 0, "Disk size should be multiple of block size"
+        assert self.compression in ["none", "zlib", "lzma", "auto"], "Unknown compression codec"
+        assert self.dedup_chunking in ["cdc", "fixed"], "Unknown dedup chunking"
+        assert self.disk_nodes is None or len(self.disk_nodes) == self.data_disks + self.parity_disks, "One disk node is needed per disk"
+        assert self.qos_depth >= 1, "At least one request per disk should be in flight"
 
 
 def merge_tuples(tuple_list):
@@ -95,4 +566,69 @@ def merge_tuples(tuple_list):
     
     merged_list.append((current_start, current_size))
     
-    return merged_list, merge_point
\ No newline at end of file
+    return merged_list, merge_point
+
+class RWLock:
+    '''
+    Reader/writer lock, readers share the lock and a writer holds it alone.
+    Read acquisitions are re-entrant and never wait for a pending writer, the writing thread may re-enter
+    both as a writer and as a reader. Upgrading a read lock to a write lock is not supported.
+    '''
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = None
+        self._writer_depth = 0
+
+    def acquire_read(self):
+        with self._cond:
+            if self._writer != threading.get_ident():
+                while self._writer is not None:
+                    self._cond.wait()
+            self._readers += 1
+
+    def release_read(self):
+        with self._cond:
+            self._readers -= 1
+            if self._readers == 0:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        with self._cond:
+            me = threading.get_ident()
+            if self._writer == me:
+                self._writer_depth += 1
+                return
+            while self._writer is not None or self._readers > 0:
+                self._cond.wait()
+            self._writer = me
+            self._writer_depth = 1
+
+    def release_write(self):
+        with self._cond:
+            self._writer_depth -= 1
+            if self._writer_depth == 0:
+                self._writer = None
+                self._cond.notify_all()
+
+    def write_held(self):
+        '''
+        Check if the calling thread holds the write lock.
+        '''
+        return self._writer == threading.get_ident()
+
+    @contextmanager
+    def read_locked(self):
+        self.acquire_read()
+        try:
+            yield self
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def write_locked(self):
+        self.acquire_write()
+        try:
+            yield self
+        finally:
+            self.release_write()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+'''
+@File    : test_async.py
+@Time    : 2026/10/19
+@Version : 0.1
+@License : TOADD
+@Desc    : Unit tests for the asyncio front-end of the raid6 database
+'''
+
+import src
+import os
+import asyncio
+import pytest
+from test_rebuild import build_small_raid6
+
+
+def test_async_save_load_delete(tmp_path):
+    '''
+    Save, read and delete many objects concurrently
+    '''
+    from src.async_raid6 import AsyncRAID6
+
+    raid6 = build_small_raid6(tmp_path / "disk")
+    objects = {f"obj{i}": os.urandom(1000 * (i + 1)) for i in range(12)}
+
+    async def run():
+        async with AsyncRAID6(raid6, max_in_flight=4) as araid6:
+            await asyncio.gather(*[araid6.save_bytes(data, name) for name, data in objects.items()])
+            loaded = await asyncio.gather(*[araid6.load_data(name, verify=True) for name in objects])
+            for name, data in zip(objects, loaded):
+                assert data == objects[name]
+
+            assert await araid6.read_range("obj11", 5000, 3000) == objects["obj11"][5000:8000]
+            assert await araid6.read_range("obj0", 900, 3000) == objects["obj0"][900:]
+
+            await asyncio.gather(*[araid6.delete_data(f"obj{i}") for i in range(0, 12, 2)])
+            for i in range(1, 12, 2):
+                assert await araid6.load_data(f"obj{i}") == objects[f"obj{i}"]
+
+    asyncio.run(run())
+    assert raid6.left_size == raid6.stripe_num * raid6.stripe_size - sum(len(objects[f"obj{i}"]) for i in range(1, 12, 2))
+
+def test_async_modify(tmp_path):
+    '''
+    Modify a file through the asyncio front-end
+    '''
+    from src.async_raid6 import AsyncRAID6
+
+    raid6 = build_small_raid6(tmp_path / "disk")
+    old = os.urandom(20000)
+    new = os.urandom(30000)
+    with open(tmp_path / "old", "wb") as f:
+        f.write(old)
+    with open(tmp_path / "new", "wb") as f:
+        f.write(new)
+
+    async def run():
+        async with AsyncRAID6(raid6) as araid6:
+            await araid6.save_data(str(tmp_path / "old"), name="a")
+            await araid6.modify_data("a", "b", str(tmp_path / "new"))
+            assert await araid6.load_data("b", out_path=str(tmp_path / "out")) == new
+
+    asyncio.run(run())
+    with open(tmp_path / "out", "rb") as f:
+        assert f.read() == new
+
+def test_async_save_replaces(tmp_path):
+    '''
+    Saving a name again replaces the file like save_data, compressed or deduplicated
+    '''
+    from src.async_raid6 import AsyncRAID6
+    from test_dedup import build_dedup_raid6
+
+    raid6 = build_small_raid6(tmp_path / "disk")
+    capacity = raid6.stripe_num * raid6.stripe_size
+    old = b"abcd" * 10000
+    new = os.urandom(30000)
+
+    async def run(raid6):
+        async with AsyncRAID6(raid6) as araid6:
+            await araid6.save_bytes(old, "a", compression="zlib")
+            assert "a" in raid6.compressed and await araid6.load_data("a") == old
+            await araid6.save_bytes(new, "a")
+            assert "a" not in raid6.compressed and await araid6.load_data("a") == new
+
+    asyncio.run(run(raid6))
+    assert raid6.left_size == capacity - len(new)
+    raid6.close()
+
+    raid6 = build_dedup_raid6(tmp_path / "dedup")
+    async def run_dedup():
+        async with AsyncRAID6(raid6) as araid6:
+            await asyncio.gather(araid6.save_bytes(new, "a"), araid6.save_bytes(new, "b"))
+            assert await araid6.load_data("a") == await araid6.load_data("b") == new
+            await araid6.save_bytes(old, "a")
+            assert await araid6.load_data("a") == old and await araid6.load_data("b") == new
+
+    asyncio.run(run_dedup())
+    raid6.close()
+
+def test_async_alloc_off_loop(tmp_path):
+    '''
+    A save or a load waiting for the allocator lock does not block the event loop
+    '''
+    import threading
+    from src.async_raid6 import AsyncRAID6
+
+    raid6 = build_small_raid6(tmp_path / "disk")
+    data = os.urandom(5000)
+    ticks = []
+
+    async def tick(done):
+        while not done.is_set():
+            ticks.append(1)
+            await asyncio.sleep(0.01)
+
+    async def blocked(coroutine):
+        done = asyncio.Event()
+        ticker = asyncio.create_task(tick(done))
+        raid6._alloc_lock.acquire()
+        threading.Timer(0.3, raid6._alloc_lock.release).start()
+        result = await coroutine
+        done.set()
+        await ticker
+        return result
+
+    async def run():
+        async with AsyncRAID6(raid6) as araid6:
+            await blocked(araid6.save_bytes(data, "a"))
+            assert len(ticks) >= 10
+            ticks.clear()
+            assert await blocked(araid6.load_data("a")) == data
+            assert len(ticks) >= 10
+
+    asyncio.run(run())
+    raid6.close()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+'''
+@File    : test_buffer_pool.py
+@Time    : 2026/10/19
+@Version : 0.1
+@License : TOADD
+@Desc    : Unit tests and allocation benchmark for the buffer pool of the raid6 database
+'''
+
+import src
+import os
+import mmap
+import time
+import ctypes
+import pytest
+from test_rebuild import build_small_raid6, fail_disks
+
+
+def test_buffer_pool():
+    '''
+    The buffers are page-aligned, reused after release and zeroed on request
+    '''
+    from src.utils import BufferPool
+
+    pool = BufferPool(8192, max_free=1)
+    buffer = pool.acquire()
+    assert ctypes.addressof(ctypes.c_char.from_buffer(buffer)) % mmap.PAGESIZE == 0
+    buffer[:4] = b"abcd"
+    pool.release(buffer)
+    with pool.buffer() as inn_buffer:
+        assert inn_buffer[:4] == b"abcd"
+    with pool.buffer(zero=True) as inn_buffer:
+        assert inn_buffer.tobytes() == bytes(8192)
+    assert pool.allocated == 1
+
+    # Only max_free buffers are kept
+    buffers = [pool.acquire() for _ in range(3)]
+    for buffer in buffers:
+        pool.release(buffer)
+    assert pool.allocated == 3 and len(pool._free) == 1
+
+def run_workload(raid6, tmp_path, rounds):
+    '''
+    Save, verify, overwrite and rebuild files, the paths served by the buffer pools.
+    '''
+    path = str(tmp_path / "workload")
+    for i in range(rounds):
+        with open(path, "wb") as f:
+            f.write(os.urandom(3 * raid6.stripe_size + 1000))
+        raid6.save_data(path, name=f"file{i}")
+        raid6.overwrite(f"file{i}", 100, os.urandom(5000))
+        raid6.load_data(f"file{i}", out_path=path, verify=True)
+    fail_disks(raid6, [0, 3])
+    raid6.recover_disks()
+
+def test_pool_reuse(tmp_path):
+    '''
+    The buffers are allocated once and reused by the following operations
+    '''
+    raid6 = build_small_raid6(tmp_path / "disk")
+    # Concurrent prefetches would make the peak number of buffers in use vary between the runs
+    raid6.readahead_stripes = 1
+    run_workload(raid6, tmp_path, 2)
+    allocated = raid6.block_pool.allocated + raid6.stripe_pool.allocated
+    run_workload(raid6, tmp_path, 4)
+    assert raid6.block_pool.allocated + raid6.stripe_pool.allocated == allocated
+
+def benchmark(tmp_path, block_size=2**20, rounds=8):
+    '''
+    Compare the buffer allocations and the time of the workload with and without buffer reuse.
+    '''
+    from src.utils import RAID6Config, BufferPool
+    from src.raid6 import RAID6
+
+    for reuse in [False, True]:
+        config = RAID6Config(data_path=os.path.join(tmp_path, f"disk_{reuse}"), data_disks=4, block_size=block_size, disk_size=64 * block_size)
+        raid6 = RAID6(config)
+        if not reuse:
+            raid6.block_pool = BufferPool(raid6.block_size, max_free=0)
+            raid6.stripe_pool = BufferPool(raid6.stripe_size, max_free=0)
+        start = time.time()
+        run_workload(raid6, tmp_path, rounds)
+        allocated = raid6.block_pool.allocated * raid6.block_size + raid6.stripe_pool.allocated * raid6.stripe_size
+        print(f"reuse={reuse}: {allocated / 2**20:.1f} MiB of buffers allocated, {time.time() - start:.2f} s")
+
+if __name__ == "__main__":
+    import pathlib
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        benchmark(pathlib.Path(tmp_dir))
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+'''
+@File    : test_cache.py
+@Time    : 2026/10/19
+@Version : 0.1
+@License : TOADD
+@Desc    : Unit tests for the cache tier of the raid6 database
+'''
+
+import src
+import os
+import pytest
+from test_rebuild import write_random_file
+
+
+def build_cached_raid6(tmp_path, lines=4):
+    from src.utils import RAID6Config
+    from src.raid6 import RAID6
+
+    config = RAID6Config(data_path=str(tmp_path / "disk"), data_disks=4, block_size=4096, disk_size=64 * 4096,
+                         cache_path=str(tmp_path / "cache"), cache_size=lines * 4 * 4096)
+    return RAID6(config)
+
+def fail_reads(raid6):
+    def failed(*args):
+        raise AssertionError("The array was read")
+    for disk in raid6.disks:
+        disk.readv = failed
+        disk.readinto = failed
+
+def test_frequency_sketch():
+    '''
+    The estimate follows the accesses and fades with the aging
+    '''
+    from src.cache import FrequencySketch
+
+    sketch = FrequencySketch(16)
+    for _ in range(5):
+        sketch.increment(7)
+    sketch.increment(8)
+    assert sketch.estimate(7) >= 5 and sketch.estimate(8) >= 1
+    assert sketch.estimate(9) <= 1
+    for key in range(200):
+        sketch.increment(1000 + key)
+    assert sketch.estimate(7) < 5
+
+def test_cached_reads(tmp_path):
+    '''
+    A stripe read again is cached and then read without touching the array
+    '''
+    raid6 = build_cached_raid6(tmp_path)
+    data = write_random_file(tmp_path / "file", 10000)
+    raid6.save_data(str(tmp_path / "file"), name="file")
+    assert raid6.read_range("file", 0, 10000) == data
+    assert raid6.cache.stats()["cached"] == 0
+    assert raid6.read_range("file", 0, 10000) == data
+    assert raid6.cache.stats()["cached"] == 1
+
+    disks = list(raid6.disks)
+    fail_reads(raid6)
+    assert raid6.read_range("file", 100, 5000) == data[100:5100]
+    assert raid6.cache.stats()["hits"] == 1
+    for disk in disks:
+        del disk.readv, disk.readinto
+    raid6.close()
+
+def test_write_back(tmp_path):
+    '''
+    An overwrite of a cached stripe is destaged as a full stripe and survives a crash
+    '''
+    from src.raid6 import ParityCode
+
+    raid6 = build_cached_raid6(tmp_path)
+    data = write_random_file(tmp_path / "file", 10000)
+    raid6.save_data(str(tmp_path / "file"), name="file")
+    raid6.read_range("file", 0, 10000)
+    raid6.read_range("file", 0, 10000)
+    (stripe_idx, offset_list), = raid6.file2stripe["file"].items()
+
+    raid6.overwrite("file", 50, b"x" * 100)
+    new = data[:50] + b"x" * 100 + data[150:]
+    assert raid6.cache.dirty_stripes() == [stripe_idx]
+    assert raid6.read_range("file", 0, 10000) == new
+
+    # Crash before the write-back, the next run destages the dirty line
+    from src.utils import RAID6Config
+    from src.raid6 import RAID6
+    config = RAID6Config(data_path=str(tmp_path / "disk"), data_disks=4, block_size=4096, disk_size=64 * 4096)
+    assert bytes(RAID6(config)._read_stripe(stripe_idx, offset_list)) == data
+    restarted = build_cached_raid6(tmp_path)
+    assert restarted.cache.stats()["destaged"] == 1 and restarted.cache.dirty_stripes() == []
+    assert bytes(restarted._read_stripe(stripe_idx, offset_list)) == new
+    assert restarted.verify_stripe(stripe_idx) == ParityCode.ACCURATE
+    restarted.close()
+
+def test_invalidation(tmp_path):
+    '''
+    Another write to a stripe writes its dirty line back first
+    '''
+    from src.raid6 import ParityCode
+
+    raid6 = build_cached_raid6(tmp_path)
+    data = write_random_file(tmp_path / "file", 10000)
+    raid6.save_data(str(tmp_path / "file"), name="file")
+    raid6.read_range("file", 0, 10000)
+    raid6.read_range("file", 0, 10000)
+    (stripe_idx, _), = raid6.file2stripe["file"].items()
+    raid6.overwrite("file", 0, b"y")
+    other = write_random_file(tmp_path / "other", 3000)
+    raid6.save_data(str(tmp_path / "other"), name="other")
+    assert raid6.file2stripe["other"].keys() == {stripe_idx}
+    assert raid6.cache.dirty_stripes() == [] and raid6.cache.stats()["cached"] == 0
+    assert raid6.read_range("file", 0, 10000) == b"y" + data[1:]
+    assert raid6.read_range("other", 0, 3000) == other
+    assert raid6.verify_stripe(stripe_idx) == ParityCode.ACCURATE
+    raid6.close()
+
+def test_admission(tmp_path):
+    '''
+    A stripe only replaces a cached one accessed more often
+    '''
+    raid6 = build_cached_raid6(tmp_path, lines=1)
+    raid6.save_many([os.urandom(16384), os.urandom(16384)], names=["hot", "cold"])
+    for _ in range(5):
+        raid6.read_range("hot", 0, 100)
+    for _ in range(3):
+        raid6.read_range("cold", 0, 100)
+    hot, = raid6.file2stripe["hot"]
+    assert list(raid6.cache.lines) == [hot]
+    for _ in range(5):
+        raid6.read_range("cold", 0, 100)
+    cold, = raid6.file2stripe["cold"]
+    assert list(raid6.cache.lines) == [cold]
+    raid6.close()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+'''
+@File    : test_compaction.py
+@Time    : 2026/10/19
+@Version : 0.1
+@License : TOADD
+@Desc    : Unit tests for the fragment handling and the online compaction of the raid6 database
+'''
+
+import src
+import os
+import time
+import pytest
+from test_rebuild import build_small_raid6, fail_disks
+
+
+def churn(raid6, tmp_path):
+    '''
+    Fill every stripe with 4 files and delete 3 of them, so no stripe is empty
+    '''
+    files = {}
+    for i in range(raid6.stripe_num * 4):
+        files[f"f{i}"] = os.urandom(4000)
+    raid6.save_many(list(files.values()), names=list(files))
+    for i in range(raid6.stripe_num * 4):
+        if i % 4 != 0:
+            raid6.delete_data(f"f{i}")
+            del files[f"f{i}"]
+    return files
+
+def check_files(raid6, files):
+    for name, data in files.items():
+        assert raid6.read_range(name, 0, len(data)) == data
+    assert sum(free for free, _ in raid6.stripe_status) == raid6.left_size
+
+def test_save_fragmented(tmp_path):
+    '''
+    A file larger than the free space of any stripe is spread over the fragments
+    '''
+    raid6 = build_small_raid6(tmp_path / "disk")
+    files = churn(raid6, tmp_path)
+    assert raid6.stripe_status[-1][0] < raid6.stripe_size
+
+    path = str(tmp_path / "large")
+    files["large"] = os.urandom(100000)
+    with open(path, "wb") as f:
+        f.write(files["large"])
+    raid6.save_data(path, name="large")
+    check_files(raid6, files)
+
+def test_merge_fragment(tmp_path):
+    raid6 = build_small_raid6(tmp_path / "disk")
+    raid6.stripe2file[0] = {8000: [None, 8384], 0: [None, 4000], 4000: ["a", 1000], 5000: [None, 3000]}
+    raid6._merge_fragment(0)
+    assert raid6.stripe2file[0] == {0: [None, 4000], 4000: ["a", 1000], 5000: [None, 11384]}
+
+def test_compact(tmp_path):
+    '''
+    Compaction frees the sparse stripes and keeps the data and parity intact
+    '''
+    from src.compactor import Compactor
+
+    raid6 = build_small_raid6(tmp_path / "disk")
+    files = churn(raid6, tmp_path)
+    compactor = Compactor(raid6, sparse_ratio=0.5, batch_stripes=8)
+    total_freed = 0
+    while True:
+        freed, moved = compactor.compact_once()
+        if freed == 0:
+            break
+        total_freed += freed
+        check_files(raid6, files)
+    empty = sum(1 for free, _ in raid6.stripe_status if free == raid6.stripe_size)
+    assert total_freed > 0
+    assert empty >= raid6.stripe_num * 3 // 4 - 2
+
+    fail_disks(raid6, [0, 3])
+    raid6.recover_disks()
+    check_files(raid6, files)
+    for name in files:
+        raid6.load_data(name, out_path=str(tmp_path / "out"), verify=True)
+
+def test_compact_degraded(tmp_path):
+    '''
+    Compaction waits for the rebuild when a disk has failed
+    '''
+    from src.compactor import Compactor
+
+    raid6 = build_small_raid6(tmp_path / "disk")
+    files = churn(raid6, tmp_path)
+    before = {name: raid6.file2stripe.mapping(name) for name in files}
+    fail_disks(raid6, [2])
+    compactor = Compactor(raid6, sparse_ratio=0.5, batch_stripes=8)
+    assert compactor.compact_once() == (0, 0)
+    assert {name: raid6.file2stripe.mapping(name) for name in files} == before
+
+    raid6.recover_disks()
+    check_files(raid6, files)
+    freed, _ = compactor.compact_once()
+    assert freed > 0
+    check_files(raid6, files)
+    fail_disks(raid6, [0, 3])
+    raid6.recover_disks()
+    check_files(raid6, files)
+
+def test_background_compactor(tmp_path):
+    from src.compactor import Compactor
+
+    raid6 = build_small_raid6(tmp_path / "disk")
+    files = churn(raid6, tmp_path)
+    compactor = Compactor(raid6, interval=0.01, max_bytes_per_sec=10**9)
+    compactor.start()
+    try:
+        for i in range(20):
+            files[f"new{i}"] = os.urandom(3000)
+            raid6.save_many([files[f"new{i}"]], names=[f"new{i}"])
+            time.sleep(0.01)
+    finally:
+        compactor.stop()
+    check_files(raid6, files)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+'''
+@File    : test_compression.py
+@Time    : 2026/10/19
+@Version : 0.1
+@License : TOADD
+@Desc    : Unit tests for the inline compression of the raid6 database
+'''
+
+import src
+import os
+import asyncio
+import pytest
+from test_rebuild import build_small_raid6, write_random_file
+
+
+def write_text_file(path, lines):
+    data = "".join(f"{i},sensor-{i % 7},{i * 0.5:.1f},OK\n" for i in range(lines)).encode()
+    with open(path, "wb") as f:
+        f.write(data)
+    return data
+
+def stored_size(raid6, name):
+    return sum(size for offset_list in raid6.file2stripe[name].values() for _, size in offset_list)
+
+def test_choose_codec():
+    '''
+    Text is compressible, random bytes are not
+    '''
+    from src.compression import choose_codec
+
+    assert choose_codec(b"timestamp,value\n" * 10000) == "zlib"
+    assert choose_codec(os.urandom(500000), "lzma") is None
+    assert choose_codec(b"") is None
+
+@pytest.mark.parametrize("codec", ["zlib", "lzma"])
+def test_compressed_file(tmp_path, codec):
+    '''
+    A compressed file is stored in fewer bytes and read back whole or by range
+    '''
+    raid6 = build_small_raid6(tmp_path / "disk")
+    raid6.compression_chunk = 4096
+    path = str(tmp_path / "file")
+    data = write_text_file(path, 5000)
+    raid6.save_data(path, name="file", compression=codec)
+
+    info = raid6.compressed["file"]
+    assert info.codec == codec and len(info.chunk_sizes) == (len(data) + 4095) // 4096
+    assert stored_size(raid6, "file") * 3 < len(data)
+    assert raid6.get_file_size("file") == len(data)
+    for offset, size in [(0, len(data)), (100, 10), (4000, 200), (5000, 20000), (len(data) - 5, 100), (len(data), 10)]:
+        assert raid6.read_range("file", offset, size) == data[offset : offset + size]
+    with raid6.open_reader("file") as reader:
+        assert reader.read(4090, 10) == data[4090:4100]
+
+    raid6.load_data("file", out_path=path, verify=True)
+    with open(path, "rb") as f:
+        assert f.read() == data
+    with pytest.raises(ValueError):
+        raid6.overwrite("file", 0, b"x")
+    raid6.delete_data("file")
+    assert "file" not in raid6.compressed
+    assert raid6.left_size == raid6.stripe_num * raid6.stripe_size
+
+def test_auto_compression(tmp_path):
+    '''
+    In auto mode only the compressible files are compressed
+    '''
+    from src.utils import RAID6Config
+    from src.raid6 import RAID6
+    from src.async_raid6 import AsyncRAID6
+
+    config = RAID6Config(data_path=str(tmp_path / "disk"), data_disks=4, block_size=4096, disk_size=64 * 4096, compression="auto")
+    raid6 = RAID6(config)
+    path = str(tmp_path / "file")
+    random_data = write_random_file(path, 50000)
+    raid6.save_data(path, name="random")
+    text = write_text_file(path, 3000)
+    raid6.save_data(path, name="text")
+    raid6.save_data(path, name="raw", compression="none")
+    assert "random" not in raid6.compressed and "raw" not in raid6.compressed
+    assert raid6.compressed["text"].codec == "zlib"
+    assert raid6.read_range("random", 0, 50000) == random_data
+
+    async def run():
+        async with AsyncRAID6(raid6) as araid6:
+            assert await araid6.load_data("text") == text
+            assert await araid6.read_range("text", 777, 1000) == text[777:1777]
+    asyncio.run(run())
+    raid6.close()
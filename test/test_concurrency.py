@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+'''
+@File    : test_concurrency.py
+@Time    : 2026/10/19
+@Version : 0.1
+@License : TOADD
+@Desc    : Stress tests for the concurrent access of the raid6 database from multiple threads
+'''
+
+import src
+import os
+import random
+import threading
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from test_rebuild import build_small_raid6
+
+
+def test_rwlock():
+    '''
+    Readers share the lock, a writer excludes everyone and may re-enter as a reader
+    '''
+    from src.utils import RWLock
+
+    lock = RWLock()
+    lock.acquire_read()
+    lock.acquire_read()
+    acquired = threading.Event()
+
+    def writer():
+        with lock.write_locked():
+            with lock.read_locked():
+                acquired.set()
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    assert not acquired.wait(0.1)
+    lock.release_read()
+    lock.release_read()
+    thread.join(5)
+    assert acquired.is_set()
+
+def test_concurrent_mixed_workload(tmp_path):
+    '''
+    Save, load, read ranges and delete files from several threads and check the data integrity
+    '''
+    raid6 = build_small_raid6(tmp_path / "disk")
+    src_dir = tmp_path / "src"
+    src_dir.mkdir()
+
+    def worker(worker_id):
+        rng = random.Random(worker_id)
+        alive = {}
+        for i in range(30):
+            name = f"w{worker_id}_{i}"
+            data = os.urandom(rng.randint(1, 6000))
+            path = src_dir / name
+            with open(path, "wb") as f:
+                f.write(data)
+            raid6.save_data(str(path), name=name)
+            alive[name] = data
+
+            name = rng.choice(list(alive))
+            out_path = str(tmp_path / f"out_{worker_id}")
+            raid6.load_data(name, out_path=out_path)
+            with open(out_path, "rb") as f:
+                assert f.read() == alive[name]
+            offset = rng.randint(0, len(alive[name]))
+            assert raid6.read_range(name, offset, 100) == alive[name][offset:offset + 100]
+
+            if len(alive) > 3:
+                name = rng.choice(list(alive))
+                raid6.delete_data(name)
+                del alive[name]
+        return alive
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(worker, range(8)))
+
+    alive = {name: data for result in results for name, data in result.items()}
+    assert set(raid6.file2stripe) == set(alive)
+    for name, data in alive.items():
+        assert raid6.read_range(name, 0, len(data)) == data
+        raid6.load_data(name, out_path=str(tmp_path / "out"), verify=True)
+
+    # The allocator state matches the extents of the remaining files
+    used = sum(len(data) for data in alive.values())
+    assert raid6.left_size == raid6.stripe_num * raid6.stripe_size - used
+    assert sum(free for free, _ in raid6.stripe_status) == raid6.left_size
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+'''
+@File    : test_dedup.py
+@Time    : 2026/10/19
+@Version : 0.1
+@License : TOADD
+@Desc    : Unit tests for the content-addressed deduplication of the raid6 database
+'''
+
+import src
+import os
+import pytest
+
+
+def build_dedup_raid6(data_path, chunking="cdc"):
+    from src.utils import RAID6Config
+    from src.raid6 import RAID6
+
+    config = RAID6Config(data_path=str(data_path), data_disks=4, block_size=4096, disk_size=128 * 4096,
+                         dedup=True, dedup_chunk=2048, dedup_chunking=chunking)
+    return RAID6(config)
+
+def stored_bytes(raid6):
+    return raid6.stripe_num * raid6.stripe_size - raid6.left_size
+
+def test_chunking():
+    '''
+    The chunks cover the data, content-defined boundaries survive an insertion
+    '''
+    from src.dedup import cdc_chunks, fixed_chunks
+
+    data = os.urandom(200000)
+    assert fixed_chunks(data, 4096)[-1] == (196608, 200000)
+    chunks = cdc_chunks(data, 4096)
+    assert chunks[0][0] == 0 and chunks[-1][1] == len(data)
+    assert all(a[1] == b[0] for a, b in zip(chunks, chunks[1:]))
+    assert all(1024 <= end - start <= 16384 for start, end in chunks[:-1])
+    assert 20 < len(chunks) < 100
+
+    shifted = cdc_chunks(data[:1000] + b"inserted" + data[1000:], 4096)
+    before = set(data[start:end] for start, end in chunks)
+    after = set((data[:1000] + b"inserted" + data[1000:])[start:end] for start, end in shifted)
+    assert len(before & after) >= len(chunks) - 2
+
+def test_dedup_index(tmp_path):
+    '''
+    Chunks are found by digest, removed, reused and persisted across a rehash
+    '''
+    from src.dedup import DedupIndex, chunk_key
+
+    path = str(tmp_path / "index.npz")
+    index = DedupIndex(path, capacity=16)
+    keys = [chunk_key(str(i).encode()) for i in range(100)]
+    ids = [index.add(key, i + 1) for i, key in enumerate(keys)]
+    assert len(set(ids)) == 100 and len(index) == 100
+    assert all(index.lookup(key) == chunk_id for key, chunk_id in zip(keys, ids))
+    index.ref(ids[5])
+    index.ref(ids[5])
+    assert index.unref(ids[5]) == 1
+    index.remove(ids[7])
+    assert index.lookup(keys[7]) is None and index.lookup(keys[8]) == ids[8]
+    assert index.add(chunk_key(b"new"), 10) == ids[7]
+    index.save()
+
+    index = DedupIndex(path)
+    assert len(index) == 100 and index.lookup(keys[8]) == ids[8] and index.refs[ids[5]] == 1
+    assert index.lookup(chunk_key(b"new")) == ids[7] and index.sizes[ids[7]] == 10
+
+@pytest.mark.parametrize("chunking", ["cdc", "fixed"])
+def test_dedup_files(tmp_path, chunking):
+    '''
+    Near-identical versions share their chunks, the chunks are freed with their last file
+    '''
+    raid6 = build_dedup_raid6(tmp_path / "disk", chunking)
+    path = str(tmp_path / "file")
+    base = os.urandom(100000)
+    versions = {
+        "v1": base,
+        "v2": base[:50000] + b"patch" * 3 + base[50015:],
+        "v3": base[:30000] + b"inserted" + base[30000:] if chunking == "cdc" else base + b"tail",
+        "copy": base,
+    }
+    for name, data in versions.items():
+        with open(path, "wb") as f:
+            f.write(data)
+        raid6.save_data(path, name=name)
+    assert stored_bytes(raid6) < 1.3 * len(base)
+    assert raid6.recipes["copy"].tolist() == raid6.recipes["v1"].tolist()
+
+    for name, data in versions.items():
+        assert raid6.get_file_size(name) == len(data)
+        assert raid6.read_range(name, 0, len(data)) == data
+        assert raid6.read_range(name, 29990, 5000) == data[29990:34990]
+        raid6.load_data(name, out_path=path, verify=True)
+        with open(path, "rb") as f:
+            assert f.read() == data
+    with pytest.raises(ValueError):
+        raid6.overwrite("v1", 0, b"x")
+
+    raid6.delete_data("v1")
+    raid6.delete_data("copy")
+    assert raid6.read_range("v2", 0, 100000) == versions["v2"]
+    raid6.delete_data("v2")
+    raid6.delete_data("v3")
+    assert raid6.left_size == raid6.stripe_num * raid6.stripe_size
+    assert len(raid6.dedup) == 0 and raid6.file2stripe == {}
+    raid6.close()
+
+def test_dedup_index_persistence(tmp_path):
+    '''
+    After a restart the index only keeps the chunks that are stored, the same data is written again and read back
+    '''
+    from src.dedup import DedupIndex
+
+    raid6 = build_dedup_raid6(tmp_path / "disk")
+    path = str(tmp_path / "file")
+    data = os.urandom(30000)
+    with open(path, "wb") as f:
+        f.write(data)
+    raid6.save_data(path, name="file")
+    count = len(raid6.dedup)
+    raid6.close()
+    assert len(DedupIndex(str(tmp_path / "disk" / "dedup_index.npz"))) == count
+
+    raid6 = build_dedup_raid6(tmp_path / "disk")
+    assert len(raid6.dedup) == 0
+    raid6.save_data(path, name="file")
+    assert len(raid6.dedup) == count
+    assert raid6.read_range("file", 0, len(data)) == data
+    raid6.save_data(path, name="copy")
+    assert len(raid6.dedup) == count
+    assert raid6.read_range("copy", 0, len(data)) == data
+    raid6.close()
+    assert len(build_dedup_raid6(tmp_path / "disk").dedup) == 0
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+'''
+@File    : test_discard.py
+@Time    : 2026/10/19
+@Version : 0.1
+@License : TOADD
+@Desc    : Unit tests for the discard of the freed space of the raid6 database
+'''
+
+import src
+import os
+import time
+import pytest
+from test_rebuild import build_small_raid6, fail_disks
+
+
+def block_data(raid6, stripe_idx, disk_idx):
+    return raid6.disks[disk_idx].read(stripe_idx * raid6.block_size, raid6.block_size)
+
+def test_punch_hole(tmp_path):
+    '''
+    A discarded range reads back as zeros, the rest of the disk is kept
+    '''
+    from src.utils import Disk
+
+    disk = Disk(str(tmp_path), 64 * 4096, id=0)
+    data = os.urandom(3 * 4096)
+    disk.write(0, data)
+    disk.discard(4096, 4096)
+    assert disk.read(0, 3 * 4096) == data[:4096] + bytes(4096) + data[8192:]
+    with pytest.raises(ValueError):
+        disk.discard(63 * 4096, 8192)
+
+def test_discard_freed(tmp_path):
+    '''
+    The data blocks freed as a whole are punched and no longer read, the parity follows
+    '''
+    from src.raid6 import ParityCode
+
+    raid6 = build_small_raid6(tmp_path / "disk")
+    datas = [os.urandom(5000), os.urandom(3000), os.urandom(16384)]
+    raid6.save_many(datas, names=["a", "b", "c"])
+    (stripe_idx, _), = raid6.file2stripe.mapping("a").items()
+    assert raid6.file2stripe["b"] == {stripe_idx: [(5000, 3000)]}
+    raid6.delete_data("a")
+    assert raid6.discard_pending == {stripe_idx}
+    assert raid6.zero_blocks[stripe_idx].tolist() == [False, False, True, True]
+
+    # Block 0 only held a, block 1 still holds b
+    assert raid6.discard_freed() == 1
+    _, data_disk_idxs = raid6._find_parity_PQ_idx(stripe_idx)
+    assert raid6.zero_blocks[stripe_idx].tolist() == [True, False, True, True]
+    assert block_data(raid6, stripe_idx, data_disk_idxs[0]) == bytes(raid6.block_size)
+    assert raid6.verify_stripe(stripe_idx) == ParityCode.ACCURATE
+    assert raid6.discard_pending == set() and raid6.discard_freed() == 0
+
+    # The punched block is not read by the rebuild
+    reads = []
+    readinto = raid6.disks[data_disk_idxs[0]].readinto
+    raid6.disks[data_disk_idxs[0]].readinto = lambda offset, buffer: reads.append(offset) or readinto(offset, buffer)
+    fail_disks(raid6, data_disk_idxs[1:3])
+    raid6.recover_disks()
+    assert stripe_idx * raid6.block_size not in reads
+    assert raid6.read_range("b", 0, 3000) == datas[1]
+    del raid6.disks[data_disk_idxs[0]].readinto
+
+    # A stripe left without data has zero parity
+    raid6.delete_data("b")
+    assert raid6.discard_freed() == 1
+    (p_idx, q_idx), _ = raid6._find_parity_PQ_idx(stripe_idx)
+    assert raid6.zero_blocks[stripe_idx].all()
+    assert block_data(raid6, stripe_idx, p_idx) == block_data(raid6, stripe_idx, q_idx) == bytes(raid6.block_size)
+    assert raid6.verify_stripe(stripe_idx) == ParityCode.ACCURATE
+    assert raid6.read_range("c", 0, 16384) == datas[2]
+    raid6.close()
+
+def test_discard_deferred(tmp_path):
+    '''
+    A stripe with a failed disk is discarded after the rebuild, by the background discarder
+    '''
+    from src.discard import Discarder
+    from src.raid6 import ParityCode
+
+    raid6 = build_small_raid6(tmp_path / "disk")
+    raid6.save_many([os.urandom(16384), os.urandom(16384)], names=["a", "b"])
+    (stripe_idx, _), = raid6.file2stripe.mapping("a").items()
+    raid6.delete_data("a")
+    fail_disks(raid6, [0])
+    assert raid6.discard_freed() == 0 and raid6.discard_pending == {stripe_idx}
+
+    raid6.recover_disks()
+    discarder = Discarder(raid6, interval=0.01)
+    discarder.start()
+    for _ in range(500):
+        if len(raid6.discard_pending) == 0:
+            break
+        time.sleep(0.01)
+    discarder.stop()
+    assert raid6.zero_blocks[stripe_idx].all()
+    assert raid6.verify_stripe(stripe_idx) == ParityCode.ACCURATE
+    raid6.close()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+'''
+@File    : test_extents.py
+@Time    : 2026/10/19
+@Version : 0.1
+@License : TOADD
+@Desc    : Unit tests and benchmark for the extent tables of the raid6 database
+'''
+
+import src
+import os
+import random
+import time
+import tracemalloc
+import pytest
+from test_rebuild import build_small_raid6
+
+
+def test_file_table():
+    '''
+    The table keeps the dict interface, an assigned entry is persisted
+    '''
+    from src.extents import FileTable
+
+    table = FileTable(capacity=4)
+    table["a"] = {3: [(0, 100), (200, 50)], 5: []}
+    table["b"] = {1: [(10, 20)]}
+    assert table["a"] == {3: [(0, 100), (200, 50)], 5: []} and len(table) == 2
+    assert table["a"][3] == [(0, 100), (200, 50)] and 5 in table["a"] and 4 not in table["a"]
+    table["a"][3] += [(300, 10)]
+    assert table.size("a") == 160
+    assert table.locate("a", 90, 20) == [(3, [(90, 10), (200, 10)])]
+
+    # The rows left by the replaced files are reclaimed
+    for i in range(100):
+        table["b"] = {i: [(i, i + 1)]}
+    assert table.used < 10 and table["b"] == {99: [(99, 100)]}
+    assert table.pop("a") == {3: [(0, 100), (200, 50), (300, 10)], 5: []}
+    assert "a" not in table and table == {"b": {99: [(99, 100)]}}
+    assert table.copy() == table
+
+def test_name_table_threads():
+    '''
+    Names interned and released by many threads keep unique ids and consistent references
+    '''
+    import threading
+    from src.extents import NameTable
+
+    table = NameTable()
+    shared = table.intern("shared")
+
+    def work(k):
+        for i in range(2000):
+            name_id = table.intern(f"t{k}-{i % 7}")
+            assert table.names[name_id] == f"t{k}-{i % 7}"
+            table.intern("shared")
+            table.release(name_id)
+            table.release(shared)
+
+    threads = [threading.Thread(target=work, args=(k,)) for k in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(table) == 1 and table.lookup("shared") == shared and table.refs[shared] == 1
+    assert sum(table.refs) == 1
+
+def test_stripe_table():
+    '''
+    The fragments are kept sorted and the free ones are merged
+    '''
+    from src.extents import StripeTable
+
+    table = StripeTable(2, 1000)
+    table[0] = {0: ["a", 100], 100: ["b", 100], 200: ["a", 100], 300: [None, 700]}
+    assert list(table[0]) == [0, 100, 200, 300]
+    assert table[0][100] == ["b", 100] and table[1] == {0: [None, 1000]}
+    table.free(0, 200, 100)
+    assert table[0] == {0: ["a", 100], 100: ["b", 100], 200: [None, 800]}
+    table.free(0, 0, 100)
+    table.free(0, 100, 100)
+    assert table[0] == {0: [None, 1000]}
+
+    # The id of a name is freed with its last fragment
+    assert len(table.names) == 0
+    table[1][500] = ["c", 0]
+    table[1][0] = [None, 500]
+    table[1][501] = [None, 0]
+    table.merge(1)
+    assert table[1] == {0: [None, 500], 500: ["c", 0]}
+
+def test_raid6_metadata(tmp_path):
+    '''
+    The tables of a RAID6 system follow the saves and deletions
+    '''
+    raid6 = build_small_raid6(tmp_path / "disk")
+    datas = [os.urandom(size) for size in [5000, 40000, 100]]
+    raid6.save_many(datas, names=["a", "b", "c"])
+    with open(tmp_path / "d", "wb") as f:
+        f.write(os.urandom(70000))
+    raid6.save_data(str(tmp_path / "d"), name="d")
+    assert raid6.get_file_size("b") == 40000
+    assert raid6.read_range("b", 12345, 20000) == datas[1][12345:32345]
+
+    for name in ["a", "b", "c", "d"]:
+        raid6.delete_data(name)
+    assert raid6.file2stripe == {} and len(raid6.names) == 0
+    assert all(stripe == {0: [None, raid6.stripe_size]} for stripe in raid6.stripe2file)
+    assert raid6.left_size == raid6.stripe_num * raid6.stripe_size
+    raid6.close()
+
+def extent_location(extent: int, stripe_extents: int, stripe_size: int):
+    '''
+    Place the extents in file order, stripe_extents of them packed into each stripe.
+    '''
+    size = stripe_size // stripe_extents
+    return extent // stripe_extents, extent % stripe_extents * size, size
+
+def build_dicts(files: int, file_extents: int, stripe_extents: int, stripe_size: int):
+    '''
+    Build the metadata of the files as the nested dicts and lists.
+    '''
+    file2stripe = {}
+    stripe2file = [{} for _ in range(-(-files * file_extents // stripe_extents))]
+    for file_idx in range(files):
+        name = f"file{file_idx}"
+        file2stripe[name] = {}
+        for extent in range(file_idx * file_extents, (file_idx + 1) * file_extents):
+            stripe_idx, offset, size = extent_location(extent, stripe_extents, stripe_size)
+            file2stripe[name].setdefault(stripe_idx, []).append((offset, size))
+            stripe2file[stripe_idx][offset] = [name, size]
+    return file2stripe, stripe2file
+
+def build_tables(files: int, file_extents: int, stripe_extents: int, stripe_size: int):
+    '''
+    Build the same metadata in the extent tables.
+    '''
+    from src.extents import FileTable, NameTable, StripeTable
+
+    names = NameTable()
+    file2stripe = FileTable(names)
+    stripe2file = StripeTable(-(-files * file_extents // stripe_extents), stripe_size, names)
+    for stripe_idx in range(len(stripe2file)):
+        stripe2file.clear(stripe_idx)
+    for file_idx in range(files):
+        name = f"file{file_idx}"
+        stripe_info = {}
+        for extent in range(file_idx * file_extents, (file_idx + 1) * file_extents):
+            stripe_idx, offset, size = extent_location(extent, stripe_extents, stripe_size)
+            stripe_info.setdefault(stripe_idx, []).append((offset, size))
+            stripe2file.set(stripe_idx, offset, name, size)
+        file2stripe[name] = stripe_info
+    return file2stripe, stripe2file
+
+def locate_dicts(file2stripe: dict, name: str, offset: int, size: int):
+    '''
+    Map a byte range of a file to its extents by walking the dicts, as RAID6 did before the tables.
+    '''
+    stripe2range, file_offset = [], 0
+    for stripe_idx, offset_list in file2stripe[name].items():
+        pieces = []
+        for extent_offset, extent_size in offset_list:
+            start, stop = max(offset, file_offset), min(offset + size, file_offset + extent_size)
+            if start < stop:
+                pieces.append((extent_offset + start - file_offset, stop - start))
+            file_offset += extent_size
+        if len(pieces) > 0:
+            stripe2range.append((stripe_idx, pieces))
+        if file_offset >= offset + size:
+            break
+    return stripe2range
+
+def benchmark(extents=10**7, file_extents=100, stripe_extents=8, lookups=10000, stripe_size=2**20):
+    '''
+    Compare the memory and the lookup time of the nested dicts and the extent tables at the same number of extents.
+    The memory is the size of the objects still allocated after the build.
+    '''
+    files = extents // file_extents
+    # The tables first, the dicts may not fit in memory
+    for kind, build in [("tables", build_tables), ("dicts", build_dicts)]:
+        tracemalloc.start()
+        start = time.time()
+        file2stripe, stripe2file = build(files, file_extents, stripe_extents, stripe_size)
+        build_time = time.time() - start
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        rng = random.Random(0)
+        file_size = file_extents * (stripe_size // stripe_extents)
+        queries = [(f"file{rng.randrange(files)}", rng.randrange(file_size), 2 * stripe_size) for _ in range(lookups)]
+        start = time.time()
+        for name, offset, size in queries:
+            if kind == "dicts":
+                locate_dicts(file2stripe, name, offset, size)
+            else:
+                file2stripe.locate(name, offset, size)
+        locate_time = (time.time() - start) / lookups
+        start = time.time()
+        for _ in range(lookups):
+            stripe2file[rng.randrange(len(stripe2file))].get(stripe_size // stripe_extents)
+        get_time = (time.time() - start) / lookups
+
+        print(f"{kind}: {extents} extents built in {build_time:.1f} s, {memory / 2**20:.0f} MiB ({memory / extents:.1f} B per extent), "
+              f"range lookup {locate_time * 1e6:.1f} us, fragment lookup {get_time * 1e6:.2f} us", flush=True)
+        del file2stripe, stripe2file
+
+if __name__ == "__main__":
+    benchmark()
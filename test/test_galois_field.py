@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+'''
+@File    : test_galois_field.py
+@Time    : 2026/10/19
+@Version : 0.1
+@License : TOADD
+@Desc    : Unit tests comparing the NumPy GF(2^8) engine with the C kernels
+'''
+
+import src
+import os
+import pytest
+from test_rebuild import build_small_raid6, fail_disks
+
+clib = pytest.importorskip("src.clib.galois_field")
+
+
+@pytest.mark.parametrize("width", [1, 2, 5, 8])
+@pytest.mark.parametrize("block_size", [8, 64, 4096])
+def test_parity_matches_c(width, block_size):
+    '''
+    The NumPy kernels give the same results as the C kernels
+    '''
+    from src import galois_field_np as gf_np
+
+    data = bytearray(os.urandom(width * block_size))
+    c_p, c_q, np_p, np_q = [bytearray(block_size) for _ in range(4)]
+    clib.cal_parity_8(c_p, c_q, data)
+    gf_np.cal_parity_8(np_p, np_q, data)
+    assert (c_p, c_q) == (np_p, np_q)
+
+    c_q, np_q = bytearray(block_size), bytearray(block_size)
+    clib.cal_parity_q_8(c_q, data)
+    gf_np.cal_parity_q_8(np_q, memoryview(data))
+    assert c_q == np_q
+
+    init = os.urandom(block_size)
+    c_p, np_p = bytearray(init), bytearray(init)
+    clib.cal_parity_p(c_p, data)
+    gf_np.cal_parity_p(np_p, data)
+    assert c_p == np_p
+
+    idxs = sorted(os.urandom(width)[i] % 200 for i in range(width))
+    c_q, np_q = bytearray(init), bytearray(init)
+    clib.cal_parity_q(c_q, data, idxs)
+    gf_np.cal_parity_q(np_q, data, idxs)
+    assert c_q == np_q
+
+    q, inter_q = os.urandom(block_size), os.urandom(block_size)
+    c_d, np_d = bytearray(block_size), bytearray(block_size)
+    clib.q_recover_data(c_d, q, inter_q, width)
+    gf_np.q_recover_data(np_d, q, inter_q, width)
+    assert c_d == np_d
+
+    p, inter_p = os.urandom(block_size), os.urandom(block_size)
+    c_d1, c_d2, np_d1, np_d2 = [bytearray(block_size) for _ in range(4)]
+    clib.recover_data_data(c_d1, c_d2, p, inter_p, q, inter_q, 1, width + 1)
+    gf_np.recover_data_data(np_d1, np_d2, p, inter_p, q, inter_q, 1, width + 1)
+    assert (c_d1, c_d2) == (np_d1, np_d2)
+
+@pytest.mark.parametrize("mask", [[1, 0, 0, 0], [0, 0, 1, 0], [0, 1, 0, 1], [0, 0, 0, 0], [1, 1, 1, 1]])
+def test_parity_mask(mask):
+    '''
+    The absent blocks count as zero without being read
+    '''
+    from src import galois_field_np as gf_np
+
+    block_size = 4096
+    data = bytearray(os.urandom(len(mask) * block_size))
+    zeroed = bytearray(data)
+    for i, present in enumerate(mask):
+        if not present:
+            zeroed[i * block_size : (i + 1) * block_size] = bytes(block_size)
+    p, q = bytearray(block_size), bytearray(block_size)
+    clib.cal_parity_8(p, q, zeroed)
+    for module in [clib, gf_np]:
+        mask_p, mask_q = bytearray(os.urandom(block_size)), bytearray(os.urandom(block_size))
+        module.cal_parity_8_mask(mask_p, mask_q, data, mask)
+        assert (mask_p, mask_q) == (p, q)
+
+@pytest.mark.parametrize("width, idx1, idx2", [(4, 0, 1), (6, 1, 4), (8, 0, 7)])
+def test_recover_batch(width, idx1, idx2):
+    '''
+    The batched kernels recover the two missing blocks of stripes of any column size
+    '''
+    from src import galois_field_np as gf_np
+
+    sizes = [4096, 8, 13, 4096 * 3 + 5]
+    stripes = [os.urandom(width * size) for size in sizes]
+    p, q, survivors = [], [], []
+    for size, stripe in zip(sizes, stripes):
+        p.append(bytearray(size))
+        q.append(bytearray(size))
+        gf_np.cal_parity_8(p[-1], q[-1], stripe)
+        survivors.append(b"".join(stripe[i * size : (i + 1) * size] for i in range(width) if i not in [idx1, idx2]))
+    for module in [clib, gf_np]:
+        data1 = [bytearray(size) for size in sizes]
+        data2 = [bytearray(size) for size in sizes]
+        module.recover_data_data_batch(data1, data2, p, q, survivors, width, idx1, idx2)
+        for k, (size, stripe) in enumerate(zip(sizes, stripes)):
+            assert data1[k] == stripe[idx1 * size : (idx1 + 1) * size]
+            assert data2[k] == stripe[idx2 * size : (idx2 + 1) * size]
+
+def test_raid6_with_numpy_engine(tmp_path, monkeypatch):
+    '''
+    Save, rebuild two failed data disks and load with the NumPy engine
+    '''
+    from src import galois_field_np as gf_np
+    import src.raid6
+
+    for name in ["cal_parity_8", "cal_parity_p", "cal_parity_q_8", "cal_parity_q", "q_recover_data", "recover_data_data_batch"]:
+        monkeypatch.setattr(src.raid6, name, getattr(gf_np, name))
+    raid6 = build_small_raid6(tmp_path / "disk")
+    path = str(tmp_path / "file")
+    with open(path, "wb") as f:
+        f.write(os.urandom(5 * raid6.stripe_size + 3000))
+    raid6.save_data(path, name="file")
+    with open(path, "rb") as f:
+        data = f.read()
+
+    for failed in [[0, 1], [2, 5]]:
+        fail_disks(raid6, failed)
+        raid6.recover_disks()
+        raid6.load_data("file", out_path=str(tmp_path / "out"), verify=True)
+        with open(tmp_path / "out", "rb") as f:
+            assert f.read() == data
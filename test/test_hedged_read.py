@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+'''
+@File    : test_hedged_read.py
+@Time    : 2026/10/19
+@Version : 0.1
+@License : TOADD
+@Desc    : Unit tests for the latency tracking, the hedged reads and the slow disk detection of the raid6 database
+'''
+
+import src
+import os
+import time
+import pytest
+from test_rebuild import build_small_raid6
+
+
+def test_latency_tracker():
+    '''
+    The EWMA follows the recent latencies and the percentiles cover the last window
+    '''
+    from src.utils import LatencyTracker
+
+    tracker = LatencyTracker(alpha=0.5, window=100)
+    for i in range(200):
+        tracker.record(i / 1000)
+    assert tracker.count == 200
+    assert tracker.ewma == pytest.approx(0.198, abs=1e-3)
+    assert tracker.percentile(50) == pytest.approx(0.150)
+    assert tracker.percentile(99) == pytest.approx(0.199)
+    assert tracker.stats()["p95"] == pytest.approx(0.195)
+
+def test_hedged_read(tmp_path):
+    '''
+    Reads from a slow disk are served by the reconstruction from P
+    '''
+    raid6 = build_small_raid6(tmp_path / "disk")
+    path = str(tmp_path / "file")
+    with open(path, "wb") as f:
+        f.write(os.urandom(10 * raid6.stripe_size + 1234))
+    raid6.save_data(path, name="file")
+    with open(path, "rb") as f:
+        data = f.read()
+
+    slow_disk = raid6.disks[1]
+    readv = slow_disk.readv
+    def slow_readv(pieces):
+        time.sleep(0.5)
+        return readv(pieces)
+    slow_disk.readv = slow_readv
+
+    start = time.time()
+    assert raid6.read_range("file", 0, len(data)) == data
+    assert time.time() - start < 3
+    assert slow_disk.latency.hedges > 0
+    raid6.load_data("file", out_path=str(tmp_path / "out"), verify=True)
+    with open(tmp_path / "out", "rb") as f:
+        assert f.read() == data
+
+    # Without hedging the slow disk is read directly
+    raid6.hedged_reads = False
+    hedges = slow_disk.latency.hedges
+    assert raid6.read_range("file", 0, 100) == data[:100]
+    assert slow_disk.latency.hedges == hedges
+    raid6.close()
+
+def test_slow_disk_detection(tmp_path):
+    '''
+    A disk consistently slower than the others is flagged
+    '''
+    raid6 = build_small_raid6(tmp_path / "disk")
+    assert raid6.slow_disks() == []
+    for disk_idx, disk in enumerate(raid6.disks):
+        for _ in range(50):
+            disk.latency.record(0.05 if disk_idx == 4 else 0.001)
+    assert raid6.slow_disks() == [4]
+    assert raid6.disk_latency_stats()[4]["p99"] == 0.05
+    raid6.check_disks_status()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+'''
+@File    : test_ingest.py
+@Time    : 2026/10/19
+@Version : 0.1
+@License : TOADD
+@Desc    : Unit tests for the multi-process bulk ingest of the raid6 database
+'''
+
+import src
+import os
+import pytest
+from test_rebuild import build_small_raid6, fail_disks
+
+
+def test_bulk_ingest(tmp_path):
+    '''
+    Ingest a batch of files with worker processes, then load and verify them
+    '''
+    from src.ingest import BulkIngestor
+
+    raid6 = build_small_raid6(tmp_path / "disk")
+    raid6.save_data(__file__, name="existing")
+
+    paths, datas = [], []
+    for i, size in enumerate([100, 5000, 16384, 40000, 3, 70000]):
+        path = str(tmp_path / f"file{i}")
+        data = os.urandom(size)
+        with open(path, "wb") as f:
+            f.write(data)
+        paths.append(path)
+        datas.append(data)
+
+    with BulkIngestor(raid6, processes=2, chunk_stripes=2) as ingestor:
+        ingestor.ingest(paths, names=[f"file{i}" for i in range(len(paths))])
+
+    for i, data in enumerate(datas):
+        out_path = str(tmp_path / "out")
+        raid6.load_data(f"file{i}", out_path=out_path, verify=True)
+        with open(out_path, "rb") as f:
+            assert f.read() == data
+
+    raid6.load_data("existing", out_path=str(tmp_path / "out"), verify=True)
+    with open(tmp_path / "out", "rb") as f, open(__file__, "rb") as g:
+        assert f.read() == g.read()
+
+    # Every stripe holding data has consistent parity, also for a rebuild
+    fail_disks(raid6, [0, 1])
+    raid6.recover_disks()
+    for i, data in enumerate(datas):
+        assert raid6.read_range(f"file{i}", 0, len(data)) == data
+
+def test_ingest_replaces(tmp_path):
+    '''
+    Ingesting an existing name replaces the old file and frees its extents
+    '''
+    from src.ingest import BulkIngestor
+
+    raid6 = build_small_raid6(tmp_path / "disk", compression="zlib")
+    path = str(tmp_path / "file")
+    with open(path, "wb") as f:
+        f.write(b"abc" * 5000)
+    raid6.save_data(path, name="a")
+    assert "a" in raid6.compressed
+    left_size = raid6.left_size + raid6.file2stripe.size("a")
+
+    data = os.urandom(5000)
+    with open(path, "wb") as f:
+        f.write(data)
+    with BulkIngestor(raid6, processes=1) as ingestor:
+        ingestor.ingest([path], names=["a"])
+    assert "a" not in raid6.compressed
+    assert raid6.read_range("a", 0, len(data)) == data
+    assert raid6.left_size == left_size - len(data)
+    assert raid6.left_size == sum(free for free, _ in raid6.stripe_status)
+
+def test_ingest_refused(tmp_path):
+    '''
+    A degraded array or a disk served from spare rows is not ingested into
+    '''
+    from src.ingest import BulkIngestor
+    from test_spare import build_spare_raid6
+
+    path = str(tmp_path / "file")
+    data = os.urandom(5000)
+    with open(path, "wb") as f:
+        f.write(data)
+
+    raid6 = build_small_raid6(tmp_path / "disk")
+    with BulkIngestor(raid6, processes=1) as ingestor:
+        fail_disks(raid6, [2])
+        with pytest.raises(ValueError):
+            ingestor.ingest([path], names=["a"])
+        raid6.recover_disks()
+        ingestor.ingest([path], names=["a"])
+    assert raid6.read_range("a", 0, 5000) == data
+
+    raid6, _ = build_spare_raid6(tmp_path / "spare", 1)
+    os.remove(raid6.disks[1].path)
+    raid6.check_disks_status()
+    raid6.recover_disks()
+    with pytest.raises(ValueError):
+        BulkIngestor(raid6, processes=1)
+    assert "a" not in raid6.file2stripe and raid6.left_size == raid6.stripe_num * raid6.stripe_size
+    raid6.close()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+'''
+@File    : test_overwrite.py
+@Time    : 2026/10/19
+@Version : 0.1
+@License : TOADD
+@Desc    : Unit tests for the in-place overwrite with delta parity of the raid6 database
+'''
+
+import src
+import os
+import random
+import pytest
+from test_rebuild import build_small_raid6, fail_disks
+
+
+@pytest.mark.parametrize("failed", [[0, 1], [2, 5]])
+def test_overwrite(tmp_path, failed):
+    '''
+    Patch small ranges of files in place, then verify the parity and rebuild from it
+    '''
+    raid6 = build_small_raid6(tmp_path / "disk")
+    rng = random.Random(1)
+    files = {}
+    for name, size in [("a", 3), ("b", 50000), ("c", 7001)]:
+        files[name] = bytearray(os.urandom(size))
+        raid6.save_many([bytes(files[name])], names=[name])
+    raid6.delete_data("c")
+    files["c"] = bytearray(os.urandom(9000))
+    raid6.save_many([bytes(files["c"])], names=["c"])
+
+    for _ in range(30):
+        name = rng.choice(list(files))
+        offset = rng.randint(0, len(files[name]) - 1)
+        patch = os.urandom(rng.randint(1, min(5000, len(files[name]) - offset)))
+        raid6.overwrite(name, offset, patch)
+        files[name][offset : offset + len(patch)] = patch
+
+    for name, data in files.items():
+        raid6.load_data(name, out_path=str(tmp_path / "out"), verify=True)
+        with open(tmp_path / "out", "rb") as f:
+            assert f.read() == data
+
+    fail_disks(raid6, failed)
+    raid6.recover_disks()
+    for name, data in files.items():
+        assert raid6.read_range(name, 0, len(data)) == data
+
+def test_overwrite_out_of_range(tmp_path):
+    raid6 = build_small_raid6(tmp_path / "disk")
+    raid6.save_many([b"0123456789"], names=["a"])
+    with pytest.raises(ValueError):
+        raid6.overwrite("a", 8, b"abc")
+    with pytest.raises(KeyError):
+        raid6.overwrite("b", 0, b"abc")
+    raid6.overwrite("a", 8, b"ab")
+    assert raid6.read_range("a", 0, 10) == b"01234567ab"
+
+def test_overwrite_degraded(tmp_path):
+    '''
+    A stripe with a failed disk is not patched in place, the parity stays consistent for the rebuild
+    '''
+    raid6 = build_small_raid6(tmp_path / "disk")
+    data = bytearray(os.urandom(16384))
+    raid6.save_many([bytes(data)], names=["a"])
+    fail_disks(raid6, [0])
+    with pytest.raises(ValueError):
+        raid6.overwrite("a", 10, b"x" * 100)
+
+    raid6.recover_disks()
+    assert raid6.read_range("a", 0, len(data)) == data
+    raid6.overwrite("a", 10, b"x" * 100)
+    data[10:110] = b"x" * 100
+    fail_disks(raid6, [0, 1])
+    raid6.recover_disks()
+    assert raid6.read_range("a", 0, len(data)) == data
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+'''
+@File    : test_qos.py
+@Time    : 2026/10/19
+@Version : 0.1
+@License : TOADD
+@Desc    : Unit tests for the I/O scheduling of the raid6 database
+'''
+
+import src
+import os
+import threading
+import time
+import pytest
+from test_rebuild import build_small_raid6, write_random_file, fail_disks
+
+
+def test_token_bucket():
+    '''
+    A request waits for the tokens it lacks
+    '''
+    from src.qos import TokenBucket
+
+    bucket = TokenBucket(1000)
+    assert bucket.delay(500) == 0
+    bucket.consume(1500)
+    assert 0.4 < bucket.delay(500) <= 1.0
+
+def test_priority_order():
+    '''
+    A waiting foreground request is dispatched before an earlier background one
+    '''
+    from src.qos import BACKGROUND, DiskScheduler, io_class
+
+    scheduler = DiskScheduler(depth=1)
+    release = threading.Event()
+    order = []
+
+    def submit(name, label):
+        with io_class(name):
+            scheduler.run(1, order.append, label)
+
+    blocker = threading.Thread(target=lambda: scheduler.run(1, release.wait))
+    blocker.start()
+    time.sleep(0.05)
+    background = threading.Thread(target=submit, args=(BACKGROUND, "background"))
+    background.start()
+    time.sleep(0.05)
+    foreground = threading.Thread(target=submit, args=("foreground", "foreground"))
+    foreground.start()
+    time.sleep(0.05)
+    release.set()
+    for thread in [blocker, background, foreground]:
+        thread.join()
+    assert order == ["foreground", "background"]
+    assert scheduler.stats[BACKGROUND]["requests"] == 1
+
+    with pytest.raises(ValueError):
+        with io_class("scrub"):
+            pass
+
+def test_background_rate():
+    '''
+    The background requests are held to the rate of their class
+    '''
+    from src.qos import BACKGROUND, DiskScheduler, io_class
+
+    scheduler = DiskScheduler(rates={BACKGROUND: 100000})
+    start = time.monotonic()
+    with io_class(BACKGROUND):
+        for _ in range(4):
+            scheduler.run(50000, lambda: None)
+    assert time.monotonic() - start >= 0.9
+    assert scheduler.stats[BACKGROUND]["bytes"] == 200000
+
+def test_rebuild_class(tmp_path):
+    '''
+    The rebuild I/O is accounted to the rebuild class, the reads of the user to the foreground
+    '''
+    raid6 = build_small_raid6(tmp_path / "disk", qos=True)
+    data = write_random_file(tmp_path / "file", 40000)
+    raid6.save_data(str(tmp_path / "file"), name="file")
+    fail_disks(raid6, [0, 1])
+    raid6.recover_disks()
+    assert raid6.read_range("file", 0, 40000) == data
+
+    stats = raid6.io_stats()
+    assert len(stats) == raid6.stripe_width
+    assert sum(disk["rebuild"]["requests"] for disk in stats) > 0
+    assert sum(disk["foreground"]["requests"] for disk in stats) > 0
+    assert sum(disk["background"]["requests"] for disk in stats) == 0
+
+    raid6.set_io_rate("rebuild", 10**6)
+    assert all(disk.scheduler.buckets["rebuild"].rate == 10**6 for disk in raid6.disks)
+    raid6.close()
+
+def test_foreground_throughput(tmp_path, monkeypatch):
+    '''
+    Without a rebuild the default configuration keeps the concurrent foreground reads of a disk in parallel,
+    the scheduler with qos_depth=1 runs them one at a time
+    '''
+    preadv = os.preadv
+    def slow_preadv(*args):
+        time.sleep(0.02)
+        return preadv(*args)
+
+    def elapsed(raid6):
+        data = os.urandom(1000)
+        raid6.save_many([data], names=["file"])
+        monkeypatch.setattr(os, "preadv", slow_preadv)
+        def read():
+            assert raid6.read_range("file", 0, 1000) == data
+        threads = [threading.Thread(target=read) for _ in range(8)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        monkeypatch.setattr(os, "preadv", preadv)
+        raid6.close()
+        return time.perf_counter() - start
+
+    # The hedged reads would race the slow reads against the reconstruction from P
+    raid6 = build_small_raid6(tmp_path / "disk", hedged_reads=False)
+    assert raid6.io_stats() == []
+    default = elapsed(raid6)
+    serialized = elapsed(build_small_raid6(tmp_path / "qos", hedged_reads=False, qos=True))
+    assert serialized >= 8 * 0.02 and default * 3 < serialized
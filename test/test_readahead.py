@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+'''
+@File    : test_readahead.py
+@Time    : 2026/10/19
+@Version : 0.1
+@License : TOADD
+@Desc    : Unit tests for the sequential readahead of the raid6 database
+'''
+
+import src
+import os
+import time
+import pytest
+from test_rebuild import build_small_raid6
+
+
+def save_striped_file(raid6, tmp_path, stripes):
+    path = str(tmp_path / "file")
+    with open(path, "wb") as f:
+        f.write(os.urandom(stripes * raid6.stripe_size - 100))
+    raid6.save_data(path, name="file")
+    with open(path, "rb") as f:
+        return f.read()
+
+def test_load_with_readahead(tmp_path):
+    '''
+    Streamed loads and sequential or random reads return the file data
+    '''
+    raid6 = build_small_raid6(tmp_path / "disk")
+    data = save_striped_file(raid6, tmp_path, 20)
+
+    raid6.load_data("file", out_path=str(tmp_path / "out"), verify=True)
+    with open(tmp_path / "out", "rb") as f:
+        assert f.read() == data
+
+    with raid6.open_reader("file") as reader:
+        chunks = [reader.read(offset, 5000) for offset in range(0, len(data), 5000)]
+        assert b"".join(chunks) == data
+        assert reader.hits + reader.waits > 0
+        assert reader.read(100, 1000) == data[100:1100]
+        assert reader.window == reader.min_window
+        assert reader.read(len(data) - 10, 100) == data[-10:]
+
+    with pytest.raises(KeyError):
+        raid6.open_reader("missing")
+
+def test_readahead_window(tmp_path):
+    '''
+    The window grows while the consumer waits for slow disks and shrinks for a slow consumer
+    '''
+    raid6 = build_small_raid6(tmp_path / "disk")
+    data = save_striped_file(raid6, tmp_path, 30)
+    read_stripe = raid6._read_stripe
+
+    def slow_read_stripe(*args, **kwargs):
+        time.sleep(0.02)
+        return read_stripe(*args, **kwargs)
+
+    raid6._read_stripe = slow_read_stripe
+    with raid6.open_reader("file") as reader:
+        assert b"".join(reader) == data
+        assert reader.window == reader.max_window
+    raid6._read_stripe = read_stripe
+
+    with raid6.open_reader("file") as reader:
+        reader.window = reader.max_window
+        chunks = []
+        for chunk in reader:
+            chunks.append(chunk)
+            time.sleep(0.02)
+        assert b"".join(chunks) == data
+        assert reader.window == reader.min_window
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+'''
+@File    : test_rebuild.py
+@Time    : 2026/10/19
+@Version : 0.1
+@License : TOADD
+@Desc    : Unit tests for the allocation-aware rebuild of the raid6 database
+'''
+
+import src
+import os
+import pytest
+
+
+def build_small_raid6(data_path, **kwargs):
+    from src.utils import RAID6Config
+    from src.raid6 import RAID6
+
+    config = RAID6Config(
+        data_path=str(data_path),
+        data_disks=4,
+        parity_disks=2,
+        block_size=4096,
+        disk_size=64*4096,
+        **kwargs
+        )
+    return RAID6(config)
+
+def write_random_file(path, size):
+    data = os.urandom(size)
+    with open(path, "wb") as f:
+        f.write(data)
+    return data
+
+def fail_disks(raid6, disk_idxs):
+    '''
+    Replace the disks with zero-filled ones and mark them as failed.
+    '''
+    for disk_idx in disk_idxs:
+        raid6.disks[disk_idx].init_new_disk(raid6.disks[disk_idx].path)
+        for stripe_idx in range(raid6.stripe_num):
+            raid6.status[stripe_idx][disk_idx] = False
+
+def test_live_ranges(tmp_path):
+    '''
+    The live ranges cover the allocated columns of every block in the stripe
+    '''
+    raid6 = build_small_raid6(tmp_path)
+    assert raid6._live_ranges(0) == []
+    raid6.stripe2file[0] = {0: [None, 5000], 5000: ["a", 3000], 8000: [None, 8384]}
+    assert raid6._live_ranges(0) == [(904, 3904)]
+    raid6.stripe2file[0] = {0: ["a", 4100], 4100: [None, 12284]}
+    assert raid6._live_ranges(0) == [(0, 4096)]
+
+@pytest.mark.parametrize("failed", [[0], [0, 1], [0, 4], [4, 5]])
+def test_rebuild_after_delete(tmp_path, failed):
+    '''
+    Rebuild a stripe holding stale deleted data next to a live file
+    '''
+    raid6 = build_small_raid6(tmp_path / "disk")
+    write_random_file(tmp_path / "a", 5000)
+    data = write_random_file(tmp_path / "b", 3000)
+    big = write_random_file(tmp_path / "c", 40000)
+    raid6.save_data(str(tmp_path / "a"), name="a")
+    raid6.save_data(str(tmp_path / "b"), name="b")
+    raid6.save_data(str(tmp_path / "c"), name="c")
+    raid6.delete_data("a")
+
+    fail_disks(raid6, failed)
+    raid6.recover_disks()
+
+    raid6.load_data("b", out_path=str(tmp_path / "b_out"), verify=True)
+    raid6.load_data("c", out_path=str(tmp_path / "c_out"), verify=True)
+    with open(tmp_path / "b_out", "rb") as f:
+        assert f.read() == data
+    with open(tmp_path / "c_out", "rb") as f:
+        assert f.read() == big
+
+def test_zero_blocks_not_read(tmp_path):
+    '''
+    The parity of a small file in a new stripe is computed without reading the free blocks
+    '''
+    from src.raid6 import ParityCode
+
+    raid6 = build_small_raid6(tmp_path / "disk")
+    reads = []
+    for disk in raid6.disks:
+        readinto = disk.readinto
+        disk.readinto = lambda offset, buffer, readinto=readinto: reads.append(offset) or readinto(offset, buffer)
+    data = write_random_file(tmp_path / "a", 3000)
+    raid6.save_data(str(tmp_path / "a"), name="a")
+    assert len(reads) == 1
+    assert raid6.zero_blocks[0].tolist() == [False, True, True, True]
+    assert raid6.verify_stripe(0) == ParityCode.ACCURATE
+
+    # A freed block holds stale data and is read again
+    raid6.delete_data("a")
+    write_random_file(tmp_path / "b", 5000)
+    raid6.save_data(str(tmp_path / "b"), name="b")
+    assert raid6.zero_blocks[0].tolist() == [False, False, True, True]
+    fail_disks(raid6, [0, 1])
+    raid6.recover_disks()
+    assert raid6.verify_stripe(0) == ParityCode.ACCURATE
+    raid6.close()
+
+def test_batched_rebuild(tmp_path, monkeypatch):
+    '''
+    The stripes missing the same two data blocks are rebuilt in batches
+    '''
+    import src.raid6
+    from src.raid6 import ParityCode
+
+    raid6 = build_small_raid6(tmp_path / "disk")
+    data = write_random_file(tmp_path / "a", 40 * raid6.stripe_size + 1000)
+    raid6.save_data(str(tmp_path / "a"), name="a")
+    batches = []
+    kernel = src.raid6.recover_data_data_batch
+    monkeypatch.setattr(src.raid6, "recover_data_data_batch", lambda *args: batches.append(len(args[0])) or kernel(*args))
+
+    fail_disks(raid6, [0, 1])
+    raid6.recover_disks()
+    # Disks 0 and 1 hold the first two data blocks of 20 of the 41 stripes
+    assert batches == [raid6.rebuild_batch, 20 - raid6.rebuild_batch]
+    assert all(raid6.verify_stripe(stripe_idx) == ParityCode.ACCURATE for stripe_idx in range(41))
+    raid6.load_data("a", out_path=str(tmp_path / "a_out"), verify=True)
+    with open(tmp_path / "a_out", "rb") as f:
+        assert f.read() == data
+    raid6.close()
+
+def test_verify_free_columns(tmp_path):
+    '''
+    Corrupted freed bytes in a live column are detected, a corrupted free column does not reach the rebuilt data
+    '''
+    from src.raid6 import ParityCode
+
+    raid6 = build_small_raid6(tmp_path / "disk")
+    datas = [os.urandom(5000), os.urandom(3000)]
+    raid6.save_many(datas, names=["a", "b"])
+    (stripe_idx, _), = raid6.file2stripe.mapping("a").items()
+    raid6.delete_data("a")
+    # b holds the columns 904 to 3904 of block 1, block 0 is free
+    assert raid6._live_ranges(stripe_idx) == [(904, 3904)]
+    _, data_disk_idxs = raid6._find_parity_PQ_idx(stripe_idx)
+    disk = raid6.disks[data_disk_idxs[0]]
+    base = stripe_idx * raid6.block_size
+
+    old = disk.read(base + 1000, 8)
+    disk.write(base + 1000, os.urandom(8))
+    assert raid6.verify_stripe(stripe_idx) == ParityCode.WRONG
+    disk.write(base + 1000, old)
+
+    disk.write(base + 100, os.urandom(8))
+    assert raid6.verify_stripe(stripe_idx) == ParityCode.ACCURATE
+    fail_disks(raid6, data_disk_idxs[1:3])
+    raid6.recover_disks()
+    assert raid6.read_range("b", 0, 3000) == datas[1]
+    assert raid6.verify_stripe(stripe_idx) == ParityCode.ACCURATE
+    raid6.close()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+'''
+@File    : test_remote_disk.py
+@Time    : 2026/10/19
+@Version : 0.1
+@License : TOADD
+@Desc    : Unit tests for the disks exported over TCP of the raid6 database
+'''
+
+import src
+import os
+import socket
+import pytest
+from test_rebuild import write_random_file
+from test_write_intent import parity_matches
+
+
+def start_servers(tmp_path, num, size):
+    from src.remote import BlockServer
+
+    return [BlockServer(str(tmp_path / f"node{i}"), size).start() for i in range(num)]
+
+def test_remote_disk(tmp_path):
+    '''
+    The remote disk reads and writes like a local one, batches and reuses its connections
+    '''
+    from src.remote import BlockServer, RemoteDisk
+
+    server = start_servers(tmp_path, 1, 8192)[0]
+    disk = RemoteDisk(server.address, 8192, 0, pool_size=1)
+    disk.write(100, b"hello")
+    assert disk.read(100, 5) == b"hello"
+    disk.writev([(0, b"abc"), (3, memoryview(b"def")), (4000, b"xyz")])
+    first, second, third = bytearray(2), bytearray(4), bytearray(3)
+    assert disk.readv([(4000, third), (0, first), (2, memoryview(second))])
+    assert (first, second, third) == (b"ab", b"cdef", b"xyz")
+    assert len(disk._pool) == 1
+    with pytest.raises(ValueError):
+        disk.read(8190, 10)
+    assert disk.check() and disk.latency.count == 2
+    disk.discard(1, 3)
+    assert disk.read(0, 6) == b"a\x00\x00\x00ef"
+
+    # A removed disk file fails the check, the node formats a new one
+    os.remove(server.path)
+    assert not disk.check()
+    disk.init_new_disk(disk.path)
+    assert disk.check() and disk.read(100, 5) == bytes(5)
+
+    # A restarted node is reconnected, an unreachable one fails the disk
+    server.stop()
+    server = BlockServer(server.path, 8192, port=int(server.address.rsplit(":", 1)[1])).start()
+    assert disk.read(100, 5) == bytes(5) and disk.status
+    server.stop()
+    disk.close()
+    assert disk.read(0, 10) is None and disk.status == False
+
+def test_remote_error_response(tmp_path, capsys):
+    '''
+    An error response fails the disk and its connection is closed, not returned to the pool
+    '''
+    from src.remote import RemoteDisk
+
+    server = start_servers(tmp_path, 1, 8192)[0]
+    disk = RemoteDisk(server.address, 16384, 0, pool_size=1)
+    assert capsys.readouterr().out == ""
+    assert disk.read(0, 5) == bytes(5) and len(disk._pool) == 1
+    pieces = [(0, bytearray(10)), (10000, bytearray(10)), (12000, bytearray(10))]
+    assert disk.readv(pieces) == False
+    assert disk.status == False and len(disk._pool) == 0
+    server.stop()
+
+def test_remote_timeout():
+    '''
+    A node that does not answer in time fails the disk
+    '''
+    from src.remote import RemoteDisk
+
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen()
+    disk = RemoteDisk("127.0.0.1:%d" % listener.getsockname()[1], 8192, 0, timeout=0.2)
+    assert not disk.readinto(0, bytearray(10))
+    assert disk.status == False
+    listener.close()
+
+@pytest.mark.parametrize("hedged", [True, False])
+def test_remote_raid6(tmp_path, hedged):
+    '''
+    A RAID6 system over six disk nodes stores, reads and rebuilds files
+    '''
+    from src.utils import RAID6Config
+    from src.raid6 import RAID6
+
+    servers = start_servers(tmp_path, 6, 64 * 4096)
+    config = RAID6Config(data_path=str(tmp_path / "disk"), data_disks=4, block_size=4096, disk_size=64 * 4096,
+                         disk_nodes=[server.address for server in servers], hedged_reads=hedged)
+    raid6 = RAID6(config)
+    path = str(tmp_path / "file")
+    data = write_random_file(path, 10 * raid6.stripe_size + 321)
+    raid6.save_data(path, name="file")
+    raid6.overwrite("file", 1000, b"x" * 5000)
+    data = data[:1000] + b"x" * 5000 + data[6000:]
+    assert raid6.read_range("file", 0, len(data)) == data
+    raid6.load_data("file", out_path=path, verify=True)
+    with open(path, "rb") as f:
+        assert f.read() == data
+
+    os.remove(servers[2].path)
+    os.remove(servers[5].path)
+    raid6.check_disks_status()
+    raid6.recover_disks()
+    assert raid6.read_range("file", 0, len(data)) == data
+    assert all(parity_matches(raid6, stripe_idx) for stripe_idx in raid6.file2stripe["file"])
+    raid6.close()
+    for server in servers:
+        server.stop()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+'''
+@File    : test_reshape.py
+@Time    : 2026/10/19
+@Version : 0.1
+@License : TOADD
+@Desc    : Unit tests for the online reshape of the raid6 database to more data disks
+'''
+
+import src
+import os
+import time
+import pytest
+from test_rebuild import build_small_raid6, fail_disks
+from test_write_intent import parity_matches
+
+
+def save_random_files(raid6, tmp_path, sizes):
+    files = {}
+    for i, size in enumerate(sizes):
+        path = str(tmp_path / f"file{i}")
+        with open(path, "wb") as f:
+            f.write(os.urandom(size))
+        raid6.save_data(path, name=f"file{i}")
+        with open(path, "rb") as f:
+            files[f"file{i}"] = f.read()
+    return files
+
+def test_online_reshape(tmp_path):
+    '''
+    Files stay readable and writable in both layouts during the reshape, the added capacity is usable afterwards
+    '''
+    from src.reshape import Reshaper
+
+    raid6 = build_small_raid6(tmp_path / "disk")
+    files = save_random_files(raid6, tmp_path, [100, 20000, 50000, 9000, 70000])
+    left_size = raid6.left_size
+
+    reshaper = Reshaper(raid6, new_data_disks=6, batch_stripes=5)
+    assert len(raid6.disks) == 8
+    reshaper.reshape_once()
+    reshaper.reshape_once()
+    assert raid6.reshape.position == 10
+    for name, data in files.items():
+        assert raid6.read_range(name, 0, len(data)) == data
+
+    # Writes go to the layout of their stripe
+    raid6.delete_data("file1")
+    del files["file1"]
+    path = str(tmp_path / "new")
+    with open(path, "wb") as f:
+        f.write(os.urandom(30000))
+    raid6.save_data(path, name="new")
+    with open(path, "rb") as f:
+        files["new"] = f.read()
+    raid6.overwrite("file2", 10, b"x" * 20000)
+    files["file2"] = files["file2"][:10] + b"x" * 20000 + files["file2"][20010:]
+
+    reshaper.start()
+    while not reshaper.done:
+        for name, data in files.items():
+            assert raid6.read_range(name, 0, len(data)) == data
+        time.sleep(0.01)
+    reshaper.stop()
+
+    assert raid6.stripe_size == 6 * raid6.block_size
+    assert raid6.left_size == left_size - 30000 + 20000 + 2 * raid6.block_size * raid6.stripe_num
+    assert sum(free for free, _ in raid6.stripe_status) == raid6.left_size
+    assert not os.path.exists(reshaper.state_path)
+    for stripe_idx in range(raid6.stripe_num):
+        assert parity_matches(raid6, stripe_idx)
+
+    with open(path, "wb") as f:
+        f.write(os.urandom(200000))
+    raid6.save_data(path, name="large")
+    with open(path, "rb") as f:
+        files["large"] = f.read()
+    fail_disks(raid6, [2, 7])
+    raid6.recover_disks()
+    for name, data in files.items():
+        assert raid6.read_range(name, 0, len(data)) == data
+        raid6.load_data(name, out_path=str(tmp_path / "out"), verify=True)
+
+def test_resume_interrupted_reshape(tmp_path):
+    '''
+    A batch interrupted in the middle of its rewrite is restored from the backup when the reshape resumes
+    '''
+    from src.reshape import Reshaper
+    from src.utils import RAID6Config
+    from src.raid6 import RAID6
+
+    raid6 = build_small_raid6(tmp_path / "disk")
+    save_random_files(raid6, tmp_path, [60000, 100000])
+    stripes = [raid6._load_stripes(stripe_idx)[2] for stripe_idx in range(raid6.stripe_num)]
+
+    reshaper = Reshaper(raid6, new_data_disks=5, batch_stripes=8)
+    reshaper.reshape_once()
+
+    # Crash after the backup of the second batch, with its rows half rewritten
+    start, end = 8, 16
+    with open(reshaper.backup_path, "wb") as f:
+        f.write(b"".join(stripes[start:end]))
+    raid6.reshape.batch_end = end
+    raid6.reshape.save(reshaper.state_path)
+    for disk in raid6.disks[:3]:
+        disk.write(start * raid6.block_size, os.urandom((end - start) * raid6.block_size))
+    raid6.close()
+
+    raid6 = build_small_raid6(tmp_path / "disk")
+    assert raid6.reshape.position == 8
+    reshaper = Reshaper(raid6, new_data_disks=5, batch_stripes=8)
+    assert raid6.reshape.position == 16
+    reshaper.run()
+    assert reshaper.done
+    for stripe_idx in range(raid6.stripe_num):
+        stripe_data = raid6._load_stripes(stripe_idx)[2]
+        assert stripe_data == stripes[stripe_idx] + bytes(raid6.block_size)
+        assert parity_matches(raid6, stripe_idx)
+
+    # The reshaped system is reopened with the new number of data disks
+    config = RAID6Config(data_path=str(tmp_path / "disk"), data_disks=5, parity_disks=2, block_size=4096, disk_size=64*4096)
+    with pytest.raises(ValueError):
+        Reshaper(RAID6(config), new_data_disks=5)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+'''
+@File    : test_save_many.py
+@Time    : 2026/10/19
+@Version : 0.1
+@License : TOADD
+@Desc    : Unit tests for the batched small object packing of the raid6 database
+'''
+
+import src
+import os
+import random
+import pytest
+from test_rebuild import build_small_raid6, fail_disks
+
+
+def test_pack_pieces(tmp_path):
+    '''
+    Best-fit decreasing packs the pieces into the minimal number of stripes here
+    '''
+    raid6 = build_small_raid6(tmp_path)
+    sizes = [9000, 7384, 8000, 8000, 16384, 1, 100]
+    bins = raid6._pack_pieces(sizes)
+    assert len(bins) == 3
+    assert sorted(i for bin_pieces in bins for i in bin_pieces) == list(range(len(sizes)))
+    for bin_pieces in bins:
+        assert sum(sizes[i] for i in bin_pieces) <= raid6.stripe_size
+
+def test_save_many(tmp_path):
+    '''
+    Save many small objects and a few larger ones in one batch
+    '''
+    raid6 = build_small_raid6(tmp_path / "disk")
+    rng = random.Random(0)
+    objects = [os.urandom(rng.randint(0, 4096)) for _ in range(60)]
+    objects.append(os.urandom(40000))
+    path = str(tmp_path / "file")
+    with open(path, "wb") as f:
+        f.write(os.urandom(20000))
+    names = [f"obj{i}" for i in range(len(objects))] + ["file"]
+
+    raid6.save_many(objects + [path], names=names)
+
+    with open(path, "rb") as f:
+        objects.append(f.read())
+    total = sum(len(data) for data in objects)
+    used_stripes = [i for i in range(raid6.stripe_num) if raid6._live_ranges(i)]
+    assert len(used_stripes) <= total // raid6.stripe_size + 2
+    assert raid6.left_size == raid6.stripe_num * raid6.stripe_size - total
+    assert sum(free for free, _ in raid6.stripe_status) == raid6.left_size
+
+    fail_disks(raid6, [1, 3])
+    raid6.recover_disks()
+    for name, data in zip(names, objects):
+        assert raid6.read_range(name, 0, len(data)) == data
+        raid6.load_data(name, out_path=str(tmp_path / "out"), verify=True)
+
+def test_save_many_overflow(tmp_path):
+    '''
+    The objects that do not fit into the empty stripes are saved one by one
+    '''
+    raid6 = build_small_raid6(tmp_path / "disk")
+    # Leave 4 empty stripes, the others have 6384 bytes free
+    raid6.save_many([os.urandom(10000) for _ in range(raid6.stripe_num - 4)], names=[f"big{i}" for i in range(raid6.stripe_num - 4)])
+
+    objects = [os.urandom(6000) for _ in range(10)]
+    names = [f"obj{i}" for i in range(len(objects))]
+    raid6.save_many(objects, names=names)
+    for name, data in zip(names, objects):
+        assert raid6.read_range(name, 0, len(data)) == data
+    assert raid6.left_size == sum(free for free, _ in raid6.stripe_status)
+
+def test_save_many_replaces(tmp_path):
+    '''
+    Saving a name again replaces the old file, compressed or not, and frees its extents
+    '''
+    from src.utils import RAID6Config
+    from src.raid6 import RAID6
+
+    raid6 = RAID6(RAID6Config(data_path=str(tmp_path / "disk"), data_disks=4, block_size=4096, disk_size=64 * 4096,
+                              compression="zlib"))
+    path = str(tmp_path / "file")
+    with open(path, "wb") as f:
+        f.write(b"abc" * 5000)
+    raid6.save_data(path, name="a")
+    assert "a" in raid6.compressed
+    left_size = raid6.left_size + raid6.file2stripe.size("a")
+
+    data = os.urandom(5000)
+    raid6.save_many([data], names=["a"])
+    assert "a" not in raid6.compressed
+    assert raid6.read_range("a", 0, len(data)) == data
+    assert raid6.left_size == left_size - len(data)
+
+    # The last object of a name saved twice in one batch wins
+    first, second = os.urandom(3000), os.urandom(7000)
+    raid6.save_many([first, second], names=["b", "b"])
+    assert raid6.read_range("b", 0, len(second)) == second
+    assert raid6.left_size == left_size - len(data) - len(second)
+    assert raid6.left_size == sum(free for free, _ in raid6.stripe_status)
+    raid6.close()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+'''
+@File    : test_snapshot.py
+@Time    : 2026/10/19
+@Version : 0.1
+@License : TOADD
+@Desc    : Unit tests for the copy-on-write snapshots and clones of the raid6 database
+'''
+
+import src
+import os
+import pytest
+from test_rebuild import build_small_raid6, write_random_file
+from test_compaction import churn, check_files
+from test_dedup import build_dedup_raid6
+
+
+def test_clone(tmp_path):
+    '''
+    A clone shares the extents of its source until one of them is written
+    '''
+    raid6 = build_small_raid6(tmp_path / "disk")
+    path = str(tmp_path / "file")
+    data = write_random_file(path, 50000)
+    raid6.save_data(path, name="file")
+    left_size = raid6.left_size
+
+    raid6.clone("file", "copy")
+    assert raid6.left_size == left_size
+    assert raid6.file2stripe["copy"] == raid6.file2stripe["file"]
+    assert raid6.read_range("copy", 0, 50000) == data
+    with pytest.raises(ValueError):
+        raid6.clone("file", "copy")
+
+    raid6.overwrite("copy", 20000, b"x" * 100)
+    assert raid6.read_range("file", 0, 50000) == data
+    assert raid6.read_range("copy", 0, 50000) == data[:20000] + b"x" * 100 + data[20100:]
+    assert raid6.extent_refs == {}
+    raid6.overwrite("copy", 0, b"y")
+    assert raid6.read_range("copy", 0, 1) == b"y"
+
+    raid6.clone("file", "copy2")
+    raid6.delete_data("file")
+    assert raid6.read_range("copy2", 0, 50000) == data
+    raid6.delete_data("copy2")
+    raid6.delete_data("copy")
+    assert raid6.left_size == raid6.stripe_num * raid6.stripe_size
+    assert raid6.extent_refs == {}
+
+def test_snapshot(tmp_path):
+    '''
+    A snapshot keeps the files as they were, its files are restored by cloning them
+    '''
+    raid6 = build_small_raid6(tmp_path / "disk")
+    path = str(tmp_path / "file")
+    old = write_random_file(path, 30000)
+    raid6.save_data(path, name="a")
+    kept = write_random_file(path, 9000)
+    raid6.save_data(path, name="b")
+    left_size = raid6.left_size
+    raid6.snapshot("s1")
+    assert raid6.left_size == left_size
+    with pytest.raises(ValueError):
+        raid6.snapshot("s1")
+
+    new = write_random_file(path, 40000)
+    raid6.modify_data("a", "a", path)
+    raid6.delete_data("b")
+    assert raid6.read_range("a", 0, 40000) == new
+    assert "b" not in raid6.file2stripe
+
+    raid6.clone("a", "a_old", snapshot="s1")
+    raid6.clone("b", "b", snapshot="s1")
+    assert raid6.read_range("a_old", 0, 30000) == old
+    assert raid6.read_range("b", 0, 9000) == kept
+    with pytest.raises(KeyError):
+        raid6.clone("c", "c", snapshot="s1")
+
+    raid6.delete_snapshot("s1")
+    for name in ["a", "a_old", "b"]:
+        raid6.delete_data(name)
+    assert raid6.left_size == raid6.stripe_num * raid6.stripe_size
+    assert raid6.extent_refs == {}
+
+def test_snapshot_dedup(tmp_path):
+    '''
+    The chunks of a deduplicated file deleted after a snapshot are registered again by a clone
+    '''
+    raid6 = build_dedup_raid6(tmp_path / "disk")
+    path = str(tmp_path / "file")
+    data = write_random_file(path, 20000)
+    raid6.save_data(path, name="file")
+    raid6.snapshot("s1")
+    raid6.delete_data("file")
+    assert len(raid6.dedup) == 0
+
+    raid6.clone("file", "file", snapshot="s1")
+    assert len(raid6.dedup) > 0
+    assert raid6.read_range("file", 0, 20000) == data
+    raid6.delete_snapshot("s1")
+    raid6.delete_data("file")
+    assert raid6.left_size == raid6.stripe_num * raid6.stripe_size
+    raid6.close()
+
+def test_compaction_skips_shared(tmp_path):
+    '''
+    The compaction does not move the extents of a snapshot
+    '''
+    from src.compactor import Compactor
+
+    raid6 = build_small_raid6(tmp_path / "disk")
+    files = churn(raid6, tmp_path)
+    raid6.snapshot("s1")
+    assert Compactor(raid6).compact_once() == (0, 0)
+    raid6.delete_snapshot("s1")
+    assert Compactor(raid6).compact_once()[0] > 0
+    check_files(raid6, files)
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+'''
+@File    : test_spare.py
+@Time    : 2026/10/19
+@Version : 0.1
+@License : TOADD
+@Desc    : Unit tests for the distributed spare rows, the declustered rebuild and the copy-back of the raid6 database
+'''
+
+import src
+import os
+import pytest
+from test_rebuild import write_random_file
+from test_write_intent import parity_matches
+
+
+def build_spare_raid6(data_path, spare_disks):
+    from src.utils import RAID6Config
+    from src.raid6 import RAID6
+
+    config = RAID6Config(
+        data_path=str(data_path),
+        data_disks=4,
+        parity_disks=2,
+        block_size=4096,
+        disk_size=64*4096,
+        spare_disks=spare_disks
+        )
+    return RAID6(config), config
+
+def check_files(raid6, files):
+    for name, data in files.items():
+        assert raid6.read_range(name, 0, len(data)) == data
+    for stripe_idx in range(raid6.stripe_num):
+        assert parity_matches(raid6, stripe_idx)
+
+def test_spare_rows(tmp_path):
+    '''
+    The last rows of every disk are reserved for the blocks of one failed disk
+    '''
+    raid6, _ = build_spare_raid6(tmp_path / "disk", 1)
+    assert raid6.spare_rows == 11 and raid6.stripe_num == 53
+    assert (raid6.stripe_width - 1) * raid6.spare_rows >= raid6.stripe_num
+
+def test_declustered_rebuild(tmp_path):
+    '''
+    The blocks of a failed disk are rebuilt in the spare rows of all the others, then copied back to its replacement
+    '''
+    from src.utils import Disk, SpareDisk
+    from src.spare import CopyBack
+
+    raid6, config = build_spare_raid6(tmp_path / "disk", 1)
+    path = str(tmp_path / "file")
+    files = {"a": write_random_file(path, 20 * raid6.stripe_size + 123)}
+    raid6.save_data(path, name="a")
+
+    os.remove(raid6.disks[1].path)
+    raid6.check_disks_status()
+    assert isinstance(raid6.disks[1], SpareDisk)
+    rows = raid6.spare.rows[1]
+    assert len(rows) == raid6.stripe_num
+    assert set(spare_disk for spare_disk, _ in rows.values()) == {0, 2, 3, 4, 5}
+    raid6.recover_disks()
+    assert not os.path.exists(raid6.disks[1].path)
+    check_files(raid6, files)
+
+    # The array keeps working on the spare rows, also after a restart
+    files["b"] = write_random_file(path, 3 * raid6.stripe_size + 77)
+    raid6.save_data(path, name="b")
+    raid6.overwrite("a", 5000, b"x" * 100)
+    files["a"] = files["a"][:5000] + b"x" * 100 + files["a"][5100:]
+    check_files(raid6, files)
+    raid6.close()
+    raid6 = build_spare_raid6(tmp_path / "disk", 1)[0]
+    assert isinstance(raid6.disks[1], SpareDisk) and raid6.disks[1].rows == rows
+
+    # Copy back to the replacement
+    raid6, _ = build_spare_raid6(tmp_path / "disk2", 1)
+    for name, data in files.items():
+        with open(path, "wb") as f:
+            f.write(data)
+        raid6.save_data(path, name=name)
+    os.remove(raid6.disks[1].path)
+    raid6.check_disks_status()
+    raid6.recover_disks()
+    with pytest.raises(ValueError):
+        CopyBack(raid6, 1)
+    raid6.replace_disk(1)
+    copy_back = CopyBack(raid6, 1, batch_stripes=16)
+    assert copy_back.copy_once() == 16
+    check_files(raid6, files)
+    copy_back.run()
+    assert copy_back.done
+    assert type(raid6.disks[1]) is Disk and raid6.spare.rows == {}
+    check_files(raid6, files)
+    raid6.close()
+
+def test_double_failure(tmp_path):
+    '''
+    A disk holding spare blocks fails, its own blocks and the spare blocks are rebuilt in the other spare rows
+    '''
+    raid6, _ = build_spare_raid6(tmp_path / "disk", 2)
+    path = str(tmp_path / "file")
+    files = {"a": write_random_file(path, 30 * raid6.stripe_size + 5)}
+    raid6.save_data(path, name="a")
+
+    os.remove(raid6.disks[0].path)
+    raid6.check_disks_status()
+    raid6.recover_disks()
+    os.remove(raid6.disks[3].path)
+    raid6.check_disks_status()
+    assert all(spare_disk not in [0, 3] for rows in raid6.spare.rows.values() for spare_disk, _ in rows.values())
+    for stripe_idx in range(raid6.stripe_num):
+        assert raid6.spare.rows[0][stripe_idx][0] != raid6.spare.rows[3][stripe_idx][0]
+    raid6.recover_disks()
+    check_files(raid6, files)
+
+    # No spare row is left for a third disk, it gets a replacement disk
+    os.remove(raid6.disks[5].path)
+    raid6.check_disks_status()
+    assert raid6.disks[5].path.endswith("_new") and 5 not in raid6.spare.rows
+    raid6.recover_disks()
+    check_files(raid6, files)
+    raid6.close()
+
+def test_failures_after_spare_rebuild(tmp_path):
+    '''
+    The stripes rebuilt in the spare rows are degraded, two more failures lose the stripes with a spare block
+    on a failed disk, the others are rebuilt and read back
+    '''
+    raid6, _ = build_spare_raid6(tmp_path / "disk", 1)
+    files = {f"f{i}": os.urandom(raid6.stripe_size) for i in range(raid6.stripe_num)}
+    raid6.save_many(list(files.values()), names=list(files))
+    os.remove(raid6.disks[1].path)
+    raid6.check_disks_status()
+    raid6.recover_disks()
+    assert raid6.degraded_stripes() == list(range(raid6.stripe_num))
+    check_files(raid6, files)
+
+    lost = sorted(stripe_idx for stripe_idx, (spare_disk, _) in raid6.spare.rows[1].items() if spare_disk in [2, 3])
+    assert 0 < len(lost) < raid6.stripe_num
+    os.remove(raid6.disks[2].path)
+    os.remove(raid6.disks[3].path)
+    raid6.check_disks_status()
+    with pytest.raises(ValueError):
+        raid6.recover_disks()
+    for name, data in files.items():
+        (stripe_idx, _), = raid6.file2stripe.mapping(name).items()
+        if stripe_idx in lost:
+            with pytest.raises(ValueError):
+                raid6.read_range(name, 0, len(data))
+        else:
+            assert raid6.read_range(name, 0, len(data)) == data
+            assert parity_matches(raid6, stripe_idx)
+    raid6.close()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+'''
+@File    : test_vectored_io.py
+@Time    : 2026/10/19
+@Version : 0.1
+@License : TOADD
+@Desc    : Unit tests for the vectored disk I/O of the raid6 database
+'''
+
+import src
+import os
+import pytest
+from test_rebuild import build_small_raid6, write_random_file, fail_disks
+
+
+def test_coalesce_pieces():
+    '''
+    Contiguous pieces are grouped into one run, in offset order
+    '''
+    from src.utils import coalesce_pieces
+
+    a, b, c, d = bytearray(10), bytearray(20), bytearray(5), bytearray(5)
+    runs = coalesce_pieces([(30, b), (100, d), (0, a), (10, c)])
+    assert [(offset, [len(buffer) for buffer in buffers]) for offset, buffers in runs] == [(0, [10, 5]), (30, [20]), (100, [5])]
+    runs = coalesce_pieces([(15, c), (0, a), (10, d), (20, b)])
+    assert [(offset, len(buffers)) for offset, buffers in runs] == [(0, 4)]
+
+def test_disk_readv_writev(tmp_path):
+    '''
+    The vectored calls read and write the same bytes as the per-piece calls
+    '''
+    from src.utils import Disk
+
+    disk = Disk(str(tmp_path), 4096, 0)
+    disk.writev([(100, b"hello"), (0, b"abc"), (105, memoryview(b"world"))])
+    assert disk.read(0, 3) == b"abc"
+    assert disk.read(100, 10) == b"helloworld"
+
+    first, second, third = bytearray(3), bytearray(5), bytearray(5)
+    assert disk.readv([(105, third), (0, first), (100, memoryview(second))])
+    assert (first, second, third) == (b"abc", b"hello", b"world")
+    with pytest.raises(ValueError):
+        disk.readv([(4090, bytearray(10))])
+
+@pytest.mark.parametrize("hedged", [True, False])
+def test_fragmented_file(tmp_path, hedged):
+    '''
+    A file spread over many holes of the stripes is written and read back with the vectored calls
+    '''
+    raid6 = build_small_raid6(tmp_path / "disk")
+    raid6.hedged_reads = hedged
+    path = str(tmp_path / "file")
+    for i in range(24):
+        write_random_file(path, 700)
+        raid6.save_data(path, name=f"small{i}")
+    for i in range(0, 24, 2):
+        raid6.delete_data(f"small{i}")
+
+    data = write_random_file(path, 12 * 700)
+    raid6.save_data(path, name="fragmented")
+    assert max(len(offset_list) for offset_list in raid6.file2stripe["fragmented"].values()) > 1
+    assert raid6.read_range("fragmented", 0, len(data)) == data
+    assert raid6.read_range("fragmented", 650, 3000) == data[650:3650]
+
+    raid6.overwrite("fragmented", 300, b"x" * 2000)
+    data = data[:300] + b"x" * 2000 + data[2300:]
+    raid6.load_data("fragmented", out_path=path, verify=True)
+    with open(path, "rb") as f:
+        assert f.read() == data
+
+    fail_disks(raid6, [1, 4])
+    raid6.recover_disks()
+    assert raid6.read_range("fragmented", 0, len(data)) == data
+    raid6.close()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+'''
+@File    : test_write_intent.py
+@Time    : 2026/10/19
+@Version : 0.1
+@License : TOADD
+@Desc    : Unit tests for the write-intent bitmap and the resync after a crash
+'''
+
+import src
+import os
+import pytest
+from test_rebuild import build_small_raid6
+
+
+def parity_matches(raid6, stripe_idx):
+    from src.galois_field import cal_parity_8
+
+    (p_idx, q_idx), data_disk_idxs = raid6._find_parity_PQ_idx(stripe_idx)
+    _, _, stripe_data, _ = raid6._load_stripes(stripe_idx, idxs=[p_idx, q_idx, data_disk_idxs])
+    p = bytearray(raid6.block_size)
+    q = bytearray(raid6.block_size)
+    cal_parity_8(p, q, stripe_data)
+    base = stripe_idx * raid6.block_size
+    return raid6.disks[p_idx].read(base, raid6.block_size) == p and raid6.disks[q_idx].read(base, raid6.block_size) == q
+
+def test_bitmap_persistence(tmp_path):
+    '''
+    A marked region is on disk at once, a finished one is only cleared in batches
+    '''
+    from src.utils import WriteIntentBitmap
+
+    path = str(tmp_path / "bitmap")
+    bitmap = WriteIntentBitmap(path, stripe_num=20, region_stripes=4, clear_batch=2)
+    bitmap.mark(5)
+    bitmap.mark(6)
+    bitmap.mark(13)
+    assert WriteIntentBitmap(path, 20, 4).dirty_regions() == [1, 3]
+    assert list(bitmap.region_to_stripes(4)) == [16, 17, 18, 19]
+
+    bitmap.clear(5)
+    bitmap.clear(13)
+    # Region 1 still has a write in flight
+    assert WriteIntentBitmap(path, 20, 4).dirty_regions() == [1, 3]
+    bitmap.clear(6)
+    assert WriteIntentBitmap(path, 20, 4).dirty_regions() == []
+    bitmap.mark(0)
+    bitmap.clear(0)
+    assert WriteIntentBitmap(path, 20, 4).dirty_regions() == [0]
+    bitmap.close()
+    assert WriteIntentBitmap(path, 20, 4).dirty_regions() == []
+
+def test_resync_after_crash(tmp_path):
+    '''
+    A stripe whose data was written without its parity is resynced on restart, clean stripes are not touched
+    '''
+    raid6 = build_small_raid6(tmp_path / "disk")
+    for i in range(4):
+        path = str(tmp_path / f"file{i}")
+        with open(path, "wb") as f:
+            f.write(os.urandom(10000))
+        raid6.save_data(path, name=f"file{i}")
+    raid6.close()
+
+    raid6 = build_small_raid6(tmp_path / "disk")
+    assert raid6.bitmap.dirty_regions() == []
+    # Crash between the data and the parity writes of stripe 3
+    raid6._mark_dirty(3)
+    (p_idx, q_idx), data_disk_idxs = raid6._find_parity_PQ_idx(3)
+    raid6.disks[data_disk_idxs[1]].write(3 * raid6.block_size, os.urandom(raid6.block_size))
+    assert not parity_matches(raid6, 3)
+
+    raid6 = build_small_raid6(tmp_path / "disk")
+    assert raid6.bitmap.dirty_regions() == []
+    for stripe_idx in range(raid6.stripe_num):
+        assert parity_matches(raid6, stripe_idx)
+    assert raid6.resync() == 0